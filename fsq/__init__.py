@@ -18,11 +18,16 @@ from exceptions import FSQError, FSQEnvError, FSQEncodeError,\
                        FSQMaxTriesError, FSQScanError, FSQDownError,\
                        FSQDoneError, FSQFailError, FSQTriggerPullError,\
                        FSQHostsError, FSQReenqueueError, FSQPushError, \
-                       FSQRemoteTriggerError
+                       FSQRemoteTriggerError, FSQWatchError,\
+                       FSQExpireError, FSQLeaseError
 
 # constants relies on: exceptions, internal
 import constants
 
+# instrument relies on: nothing
+import instrument
+from instrument import FSQTimings, add_hook, remove_hook
+
 # const relies on: constants, exceptions, internal
 from const import const, set_const # has tests
 
@@ -40,36 +45,51 @@ from configure import down, up, is_down, trigger, untrigger, trigger_pull,\
 # install relies on exceptions, path, constants, configure, internal, hosts
 from install import install, uninstall, install_host, uninstall_host # has tests
 
-# encode relies on: constants, exceptions, internal
+# codec relies on: constants, exceptions, internal
+from codec import FSQCodec, codec
+
+# encode relies on: constants, codec, internal
 from encode import encode, decode # has tests
 
-# construct relies on: constants, exceptions, encode, internal
+# construct relies on: constants, exceptions, codec, internal
 from construct import construct, deconstruct # has tests
 
+# lease relies on: constants, exceptions, path, construct, internal
+from lease import renew, reclaim
+
 # done relies on: constants, exceptions, path, internal, mkitem
-from done import done, success, fail, fail_tmp, fail_perm
+from done import done, success, fail, fail_tmp, fail_perm, success_many,\
+                 fail_many
 
 # items relies on: exceptions, constants, path, construct, internal
-from items import FSQWorkItem
+from items import FSQWorkItem, FSQEnqueueItem
 
-# enqueue relies on: constants, exceptions, path, internal, mkitem
-from enqueue import enqueue, senqueue, venqueue, vsenqueue, reenqueue,\
-                    sreenqueue, vreenqueue, vsreenqueue
+# enqueue relies on: constants, exceptions, path, internal, items
+from enqueue import enqueue, senqueue, venqueue, vsenqueue, enqueue_many,\
+                    senqueue_many, reenqueue, sreenqueue, vreenqueue,\
+                    vsreenqueue
 
-# scan relies on: exceptions, constants, path, items, configure, internal
-from scan import FSQScanGenerator, scan, scan_forever
+# watch relies on: exceptions, constants, path, internal
+from watch import FSQWatch
+
+# scan relies on: exceptions, constants, path, items, configure, internal,
+#                 watch
+from scan import FSQScanGenerator, FSQScanCursor, scan, scan_forever
 
 # remote.v1 relies on: enqueue
 import remote
 
 # push relies on: exceptions, constants, items and configure
-from push import push, remote_trigger_pull
+from push import push, push_many, remote_trigger_pull
 
-# utility relies on: exceptions, scan, enqueue and done
+# utility relies on: exceptions, scan, enqueue, done, internal and ratelimit
 from utility import fork_exec_items
 
 # ratelimit relies on: nothing
-from ratelimit import ratelimited, RatelimitedIterator
+from ratelimit import ratelimited, RatelimitedIterator, TokenBucket
+
+# retention relies on: constants, exceptions, internal, path, construct
+from retention import expire
 
 __all__ = [ 'FSQError', 'FSQEnvError', 'FSQEncodeError', 'FSQTimeFmtError',
             'FSQMalformedEntryError', 'FSQCoerceError', 'FSQEnqueueError',
@@ -79,13 +99,21 @@ __all__ = [ 'FSQError', 'FSQEnvError', 'FSQEncodeError', 'FSQTimeFmtError',
             'FSQTriggerPullError', 'FSQCannotLockError', 'FSQPathError',
             'path', 'constants', 'const', 'set_const', 'down', 'up',
             'is_down', 'trigger', 'untrigger', 'trigger_pull', 'install',
-            'uninstall', 'encode', 'decode', 'construct', 'deconstruct',
-            'enqueue', 'senqueue', 'venqueue', 'vsenqueue', 'success', 'fail',
-            'done', 'fail_tmp', 'fail_perm', 'FSQWorkItem',
-            'FSQScanGenerator', 'scan', 'scan_forever', 'install_host', 'FSQHostsError',
+            'uninstall', 'FSQCodec', 'codec', 'encode', 'decode',
+            'construct', 'deconstruct',
+            'enqueue', 'senqueue', 'venqueue', 'vsenqueue', 'enqueue_many',
+            'senqueue_many', 'success', 'fail', 'success_many', 'fail_many',
+            'done', 'fail_tmp', 'fail_perm', 'FSQWorkItem', 'FSQEnqueueItem',
+            'FSQScanGenerator', 'FSQScanCursor', 'scan', 'scan_forever',
+            'install_host', 'FSQHostsError',
             'hosts', 'down_host', 'up_host', 'host_is_down', 'host_trigger',
             'host_untrigger', 'host_trigger_pull', 'host_root',
             'uninstall_host', 'FSQReenqueueError', 'reenqueue', 'sreenqueue',
             'vreenqueue', 'vsreenqueue', 'remote', 'FSQPushError', 'push',
+            'push_many',
             'queues', 'fork_exec_items', 'ratelimited', 'RatelimitedIterator',
-            'FSQRemoteTriggerError', 'remote_trigger_pull', ]
+            'TokenBucket',
+            'FSQRemoteTriggerError', 'remote_trigger_pull', 'FSQWatchError',
+            'FSQWatch', 'instrument', 'FSQTimings', 'add_hook',
+            'remove_hook', 'FSQExpireError', 'expire',
+            'FSQLeaseError', 'renew', 'reclaim', ]
@@ -0,0 +1,156 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/codec.py -- provides compiled name codecs: FSQCodec, codec
+#
+#     fsq is all unicode internally, if you pass in strings,
+#     they will be explicitly coerced to unicode.
+#
+# This software is for POSIX compliant systems only.
+import errno
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from . import FSQEncodeError, constants as _c
+from .internal import coerce_unicode, delimiter_encodeseq
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+_ENCODED = (os.path.sep,)
+# ( delimiter, encodeseq, charset, ) -> FSQCodec
+_CODECS = {}
+# maximum number of deconstructed names cached per codec
+_CACHE_SIZE = 4096
+
+def _hex_encode(encodeseq, seq):
+    return u''.join([ encodeseq, u'{0:02x}'.format(ord(seq)) ])
+
+####### EXPOSED METHODS AND CLASSES #######
+class FSQCodec(object):
+    '''FSQCodec encodes, decodes, constructs and deconstructs queue-names for
+       a single delimiter, encodeseq and charset, validating the delimiter
+       and encodeseq once, on construction, rather than on each call.
+
+       Encoding is done with a translate table, and decoding and
+       deconstruction with compiled regular expressions.  Deconstructed names
+       are cached, least recently used names are evicted once the cache holds
+       cache_size names.  The cache is shared by every caller of the codec,
+       and is guarded by a lock, so that codecs may be used from many
+       threads.
+
+       Output is identical to the char-wise walk this replaces, including
+       errors raised.  Prefer the codec function to construct FSQCodecs, as
+       it returns the same object for the same arguments.'''
+    ####### MAGICAL METHODS AND ATTRS #######
+    def __init__(self, delimiter, encodeseq, charset, cache_size=_CACHE_SIZE):
+        self.delimiter, self.encodeseq = delimiter_encodeseq(delimiter,
+                                                             encodeseq,
+                                                             charset)
+        self.charset = charset
+        self.cache_size = cache_size
+        # name -> list of args, guarded by _lock
+        self.cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._table = dict(( ord(seq), _hex_encode(self.encodeseq, seq), )
+                           for seq in ( self.delimiter, self.encodeseq, ) +\
+                                      _ENCODED)
+        enc = re.escape(self.encodeseq)
+        # an encodeseq consumes the next two chars, whatever they are
+        self._decode_re = re.compile(u'{0}(.{{0,2}})'.format(enc),
+                                     re.DOTALL|re.UNICODE)
+        self._token_re = re.compile(u'{0}.{{0,2}}|({1})'.format(enc,
+                                    re.escape(self.delimiter)),
+                                    re.DOTALL|re.UNICODE)
+
+    ####### INTERNAL METHODS #######
+    def _decode_seq(self, match):
+        encoding_trg = u''.join([ u'0x', match.group(1) ])
+        if 4 != len(encoding_trg):
+            raise FSQEncodeError(errno.EINVAL, u'truncated encoding at end of'
+                                 u' argument: {0}'.format(encoding_trg))
+        try:
+            c = chr(int(encoding_trg, 16))
+        except ValueError:
+            raise FSQEncodeError(errno.EINVAL, u'invalid decode'\
+                                 u' target: {0}'.format(encoding_trg))
+        return coerce_unicode(c, self.charset)
+
+    ####### EXPOSED METHODS #######
+    def encode(self, arg, encoded=tuple()):
+        '''Encode a single (unicode) argument for the file-system'''
+        table = self._table
+        if encoded:
+            table = table.copy()
+            # validate encoded tuple
+            for enc in encoded:
+                u_enc = coerce_unicode(enc, self.charset)
+                try:
+                    u_enc.encode('ascii')
+                except UnicodeEncodeError:
+                    raise FSQEncodeError(errno.EINVAL, u'invalid encoded'\
+                                         u' value: {0} non-ascii'.format(
+                                         u_enc))
+                # only single chars are ever encoded
+                if isinstance(enc, basestring) and 1 == len(enc):
+                    table[ord(u_enc)] = _hex_encode(self.encodeseq, u_enc)
+        return arg.translate(table)
+
+    def decode(self, arg):
+        '''Decode a single (unicode) argument from the file-system'''
+        if self.encodeseq not in arg:
+            return arg
+        return self._decode_re.sub(self._decode_seq, arg)
+
+    def construct(self, args):
+        '''Construct a queue-name from a set of arguments'''
+        charset = self.charset
+        return u''.join([ self.delimiter, self.delimiter.join([
+                          coerce_unicode(arg, charset).translate(self._table)
+                          for arg in args ]) ])
+
+    def deconstruct(self, name):
+        '''Deconstruct a (unicode) queue-name, delimited by the delimiter of
+           this codec, to a list of arguments'''
+        with self._lock:
+            try:
+                # re-insert as most recently used
+                args = self.cache.pop(name)
+                self.cache[name] = args
+                return list(args)
+            except KeyError:
+                pass
+        body = name[1:]
+        # edge case, no args
+        if not body:
+            return []
+        elif self.encodeseq not in body:
+            args = body.split(self.delimiter)
+        else:
+            args = []
+            start = 0
+            for match in self._token_re.finditer(body):
+                if match.group(1) is not None:
+                    args.append(self.decode(body[start:match.start()]))
+                    start = match.end()
+            args.append(self.decode(body[start:]))
+        with self._lock:
+            # another thread may have cached name while we parsed it
+            if name not in self.cache and len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+            self.cache[name] = args
+        return list(args)
+
+def codec(delimiter=None, encodeseq=None, charset=None):
+    '''Return the FSQCodec for a delimiter, encodeseq and charset, defaulting
+       to the delimiter, encodeseq and charset taken from environment'''
+    key = ( _c.FSQ_DELIMITER if delimiter is None else delimiter,
+            _c.FSQ_ENCODE if encodeseq is None else encodeseq,
+            _c.FSQ_CHARSET if charset is None else charset, )
+    try:
+        return _CODECS[key]
+    except KeyError:
+        return _CODECS.setdefault(key, FSQCodec(*key))
+    except TypeError:
+        # unhashable, let FSQCodec raise
+        return FSQCodec(*key)
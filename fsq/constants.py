@@ -35,6 +35,13 @@ FSQ_TMP = coerce_unicode(os.environ.get("FSQ_TMP", u'tmp'), FSQ_CHARSET)
 FSQ_DOWN = coerce_unicode(os.environ.get("FSQ_DOWN", u'down'), FSQ_CHARSET)
 FSQ_TRIGGER = coerce_unicode(os.environ.get("FSQ_TRIGGER", u'trigger-s'),
                              FSQ_CHARSET)
+FSQ_RATE = coerce_unicode(os.environ.get("FSQ_RATE", u'rate'), FSQ_CHARSET)
+FSQ_CLAIMED = coerce_unicode(os.environ.get("FSQ_CLAIMED", u'claimed'),
+                             FSQ_CHARSET)
+FSQ_LANES = coerce_unicode(os.environ.get("FSQ_LANES", u'lanes'),
+                           FSQ_CHARSET)
+FSQ_SHARDS = coerce_unicode(os.environ.get("FSQ_SHARDS", u'shards'),
+                            FSQ_CHARSET)
 FSQ_ROOT = coerce_unicode(os.environ.get("FSQ_ROOT", u'/var/fsq'),
                           FSQ_CHARSET)
 FSQ_HOSTS = coerce_unicode(os.environ.get("FSQ_HOSTS", u'hosts'),
@@ -73,9 +80,19 @@ try:
     FSQ_USE_TRIGGER = int(os.environ.get("FSQ_USE_TRIGGER", 0))
     # get/respect exclusive locks on queue items
     FSQ_LOCK = int(os.environ.get("FSQ_LOCK", 1))
+    # lease (in seconds) on scanned items, in place of locks -- 0 is none
+    FSQ_LEASE = int(os.environ.get("FSQ_LEASE", 0))
     # max tries before tmp fails become permanant -- 0 is infinite
     FSQ_MAX_TRIES = int(os.environ.get("FSQ_MAX_TRIES", 1))
     # time-to-live (in seconds) for any queue item -- 0 is infinite
     FSQ_TTL = int(os.environ.get("FSQ_TTL", 0))
+    # scan re-checks down-files every N items -- 0 is never
+    FSQ_DOWN_EVERY = int(os.environ.get("FSQ_DOWN_EVERY", 1))
+    # scan re-checks down-files every N seconds -- 0 is never
+    FSQ_DOWN_INTERVAL = int(os.environ.get("FSQ_DOWN_INTERVAL", 0))
+    # watching scans re-list the whole queue every N seconds -- 0 is never
+    FSQ_WATCH_RESCAN = int(os.environ.get("FSQ_WATCH_RESCAN", 60))
+    # bytes read at a time when copying items that cannot be copied in-kernel
+    FSQ_COPY_BUFSIZE = int(os.environ.get("FSQ_COPY_BUFSIZE", 1048576))
 except ValueError, e:
     raise FSQEnvError(errno.EINVAL, e.message)
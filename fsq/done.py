@@ -3,7 +3,7 @@
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
 # fsq/done.py -- provides finishing functions: done, fail, fail_tmp,
-#                   fail_perm, retry
+#                   fail_perm, retry, success_many, fail_many
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
@@ -11,8 +11,88 @@
 # This software is for POSIX compliant systems only.
 import os
 from . import constants as _c, FSQDoneError, FSQFailError, FSQMaxTriesError,\
-              FSQEnqueueError, FSQTTLExpiredError, path as fsq_path, construct
-from .internal import wrap_io_os_err, check_ttl_max_tries, fmt_time
+              FSQEnqueueError, FSQTTLExpiredError, path as fsq_path, construct,\
+              instrument as _i
+from .internal import wrap_io_os_err, check_ttl_max_tries, fmt_time,\
+                      shard_op
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+def _layout(item):
+    '''Shard layout of the queue of a work item, read from the queue should
+       the item not carry it (see FSQWorkItem)'''
+    try:
+        return item.layout
+    except AttributeError:
+        return fsq_path.layout(item.queue)
+
+def _item_path(item, p_layout):
+    '''Path to a work item, in the claimed dir should the item be leased'''
+    claimed = getattr(item, 'claimed', None)
+    if claimed is None:
+        return fsq_path.item(item.queue, item.id, host=item.host,
+                             priority=getattr(item, 'priority', None),
+                             layout=p_layout)
+    return fsq_path.claimed_item(item.queue, claimed, host=item.host)
+
+def _fsync_dirs(dirs, exc):
+    '''fsync each directory in dirs, making renames into and out of them
+       durable'''
+    for dir_path in dirs:
+        try:
+            fd = os.open(dir_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except (OSError, IOError, ), e:
+            raise exc(e.errno, u'cannot fsync directory: {0}:'\
+                      u' {1}'.format(dir_path, wrap_io_os_err(e)))
+
+def _many(finish, items, trg_item, exc):
+    '''Finish each item, then fsync each queue directory (or shard), each
+       directory retried items were renamed into, and each directory of
+       trg_item touched, once.  Should finishing any item fail, the rest are
+       still finished, and exc is raised once all are, with the ids of the
+       items that failed as failed, and the ids returned for the rest as
+       item_ids.'''
+    dirs = set()
+    item_ids = []
+    # ( item id, error, ) for each item that failed to finish
+    failed = []
+    try:
+        for item in items:
+            try:
+                p_layout = _layout(item)
+                dirs.add(os.path.dirname(_item_path(item, p_layout)))
+                dirs.add(os.path.dirname(trg_item(item.queue, item.id,
+                                                  host=item.host,
+                                                  layout=p_layout)))
+            except AttributeError:
+                # DuckType TypeError'ing
+                raise TypeError(u'item must be an FSQWorkItem, not:'\
+                                u' {0}'.format(item.__class__.__name__))
+            try:
+                item_id = finish(item)
+            except (OSError, IOError, ), e:
+                failed.append(( item.id, e, ))
+                continue
+            if item_id != item.id:
+                # retried, and renamed into the queue (or lane)
+                dirs.add(os.path.dirname(fsq_path.item(item.queue, item_id,
+                         host=item.host, priority=getattr(item, 'priority',
+                         None), layout=p_layout)))
+            item_ids.append(item_id)
+    finally:
+        _fsync_dirs(dirs, exc)
+    if failed:
+        failed_ids = [ failed_id for failed_id, err in failed ]
+        e = exc(failed[0][1].errno, u'cannot finish {0} of {1} items: {2}:'\
+                u' {3}'.format(len(failed), len(failed) + len(item_ids),
+                u', '.join(failed_ids), wrap_io_os_err(failed[0][1])))
+        e.failed = failed_ids
+        e.item_ids = item_ids
+        raise e
+    return item_ids
 
 ####### EXPOSED METHODS #######
 def fail_tmp(item, max_tries=None, ttl=None):
@@ -30,8 +110,17 @@ def fail_tmp(item, max_tries=None, ttl=None):
                                _c.FSQ_CHARSET), item.entropy,
                                item.pid, item.hostname,
                                item.tries, ) + tuple(item.arguments))
-        os.rename(fsq_path.item(item.queue, item.id, host=item.host),
-				  fsq_path.item(item.queue, new_name, host=item.host))
+        started = _i.start()
+        p_layout = _layout(item)
+        # retries stay in their lane
+        shard_op(os.rename, _item_path(item, p_layout),
+                 fsq_path.item(item.queue, new_name, host=item.host,
+                               priority=getattr(item, 'priority', None),
+                               layout=p_layout))
+        _i.record(u'done.rename', item.queue, started)
+        # retrying releases any lease
+        if getattr(item, 'claimed', None) is not None:
+            item.claimed = None
         return new_name
     except (FSQMaxTriesError, FSQTTLExpiredError, FSQEnqueueError, ), e:
         fail_perm(item)
@@ -48,12 +137,16 @@ def fail_perm(item):
     item_id = item.id
     trg_queue = item.queue
     host = item.host
+    started = _i.start()
     try:
-        os.rename(fsq_path.item(trg_queue, item_id, host=host),
-                  os.path.join(fsq_path.fail(trg_queue, host=host), item_id))
+        p_layout = _layout(item)
+        shard_op(os.rename, _item_path(item, p_layout),
+                 fsq_path.fail_item(trg_queue, item_id, host=host,
+                                    layout=p_layout))
     except (OSError, IOError, ), e:
         raise FSQFailError(e.errno, u'cannot mv item to fail: {0}:'\
                            u' {1}'.format(item.id, wrap_io_os_err(e)))
+    _i.record(u'done.rename', trg_queue, started)
 
     return item.id
 
@@ -76,9 +169,13 @@ def success(item):
     try:
         # mv to done
         trg_queue = item.queue
-        os.rename(fsq_path.item(trg_queue, item.id, host=item.host),
-                  os.path.join(fsq_path.done(trg_queue, host=item.host),
-                               item.id))
+        started = _i.start()
+        p_layout = _layout(item)
+        shard_op(os.rename, _item_path(item, p_layout),
+                 fsq_path.done_item(trg_queue, item.id, host=item.host,
+                                    layout=p_layout))
+        _i.record(u'done.rename', trg_queue, started)
+        return item.id
     except AttributeError, e:
         # DuckType TypeError'ing
         raise TypeError(u'item must be an FSQWorkItem, not:'\
@@ -87,6 +184,24 @@ def success(item):
         raise FSQDoneError(e.errno, u'cannot mv item to done: {0}:'\
                            u' {1}'.format(item.id, wrap_io_os_err(e)))
 
+def success_many(items):
+    '''Successfully finish many items, then fsync the queue and done
+       directories of the items, once each, so that all renames are durable
+       on return.  Returns a list of item ids.'''
+    return _many(success, items, fsq_path.done_item, FSQDoneError)
+
+def fail_many(items, fail_type=None, max_tries=None, ttl=None):
+    '''Fail many items, either temporarily or permanently, then fsync the
+       queue and fail directories of the items, once each, so that all
+       renames are durable on return.  Returns a list of item ids (for
+       temporary failures, the retried item id).  Should any item fail to be
+       failed (e.g. a temporary failure escalated for max tries), every
+       other item is still failed, and FSQFailError is raised with the ids
+       of those items as failed.'''
+    return _many(lambda item: fail(item, fail_type=fail_type,
+                                   max_tries=max_tries, ttl=ttl), items,
+                 fsq_path.fail_item, FSQFailError)
+
 def retry(*args, **kwargs):
     '''Retry is a convenience alias for fail_tmp'''
     return fail_tmp(*args, **kwargs)
@@ -3,8 +3,8 @@
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
 # fsq/enqueue.py -- provides enqueueing functions: enqueue, senqueue,
-#                   venqueue, vsenqueue, reenqueue, sreenqueue, vreenqueue,
-#                   vsreenqueue
+#                   venqueue, vsenqueue, enqueue_many, senqueue_many,
+#                   reenqueue, sreenqueue, vreenqueue, vsreenqueue
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
@@ -12,41 +12,19 @@
 # This software is for POSIX compliant systems only.
 import errno
 import os
-import datetime
-import socket
-import select
 
 from cStringIO import StringIO
-from contextlib import closing
 
 from . import FSQEnqueueError, FSQCoerceError, FSQError, FSQReenqueueError,\
-              constants as _c, path as fsq_path, construct,\
-              hosts as fsq_hosts, FSQWorkItem
-from .internal import rationalize_file, wrap_io_os_err, fmt_time,\
-                      coerce_unicode, uid_gid
-
-# TODO: provide an internal/external streamable queue item object use that
-#       instead of this for the enqueue family of functions
-#       make a queue item from args, return a file
+              constants as _c, path as fsq_path, hosts as fsq_hosts,\
+              FSQWorkItem, FSQEnqueueItem, instrument as _i
+from .internal import rationalize_file, wrap_io_os_err, coerce_unicode,\
+                      shard_op
+from .fanout import fanout, sync
 
 ####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
-_HOSTNAME = socket.gethostname()
-_ENTROPY_PID = None
-_ENTROPY_TIME = None
-_ENTROPY_HOST = None
-_ENTROPY = 0
-
-# sacrifice a lot of complexity for a little statefullness
-def _mkentropy(pid, now, host):
-    global _ENTROPY_PID, _ENTROPY_TIME, _ENTROPY_HOST, _ENTROPY
-    if _ENTROPY_PID == pid and _ENTROPY_TIME == now and _ENTROPY_HOST == host:
-        _ENTROPY += 1
-    else:
-        _ENTROPY_PID = pid
-        _ENTROPY_TIME = now
-        _ENTROPY_HOST = host
-        _ENTROPY = 0
-    return _ENTROPY
+# max items enqueue_many holds open in tmp at once
+_BATCH_SIZE = 256
 
 def _formhostpath(args, hosts, all_hosts):
     path = []
@@ -79,6 +57,56 @@ def _unpack_args(item_f, src_queue, link, args):
             raise ValueError('Insufficient arguments')
     return item_f, src_queue, item_id , args, link
 
+def _mkbuffer(item_s, charset):
+    # we coerce here because StringIO.StringIO will coerce on file-write,
+    # and cStringIO.StringIO has a bug which injects NULs for unicode
+    if isinstance(item_s, unicode):
+        try:
+            item_s = item_s.encode(charset)
+        except UnicodeEncodeError:
+            raise FSQCoerceError(errno.EINVAL, u'cannot encode item with'\
+                                 u' charset {0}'.format(charset))
+    return StringIO(item_s)
+
+def _copy(src_file, item):
+    # flush anything already written, then write around the file object
+    started = _i.start()
+    item.item.flush()
+    fanout(src_file, [ item.item.fileno(), ])
+    _i.record(u'enqueue.write', item.queue, started)
+
+def _mkbatched(trg_queue, item_f, args, user, group, mode, priority,
+               p_layout):
+    # write an item to tmp, without syncing, for enqueue_many
+    try:
+        src_file = rationalize_file(item_f, _c.FSQ_CHARSET)
+    except (OSError, IOError, ), e:
+        raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+    try:
+        item = FSQEnqueueItem(trg_queue, *args, user=user, group=group,
+                              mode=mode, priority=priority, layout=p_layout)
+        try:
+            _copy(src_file, item)
+            item.item.flush()
+        except Exception, e:
+            item.abort()
+            if (isinstance(e, OSError) or isinstance(e, IOError)) and\
+                    not isinstance(e, FSQError):
+                raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+            raise e
+        return item
+    finally:
+        src_file.close()
+
+def _commit_batch(batch, item_ids):
+    # fsync each item in batch, then link each into the queue; batch is
+    # emptied as items are committed
+    for item in batch:
+        item.sync()
+    while batch:
+        item_ids.append(batch[0].commit())
+        batch.pop(0)
+
 ####### EXPOSED METHODS #######
 def enqueue(trg_queue, item_f, *args, **kwargs):
     '''Enqueue the contents of a file, or file-like object, file-descriptor or
@@ -94,7 +122,8 @@ def senqueue(trg_queue, item_s, *args, **kwargs):
     '''
     return vsenqueue(trg_queue, item_s, args, **kwargs)
 
-def venqueue(trg_queue, item_f, args, user=None, group=None, mode=None):
+def venqueue(trg_queue, item_f, args, user=None, group=None, mode=None,
+             priority=None):
     '''Enqueue the contents of a file, or file-like object, file-descriptor or
        the contents of a file at an address (e.g. '/my/file') queue with
        an argument list, venqueue is to enqueue what vprintf is to printf
@@ -102,96 +131,74 @@ def venqueue(trg_queue, item_f, args, user=None, group=None, mode=None):
        If entropy is passed in, failure on duplicates is raised to the caller,
        if entropy is not passed in, venqueue will increment entropy until it
        can create the queue item.
-    '''
-    # setup defaults
-    trg_fd = name = None
-    user = _c.FSQ_ITEM_USER if user is None else user
-    group = _c.FSQ_ITEM_GROUP if group is None else group
-    mode = _c.FSQ_ITEM_MODE if mode is None else mode
-    now = fmt_time(datetime.datetime.now(), _c.FSQ_TIMEFMT, _c.FSQ_CHARSET)
-    pid = coerce_unicode(os.getpid(), _c.FSQ_CHARSET)
-    host = coerce_unicode(_HOSTNAME, _c.FSQ_CHARSET)
-    tries = u'0'
-    entropy = _mkentropy(pid, now, host)
 
+       If priority is passed (and non-0), the item is enqueued to the lane of
+       priority; scan drains lanes of higher priority first.
+    '''
     # open source file
     try:
         src_file = rationalize_file(item_f, _c.FSQ_CHARSET)
     except (OSError, IOError, ), e:
         raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
     try:
-        real_file = True if hasattr(src_file, 'fileno') else False
-        # get low, so we can use some handy options; man 2 open
+        item = FSQEnqueueItem(trg_queue, *args, user=user, group=group,
+                              mode=mode, priority=priority)
         try:
-            item_name = construct(( now, entropy, pid, host,
-                                    tries, ) + tuple(args))
-            tmp_name = os.path.join(fsq_path.tmp(trg_queue), item_name)
-            trg_fd = os.open(tmp_name, os.O_WRONLY|os.O_CREAT|os.O_EXCL, mode)
-        except (OSError, IOError, ), e:
-            if isinstance(e, FSQError):
-                raise e
-            raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
-        try:
-            if user is not None or group is not None:
-                # set user/group ownership for file; man 2 fchown
-                os.fchown(trg_fd, *uid_gid(user, group, fd=trg_fd))
-            with closing(os.fdopen(trg_fd, 'wb', 1)) as trg_file:
-                # i/o time ... assume line-buffered
-                while True:
-                    if real_file:
-                        reads, dis, card = select.select([src_file], [], [])
-                        try:
-                            msg = os.read(reads[0].fileno(), 2048)
-                            if 0 == len(msg):
-                                break
-                        except (OSError, IOError, ), e:
-                            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN,):
-                                continue
-                            raise e
-                        trg_file.write(msg)
-                    else:
-                        line = src_file.readline()
-                        if not line:
-                            break
-                        trg_file.write(line)
-
-                # flush buffers, and force write to disk pre mv.
-                trg_file.flush()
-                os.fsync(trg_file.fileno())
-
-                # hard-link into queue, unlink tmp, failure case here leaves
-                # cruft in tmp, but no race condition into queue
-                os.link(tmp_name, os.path.join(fsq_path.item(trg_queue,
-                                                            item_name)))
-                os.unlink(tmp_name)
-
-                # return the queue item id (filename)
-                return item_name
+            _copy(src_file, item)
         except Exception, e:
-            try:
-                os.close(trg_fd)
-            except (OSError, IOError, ), err:
-                if err.errno != errno.EBADF:
-                    raise FSQEnqueueError(err.errno, wrap_io_os_err(err))
-            try:
-                if tmp_name is not None:
-                    os.unlink(tmp_name)
-            except (OSError, IOError, ), err:
-                if err.errno != errno.ENOENT:
-                   raise FSQEnqueueError(err.errno, wrap_io_os_err(err))
-            try:
-                if name is not None:
-                    os.unlink(name)
-            except OSError, err:
-                if err.errno != errno.ENOENT:
-                   raise FSQEnqueueError(err.errno, wrap_io_os_err(err))
+            item.abort()
             if (isinstance(e, OSError) or isinstance(e, IOError)) and\
                     not isinstance(e, FSQError):
                 raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
             raise e
+        # return the queue item id (filename)
+        return item.commit()
     finally:
         src_file.close()
 
+def enqueue_many(trg_queue, items, user=None, group=None, mode=None,
+                 priority=None):
+    '''Enqueue many files, or file-like objects, file-descriptors or files at
+       an address (e.g. '/my/file') with argument lists, from an iterable of
+       ( item_f, args, ) tuples, returning the list of item ids in order.
+
+       All items are written to tmp before any is fsync'd, and all are
+       fsync'd before any is linked into the queue, so the cost of syncing is
+       paid once per group rather than once per item.  Each item is still
+       linked into the queue atomically; should enqueue_many fail part way
+       through, items linked prior to the failure remain enqueued.  Should
+       priority be passed, every item is enqueued to the lane of priority.
+    '''
+    item_ids = []
+    batch = []
+    try:
+        # read the shard layout of the queue once, not once per item
+        p_layout = fsq_path.layout(trg_queue)
+        for item_f, args in items:
+            batch.append(_mkbatched(trg_queue, item_f, args, user, group,
+                                    mode, priority, p_layout))
+            if _BATCH_SIZE <= len(batch):
+                _commit_batch(batch, item_ids)
+        _commit_batch(batch, item_ids)
+    except Exception, e:
+        for item in batch:
+            item.abort()
+        if (isinstance(e, OSError) or isinstance(e, IOError)) and\
+                not isinstance(e, FSQError):
+            raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+        raise e
+
+    return item_ids
+
+def senqueue_many(trg_queue, items, **kwargs):
+    '''Enqueue many strings, or string-like objects with argument lists, from
+       an iterable of ( item_s, args, ) tuples, senqueue_many is to
+       enqueue_many what vsenqueue is to venqueue.
+    '''
+    charset = kwargs.pop('charset', _c.FSQ_CHARSET)
+    return enqueue_many(trg_queue, ( ( _mkbuffer(item_s, charset), args, )
+                                       for item_s, args in items ), **kwargs)
+
 def vsenqueue(trg_queue, item_s, args, **kwargs):
     '''Enqueue a string, or string-like object to queue with arbitrary
        arguments, vsenqueue is to venqueue what vsprintf is to vprintf,
@@ -201,16 +208,7 @@ def vsenqueue(trg_queue, item_s, args, **kwargs):
     if kwargs.has_key('charset'):
         del kwargs['charset']
 
-    # we coerce here because StringIO.StringIO will coerce on file-write,
-    # and cStringIO.StringIO has a bug which injects NULs for unicode
-    if isinstance(item_s, unicode):
-        try:
-            item_s = item_s.encode(charset)
-        except UnicodeEncodeError:
-            raise FSQCoerceError(errno.EINVAL, u'cannot encode item with'\
-                                 u' charset {0}'.format(charset))
-
-    return venqueue(trg_queue, StringIO(item_s), args, **kwargs)
+    return venqueue(trg_queue, _mkbuffer(item_s, charset), args, **kwargs)
 
 def reenqueue(item_f, *args, **kwargs):
     '''Enqueue the contents of a file, or file-like object, FSQWorkItem,
@@ -245,6 +243,11 @@ def vreenqueue(item_f, *args, **kwargs):
     link = kwargs.pop('link', False)
     hosts = kwargs.pop('hosts', None)
     all_hosts = kwargs.pop('all_hosts', False)
+    # a leased item has been renamed out of its queue, and an item with a
+    # priority is in its lane
+    claimed = getattr(item_f, 'claimed', None)
+    priority = getattr(item_f, 'priority', None)
+    src_layout = getattr(item_f, 'layout', None)
     item_f, src_queue, item_id, args, link = _unpack_args(item_f, src_queue,
                                                           link, args)
     if 1 < len(args):
@@ -255,7 +258,8 @@ def vreenqueue(item_f, *args, **kwargs):
         raise ValueError('Insufficient arguments')
     try:
         if item_f is None:
-            item_f = fsq_path.item(src_queue, item_id)
+            src_layout = fsq_path.layout(src_queue)
+            item_f = fsq_path.item(src_queue, item_id, layout=src_layout)
         if link:
             src_file = item_f
         else:
@@ -265,74 +269,95 @@ def vreenqueue(item_f, *args, **kwargs):
     tmp_names = []
     try:
         paths = _formhostpath(args, hosts, all_hosts)
+        # read the shard layout of each queue once
+        layouts = dict(( queue, fsq_path.layout(queue), )
+                       for queue in set(queue for queue, host in paths))
         if link:
             tmp_name = os.path.join(fsq_path.tmp(src_queue), item_id)
             # hard link directly to tmp
             try:
                 try:
-                    os.link(fsq_path.item(src_queue, item_id), tmp_name)
+                    os.link(fsq_path.item(src_queue, item_id,
+                            priority=priority, layout=src_layout) if\
+                            claimed is None else\
+                            fsq_path.claimed_item(src_queue, claimed),
+                            tmp_name)
                 except (OSError, IOError, ), e:
                     if not e.errno == errno.EEXIST:
                         raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
                 for queue, host in paths:
                     try:
-                        os.link(tmp_name, os.path.join(fsq_path.item(queue,
-                                                       item_id, host=host)))
+                        shard_op(os.link, tmp_name, fsq_path.item(queue,
+                                 item_id, host=host, layout=layouts[queue]))
                     except (OSError, IOError, ), e:
                         if not e.errno == errno.EEXIST:
                             raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
             finally:
                 os.unlink(tmp_name)
         else:
-            tmp_fos = []
+            # one tmp (and inode) per queue (or host queue), as work items
+            # are locked by inode; src_file is read once, into a staged tmp
+            # per file-system, and every other tmp on that file-system is
+            # cloned (or copied in-kernel) from its staged tmp
+            stages = []
+            by_dev = {}
+            for queue, host in paths:
+                tmp_dir = fsq_path.tmp(queue, host=host)
+                try:
+                    dev = os.stat(tmp_dir).st_dev
+                except (OSError, IOError, ), e:
+                    raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
+                if dev not in by_dev:
+                    by_dev[dev] = []
+                    stages.append(by_dev[dev])
+                by_dev[dev].append(( os.path.join(tmp_dir, item_id), queue,
+                                     host, ))
+            tmp_fds = []
             try:
-                for queue, host in paths:
-                    try:
-                        tmp_name = os.path.join(fsq_path.tmp(queue, host=host),
-                                                             item_id)
-                        tmp_names.append(tmp_name)
-                        # copy to n trg_queues
-                        tmp_fo = os.open(tmp_name, os.O_RDWR|os.O_CREAT|\
-                                               os.O_TRUNC, _c.FSQ_ITEM_MODE)
-                        tmp_fos.append(os.fdopen(tmp_fo, 'wb', 1))
-                    except Exception, e:
-                        raise FSQReenqueueError(wrap_io_os_err(e))
-                real_file = True if hasattr(src_file, 'fileno') else False
-                # read src_file once
-                while True:
-                    if real_file:
-                        reads, dis, card = select.select([src_file], [], [])
+                for targets in stages:
+                    for tmp_name, queue, host in targets:
                         try:
-                            chunk = os.read(reads[0].fileno(), 2048)
+                            tmp_names.append(tmp_name)
+                            # copy to n trg_queues
+                            tmp_fds.append(os.open(tmp_name, os.O_RDWR|\
+                                           os.O_CREAT|os.O_TRUNC,
+                                           _c.FSQ_ITEM_MODE))
+                        except Exception, e:
+                            raise FSQReenqueueError(wrap_io_os_err(e))
+                # ( staged fd, [ fd to clone, ... ], ) per file-system
+                staged = []
+                first = 0
+                for targets in stages:
+                    staged.append(( tmp_fds[first],
+                                    tmp_fds[first+1:first+len(targets)], ))
+                    first += len(targets)
+                # read src_file once (or not at all, if copied in-kernel)
+                fanout(src_file, [ fd for fd, clones in staged ])
+                for fd, clones in staged:
+                    if clones:
+                        os.lseek(fd, 0, os.SEEK_SET)
+                        fanout(fd, clones)
+                # force write to disk pre mv
+                sync(tmp_fds)
+                for targets in stages:
+                    for tmp_name, queue, host in targets:
+                        # hard-link into queue, unlink tmp, failure case here
+                        # leaves cruft in tmp, but no race condition into
+                        # queue
+                        try:
+                            shard_op(os.link, tmp_name, fsq_path.item(queue,
+                                     item_id, host=host,
+                                     layout=layouts[queue]))
                         except (OSError, IOError, ), e:
-                            if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN,):
-                                continue
-                            raise
-                    else:
-                        chunk = src_file.readline()
-                    if 0 == len(chunk):
-                        break
-                    for tmp_fo in tmp_fos:
-                        tmp_fo.write(chunk)
-                        # flush buffers, and force write to disk pre mv.
-                        tmp_fo.flush()
-                        os.fsync(tmp_fo.fileno())
-                for queue, host in paths:
-                    tmp_name = os.path.join(fsq_path.tmp(queue, host=host),
-                                                         item_id)
-                    # hard-link into queue, unlink tmp, failure case here
-                    # leaves cruft in tmp, but no race condition into queue
-                    try:
-                        os.link(tmp_name, os.path.join(fsq_path.item(queue,
-                                                       item_id, host=host)))
-                    except (OSError, IOError, ), e:
-                        if link and not e.errno == errno.EEXIST:
-                            raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
-                    finally:
-                        os.unlink(tmp_name)
+                            if not e.errno == errno.EEXIST:
+                                raise FSQReenqueueError(e.errno,
+                                                        wrap_io_os_err(e))
+                        finally:
+                            os.unlink(tmp_name)
+                            tmp_names.remove(tmp_name)
             finally:
-                for tmp_fo in tmp_fos:
-                    tmp_fo.close()
+                for tmp_fd in tmp_fds:
+                    os.close(tmp_fd)
         return item_id
     except Exception, e:
         try:
@@ -74,6 +74,10 @@ class FSQDownError(FSQScanError):
     '''Attempt to scan a down'ed queue'''
     pass
 
+class FSQWatchError(FSQScanError):
+    '''An error occured while trying to watch a queue for new items'''
+    pass
+
 class FSQDoneError(FSQError):
     '''Attempt to done/succeed an item failed'''
     pass
@@ -101,3 +105,11 @@ class FSQPushError(FSQError):
 class FSQRemoteTriggerError(FSQError):
     '''An error occured while triggering a queue on a remote server'''
     pass
+
+class FSQExpireError(FSQError):
+    '''An error occured while expiring done or failed items'''
+    pass
+
+class FSQLeaseError(FSQError):
+    '''An error occured while claiming, renewing or reclaiming a lease'''
+    pass
@@ -0,0 +1,193 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/fanout.py -- non-public copy engine, copying one source to many
+#                  targets: fanout, sync
+#
+#   NB: on Linux, regular files are copied in-kernel -- by reflink
+#       (FICLONE), copy_file_range(2) or sendfile(2), whichever the
+#       file-systems support -- falling back to large buffered copies.
+#       In-kernel copies and syncs of many targets run on threads.
+#
+# This software is for POSIX compliant systems only.
+import os
+import errno
+import fcntl
+import select
+import stat
+import threading
+import ctypes
+import ctypes.util
+
+from . import constants as _c
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# most bytes per in-kernel copy call, well under the 2GB linux limit
+_CHUNK = 1073741824
+# ioctl to share all extents of a file (man 2 ioctl_ficlone)
+_FICLONE = 0x40049409
+# most threads copying (or syncing) targets at once
+_THREADS = 16
+# errnos meaning a copy method is not supported for a pair of files
+_UNSUPPORTED = ( errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                 errno.ENOTTY, )
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+except OSError:
+    _LIBC = None
+
+def _bind(name, *argtypes):
+    fn = getattr(_LIBC, name, None)
+    if fn is not None:
+        fn.argtypes = list(argtypes)
+        fn.restype = ctypes.c_ssize_t
+    return fn
+
+# ssize_t copy_file_range(int, loff_t *, int, loff_t *, size_t, unsigned int)
+_copy_file_range = _bind('copy_file_range', ctypes.c_int,
+                         ctypes.POINTER(ctypes.c_int64), ctypes.c_int,
+                         ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t,
+                         ctypes.c_uint)
+# ssize_t sendfile64(int out_fd, int in_fd, off64_t *offset, size_t count)
+_sendfile = _bind('sendfile64', ctypes.c_int, ctypes.c_int,
+                  ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t)
+
+def _ficlone(src_fd, trg_fd, offset):
+    '''Reflink all of src_fd to trg_fd; only possible from offset 0, to an
+       empty trg_fd'''
+    if 0 != offset or 0 != os.lseek(trg_fd, 0, os.SEEK_CUR):
+        return False
+    try:
+        fcntl.ioctl(trg_fd, _FICLONE, src_fd)
+    except (OSError, IOError, ), e:
+        if e.errno in _UNSUPPORTED:
+            return False
+        raise e
+    # advance trg_fd, as the other methods would
+    os.lseek(trg_fd, 0, os.SEEK_END)
+    return True
+
+def _kcopy(call, src_fd, trg_fd, offset):
+    '''Copy src_fd from offset to EOF into trg_fd with an in-kernel copy call,
+       returning False if the call is not supported for these files'''
+    if call is None:
+        return False
+    off = ctypes.c_int64(offset)
+    copied = False
+    while True:
+        if call is _sendfile:
+            rv = call(trg_fd, src_fd, ctypes.byref(off), _CHUNK)
+        else:
+            rv = call(src_fd, ctypes.byref(off), trg_fd, None, _CHUNK, 0)
+        if 0 == rv:
+            return True
+        elif 0 < rv:
+            copied = True
+            continue
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            continue
+        elif not copied and err in _UNSUPPORTED:
+            return False
+        raise OSError(err, os.strerror(err))
+
+def _kernel(src_fd, trg_fd, offset):
+    '''Copy src_fd from offset to EOF into trg_fd in-kernel, if possible'''
+    return _ficlone(src_fd, trg_fd, offset) or\
+           _kcopy(_copy_file_range, src_fd, trg_fd, offset) or\
+           _kcopy(_sendfile, src_fd, trg_fd, offset)
+
+def _parallel(fn, arg_lists):
+    '''Call fn with each of arg_lists, up to _THREADS at once, returning the
+       results in order, and re-raising the first error raised'''
+    results = [ None ]*len(arg_lists)
+    if 1 >= len(arg_lists):
+        return [ fn(*args) for args in arg_lists ]
+    errors = []
+    def call(i, args):
+        try:
+            results[i] = fn(*args)
+        except Exception, e:
+            errors.append(e)
+    for start in xrange(0, len(arg_lists), _THREADS):
+        threads = [ threading.Thread(target=call, args=( i, args, ))
+                    for i, args in enumerate(arg_lists[start:start+_THREADS],
+                                             start) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+    return results
+
+def _write(trg_fd, chunk):
+    '''Write all of chunk to trg_fd'''
+    while chunk:
+        try:
+            chunk = chunk[os.write(trg_fd, chunk):]
+        except (OSError, IOError, ), e:
+            if e.errno != errno.EINTR:
+                raise e
+
+def _read(src_file, src_fd, bufsize, wait):
+    '''Read up to bufsize from src_fd (or src_file, if src_fd is None),
+       select'ing first should wait be True'''
+    if src_fd is None:
+        if hasattr(src_file, 'read'):
+            return src_file.read(bufsize)
+        return src_file.readline()
+    while True:
+        # regular files are always readable, only pipes and sockets wait
+        if wait:
+            select.select([src_fd], [], [])
+        try:
+            return os.read(src_fd, bufsize)
+        except (OSError, IOError, ), e:
+            if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN, errno.EINTR,):
+                raise e
+
+####### EXPOSED METHODS #######
+def fanout(src_file, trg_fds, bufsize=None):
+    '''Copy the remainder of src_file (a file, file-like object or file
+       descriptor) to each of the file-descriptors in trg_fds, reading at
+       most bufsize (default: FSQ_COPY_BUFSIZE) bytes at a time from
+       sources that cannot be copied in-kernel.  Nothing is flushed or
+       synced, callers should fsync each of trg_fds, once.'''
+    bufsize = _c.FSQ_COPY_BUFSIZE if bufsize is None else bufsize
+    if 1 > bufsize:
+        raise ValueError(u'bufsize must be at least 1, not'\
+                         u' {0}'.format(bufsize))
+    try:
+        src_fd = src_file.fileno() if hasattr(src_file, 'fileno') else None
+    except ValueError:
+        # file-likes with no real fd (e.g. tempfile.SpooledTemporaryFile)
+        src_fd = None
+    if isinstance(src_file, ( int, long, )):
+        src_fd = src_file
+    trg_fds = list(trg_fds)
+    regular = src_fd is not None and stat.S_ISREG(os.fstat(src_fd).st_mode)
+    if regular:
+        offset = os.lseek(src_fd, 0, os.SEEK_CUR)
+        # in-kernel copies read at their own offset, so may run at once
+        copied = _parallel(_kernel, [ ( src_fd, trg_fd, offset, )
+                                      for trg_fd in trg_fds ])
+        buffered = [ trg_fd for trg_fd, done in zip(trg_fds, copied)
+                     if not done ]
+        # in-kernel copies leave src_fd where it was, buffered copies
+        # read it to EOF
+        if not buffered:
+            os.lseek(src_fd, 0, os.SEEK_END)
+            return
+        trg_fds = buffered
+    while True:
+        chunk = _read(src_file, src_fd, bufsize, not regular)
+        if not chunk:
+            break
+        for trg_fd in trg_fds:
+            _write(trg_fd, chunk)
+
+def sync(fds):
+    '''fsync each of fds, at once'''
+    _parallel(os.fsync, [ ( fd, ) for fd in fds ])
@@ -73,6 +73,22 @@ def _remove_dir(path, tmp_full, trg_queue):
             raise e
         raise FSQInstallError(e.errno, wrap_io_os_err(e))
 
+def _instshards(trg_queue, p_layout, mode, uid, gid):
+    '''Record the shard layout of a queue in its shards file'''
+    shards_path = fsq_path.shards(trg_queue)
+    try:
+        fd = os.open(shards_path, os.O_CREAT|os.O_WRONLY|os.O_EXCL, mode)
+        try:
+            os.fchmod(fd, mode)
+            if -1 != uid or -1 != gid:
+                os.fchown(fd, uid, gid)
+            os.write(fd, u'{0}:{1}\n'.format(*p_layout).encode(
+                     _c.FSQ_CHARSET))
+        finally:
+            os.close(fd)
+    except (OSError, IOError, ), e:
+        raise FSQInstallError(e.errno, wrap_io_os_err(e))
+
 # setup default modes and users
 def _def_mode(mode, user, group, item_user, item_group, item_mode):
     mode = _c.FSQ_QUEUE_MODE if mode is None else mode
@@ -86,14 +102,30 @@ def _def_mode(mode, user, group, item_user, item_group, item_mode):
 ####### EXPOSED METHODS #######
 def install(trg_queue, is_down=False, is_triggered=False, user=None,
             group=None, mode=None, item_user=None, item_group=None,
-            item_mode=None, hosts=None, is_host_triggered=False):
-    '''Atomically install a queue'''
+            item_mode=None, hosts=None, is_host_triggered=False,
+            shards=None):
+    '''Atomically install a queue.  Should shards be passed, items in the
+       queue, done and fail directories of the queue (and its host queues)
+       are spread across shard sub-directories, by the shard layout shards:
+
+           time[:n] -- by the first n (default: 10) characters of the item
+                       timestamp, with the default FSQ_TIMEFMT, 8 is daily,
+                       10 is hourly and 12 is by the minute
+           hash[:n] -- by a hash of the item id, sans tries, into n
+                       (default: 256) buckets
+
+       The layout is fixed until the queue is uninstalled.'''
     mode, user, group, item_user, item_group, item_mode =\
         _def_mode(mode, user, group, item_user, item_group, item_mode)
     if hosts and not hasattr(hosts, '__iter__'):
         raise TypeError('Hosts must be an interable')
     # validate here, so that we don't throw an odd exception on the tmp name
     trg_queue = fsq_path.valid_name(trg_queue)
+    if shards is not None:
+        try:
+            shards = fsq_path.valid_layout(shards)
+        except FSQError, e:
+            raise FSQInstallError(e.errno, e.strerror)
     # uid_gid makes calls to the pw db and|or gr db, in addition to
     # potentially stat'ing, as such, we want to avoid calling it unless we
     # absoultely have to
@@ -115,6 +147,9 @@ def install(trg_queue, is_down=False, is_triggered=False, user=None,
         _instdir(fsq_path.queue(tmp_queue), mode, uid, gid)
         _instdir(fsq_path.done(tmp_queue), mode, uid, gid)
         _instdir(fsq_path.fail(tmp_queue), mode, uid, gid)
+        if shards is not None:
+            _instshards(tmp_queue, shards, _c.FSQ_ITEM_MODE if item_mode is\
+                        None else item_mode, *uid_gid(item_user, item_group))
 
         # down via configure.down if necessary
         if is_down:
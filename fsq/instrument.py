@@ -0,0 +1,149 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/instrument.py -- timing hooks for the hot paths of the library:
+#                      add_hook, remove_hook, FSQTimings
+#
+#     fsq is all unicode internally, if you pass in strings,
+#     they will be explicitly coerced to unicode.
+#
+#   NB: with no hooks registered, each instrumented operation costs one
+#       function call and a truth test; timings are taken only while at
+#       least one hook is registered.  Stages timed are:
+#
+#         enqueue.open   -- creating an item in tmp
+#         enqueue.write  -- copying the payload into the item
+#         enqueue.fsync  -- flushing and fsync'ing the item
+#         enqueue.link   -- linking the item into the queue
+#         scan.listdir   -- listing a queue (or host queue) directory
+#         scan.sort      -- sorting the listing
+#         item.lock      -- opening (and locking) a work item
+#         item.parse     -- parsing a work item's id
+#         done.rename    -- moving an item to done, fail or back to queue
+#
+#       Only operations which complete are timed.
+#
+# This software is for POSIX compliant systems only.
+import bisect
+import threading
+import time
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# callables of ( stage, queue, seconds, ), replaced (never mutated) on change
+_HOOKS = ()
+_HOOKS_LOCK = threading.Lock()
+# upper bounds, in seconds, of the latency histogram buckets
+_BUCKETS = ( 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+             0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+             5.0, 10.0, )
+
+def _label(val):
+    '''Escape a prometheus label value'''
+    return unicode(val).replace(u'\\', u'\\\\').replace(u'"', u'\\"')\
+                       .replace(u'\n', u'\\n')
+
+def _le(bound):
+    return u'+Inf' if bound is None else repr(bound).decode('ascii')
+
+####### EXPOSED METHODS AND CLASSES #######
+def add_hook(hook):
+    '''Register a callable, to be called as hook(stage, queue, seconds) as
+       each instrumented operation completes'''
+    global _HOOKS
+    with _HOOKS_LOCK:
+        if hook not in _HOOKS:
+            _HOOKS = _HOOKS + ( hook, )
+
+def remove_hook(hook):
+    '''Unregister a callable registered with add_hook'''
+    global _HOOKS
+    with _HOOKS_LOCK:
+        _HOOKS = tuple(h for h in _HOOKS if h != hook)
+
+def start():
+    '''Return the start time of an operation, or None if nothing is hooked'''
+    if _HOOKS:
+        return time.time()
+    return None
+
+def record(stage, queue, started):
+    '''Report the time since started (from start) for stage on queue to each
+       hook; hooks raising are ignored, rather than failing the operation'''
+    if started is None:
+        return
+    seconds = time.time() - started
+    for hook in _HOOKS:
+        try:
+            hook(stage, queue, seconds)
+        except Exception:
+            pass
+
+class FSQTimings(object):
+    '''FSQTimings is a hook collecting counts and latency histograms of
+       instrumented operations, keyed by stage and queue, e.g.
+
+        timings = FSQTimings()
+        add_hook(timings)
+        ...
+        print timings.prometheus()
+
+       buckets are the upper bounds, in seconds, of the histogram buckets;
+       an unbounded bucket is always added.'''
+    ####### MAGICAL METHODS AND ATTRS #######
+    def __init__(self, buckets=None):
+        self.buckets = tuple(sorted(_BUCKETS if buckets is None else buckets))
+        self._lock = threading.Lock()
+        # ( stage, queue, ) -> [ count, sum, [ bucket counts ] ]
+        self._timings = {}
+
+    def __call__(self, stage, queue, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            try:
+                timing = self._timings[( stage, queue, )]
+            except KeyError:
+                timing = self._timings.setdefault(( stage, queue, ), [ 0, 0.0,
+                                          [ 0 ]*(len(self.buckets) + 1) ])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2][i] += 1
+
+    ####### EXPOSED METHODS AND ATTRS #######
+    def snapshot(self):
+        '''Return a dict of ( stage, queue, ) -> dict of count, sum (seconds)
+           and buckets, a list of cumulative ( upper bound, count, ), ending
+           with an upper bound of None'''
+        with self._lock:
+            timings = [ ( k, v[0], v[1], list(v[2]), )
+                        for k, v in self._timings.iteritems() ]
+        snap = {}
+        for key, count, total, counts in timings:
+            buckets = []
+            cumulative = 0
+            for bound, n in zip(self.buckets + ( None, ), counts):
+                cumulative += n
+                buckets.append(( bound, cumulative, ))
+            snap[key] = { 'count': count, 'sum': total, 'buckets': buckets, }
+        return snap
+
+    def reset(self):
+        '''Forget everything collected so far'''
+        with self._lock:
+            self._timings = {}
+
+    def prometheus(self, name=u'fsq_operation_seconds'):
+        '''Return the timings as a prometheus text exposition histogram'''
+        lines = [ u'# HELP {0} Latency of fsq operations, by stage and'\
+                  u' queue.'.format(name),
+                  u'# TYPE {0} histogram'.format(name), ]
+        for ( stage, queue, ), timing in sorted(self.snapshot().iteritems()):
+            labels = u'stage="{0}",queue="{1}"'.format(_label(stage),
+                                                       _label(queue))
+            for bound, n in timing['buckets']:
+                lines.append(u'{0}_bucket{{{1},le="{2}"}} {3}'.format(name,
+                             labels, _le(bound), n))
+            lines.append(u'{0}_sum{{{1}}} {2!r}'.format(name, labels,
+                                                       timing['sum']))
+            lines.append(u'{0}_count{{{1}}} {2}'.format(name, labels,
+                                                       timing['count']))
+        return u'\n'.join(lines) + u'\n'
@@ -18,6 +18,8 @@ from . import FSQCoerceError, FSQEncodeError, FSQEnvError, FSQTimeFmtError,\
 ####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
 # additional types to coerce to unicode, beyond decodable types
 _COERCE_THESE_TOO = (numbers.Real,)
+# times shard_op will (re-)create a shard removed from under it
+_SHARD_TRIES = 8
 
 # locking convenience wrapper
 def _lock(fd, lock=False):
@@ -31,7 +33,64 @@ def _lock(fd, lock=False):
             raise FSQCannotLockError(e.errno, u'cannot lock')
         raise e
 
+def _mkshard(s_path):
+    '''Make a shard directory, with the mode and group of its parent,
+       returning False if it already exists'''
+    st = os.stat(os.path.dirname(s_path))
+    try:
+        os.mkdir(s_path, st.st_mode&07777)
+    except (OSError, IOError, ), e:
+        if e.errno == errno.EEXIST:
+            return False
+        raise e
+    try:
+        # mkdir is subject to umask, and may not inherit the group
+        os.chmod(s_path, st.st_mode&07777)
+        if os.stat(s_path).st_gid != st.st_gid:
+            os.chown(s_path, -1, st.st_gid)
+    except (OSError, IOError, ), e:
+        if e.errno not in ( errno.ENOENT, errno.EPERM, ):
+            raise e
+    return True
+
 ####### EXPOSED METHODS #######
+def _mkshards(s_path, levels):
+    '''Make a shard directory, and up to levels - 1 of its missing parents
+       (e.g. a lane directory), returning False if it already exists'''
+    try:
+        return _mkshard(s_path)
+    except (OSError, IOError, ), e:
+        if e.errno != errno.ENOENT or 1 >= levels:
+            raise e
+    _mkshards(os.path.dirname(s_path), levels - 1)
+    return _mkshard(s_path)
+
+def shard_op(op, src, trg, levels=1):
+    '''Call op(src, trg) -- e.g. os.link or os.rename into a queue, done or
+       fail directory -- making the shard directory of trg, should it not
+       exist.  Should levels be passed, up to levels directories are made
+       (e.g. the lanes dir, a lane dir and a shard dir of a priority lane),
+       but never the queue itself.'''
+    raced = False
+    for i in xrange(_SHARD_TRIES):
+        try:
+            return op(src, trg)
+        except (OSError, IOError, ), e:
+            if e.errno != errno.ENOENT or i + 1 == _SHARD_TRIES:
+                raise e
+            try:
+                made = _mkshards(os.path.dirname(trg), levels)
+            except (OSError, IOError, ):
+                # e.g. no such queue, report the original error
+                raise e
+            # the shard exists: it was made by another since op failed, so
+            # try once more, or it existed all along, and src is what's
+            # missing
+            if not made:
+                if raced:
+                    raise e
+                raced = True
+
 def coerce_unicode(s, charset):
     if isinstance(s, unicode):
         return s
@@ -2,35 +2,218 @@
 # @author: Matthew Story <matt.story@axial.net>
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
-# fsq/items.py -- provides items classes for fsq: FSQItem, FSQEnqueueItem
+# fsq/items.py -- provides items classes for fsq: FSQWorkItem, FSQEnqueueItem
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
 #
 # This software is for POSIX compliant systems only.
+import os
 import errno
 import datetime
+import socket
+import re
 
-from . import constants as _c, path as fsq_path, deconstruct,\
+from . import constants as _c, path as fsq_path, construct, deconstruct,\
               FSQMalformedEntryError, FSQTimeFmtError, FSQWorkItemError,\
-              FSQMaxTriesError, FSQTTLExpiredError, fail, success, done,\
-              fail_tmp, fail_perm
-from .internal import rationalize_file, wrap_io_os_err, check_ttl_max_tries
+              FSQMaxTriesError, FSQTTLExpiredError, FSQEnqueueError,\
+              FSQError, fail, success, done, fail_tmp, fail_perm, renew,\
+              instrument as _i, lease as fsq_lease
+from .internal import rationalize_file, wrap_io_os_err, check_ttl_max_tries,\
+                      fmt_time, coerce_unicode, uid_gid, shard_op
 
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# timestamps in the default FSQ_TIMEFMT are fixed-width, and parsed by hand
+_FIXED_TIMEFMT = u'%Y%m%d%H%M%S'
+_FIXED_TIMESTAMP = re.compile(u'[0-9]{14}\\Z')
+_HOSTNAME = socket.gethostname()
+_ENTROPY_PID = None
+_ENTROPY_TIME = None
+_ENTROPY_HOST = None
+_ENTROPY = 0
+# default of the layout kwarg, the shard layout is read from the queue
+_UNREAD = object()
+
+# sacrifice a lot of complexity for a little statefullness
+def _mkentropy(pid, now, host):
+    global _ENTROPY_PID, _ENTROPY_TIME, _ENTROPY_HOST, _ENTROPY
+    if _ENTROPY_PID == pid and _ENTROPY_TIME == now and _ENTROPY_HOST == host:
+        _ENTROPY += 1
+    else:
+        _ENTROPY_PID = pid
+        _ENTROPY_TIME = now
+        _ENTROPY_HOST = host
+        _ENTROPY = 0
+    return _ENTROPY
+
+def _timefmt_error(timefmt, timestamp):
+    return FSQTimeFmtError(errno.EINVAL, u'invalid date string for strptime'\
+                           u' fmt {0}: {1}'.format(timefmt, timestamp))
+
+def _parse_fixed(timestamp):
+    '''Parse a timestamp known to be 14 digits in the default FSQ_TIMEFMT,
+       without the considerable overhead of strptime'''
+    try:
+        return datetime.datetime(int(timestamp[:4]), int(timestamp[4:6]),
+                                 int(timestamp[6:8]), int(timestamp[8:10]),
+                                 int(timestamp[10:12]), int(timestamp[12:]))
+    except ValueError:
+        raise _timefmt_error(_FIXED_TIMEFMT, timestamp)
+
+####### EXPOSED METHODS AND CLASSES #######
 class FSQEnqueueItem(object):
-    '''Stub for Streamable Enqueue object, e.g.
+    '''A Streamable Enqueue object.  FSQEnqueueItem creates a new item in the
+       tmp directory of a queue, and stores it as the attribute self.item,
+       opened in write-only mode.  Nothing is visible in the queue until
+       commit is called, at which point the item is fsync'd and atomically
+       linked into the queue, e.g.
 
         foo = FSQEnqueueItem('foo', 'bar', 'baz', 'bang')
         try:
             for i in ['a', 'b', 'c']:
-                foo.item.write(i)
+                foo.write(i)
             foo.commit()
         except Exception, e:
             foo.abort()
         finally:
             del foo
-    '''
-    pass
+
+       Should an FSQEnqueueItem be neither committed nor aborted, it is
+       aborted when the ref count drops to 0.
+
+       Should priority be passed (and non-0), the item is linked into the
+       lane of priority, rather than the queue dir; scan drains lanes of
+       higher priority first (see fsq.scan).
+
+       The shard layout of the queue is read on construction, and stored as
+       the attribute self.layout, unless passed as layout (see
+       fsq.path.layout).'''
+    ####### MAGICAL METHODS AND ATTRS #######
+    def __init__(self, trg_queue, *args, **kwargs):
+        '''Construct an FSQEnqueueItem object from a queue-name and
+           arguments.  The user, group and mode kwargs will override the
+           default item ownership and mode (taken from environment), and the
+           priority kwarg selects the lane of the item.'''
+        user = kwargs.pop('user', None)
+        group = kwargs.pop('group', None)
+        mode = kwargs.pop('mode', None)
+        priority = kwargs.pop('priority', None)
+        layout = kwargs.pop('layout', _UNREAD)
+        if kwargs:
+            raise TypeError(u'unexpected keyword arguments:'\
+                            u' {0}'.format(u', '.join(kwargs.keys())))
+        self.queue = trg_queue
+        self.priority = fsq_path.valid_priority(priority)
+        self.layout = fsq_path.layout(trg_queue) if layout is _UNREAD\
+                                                 else layout
+        self.item = None
+        # nothing to abort until we've created the item in tmp
+        self.done = True
+        user = _c.FSQ_ITEM_USER if user is None else user
+        group = _c.FSQ_ITEM_GROUP if group is None else group
+        mode = _c.FSQ_ITEM_MODE if mode is None else mode
+
+        now = fmt_time(datetime.datetime.now(), _c.FSQ_TIMEFMT,
+                       _c.FSQ_CHARSET)
+        pid = coerce_unicode(os.getpid(), _c.FSQ_CHARSET)
+        host = coerce_unicode(_HOSTNAME, _c.FSQ_CHARSET)
+        tries = u'0'
+        entropy = _mkentropy(pid, now, host)
+        self.id = construct(( now, entropy, pid, host, tries, ) + args)
+        self.tmp = os.path.join(fsq_path.tmp(trg_queue), self.id)
+
+        # get low, so we can use some handy options; man 2 open
+        started = _i.start()
+        try:
+            trg_fd = os.open(self.tmp, os.O_WRONLY|os.O_CREAT|os.O_EXCL,
+                             mode)
+        except (OSError, IOError, ), e:
+            raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+        _i.record(u'enqueue.open', trg_queue, started)
+        self.done = False
+        try:
+            if user is not None or group is not None:
+                # set user/group ownership for file; man 2 fchown
+                os.fchown(trg_fd, *uid_gid(user, group, fd=trg_fd))
+            self.item = os.fdopen(trg_fd, 'wb')
+        except Exception, e:
+            if self.item is None:
+                os.close(trg_fd)
+            self.abort()
+            if (isinstance(e, OSError) or isinstance(e, IOError)) and\
+                    not isinstance(e, FSQError):
+                raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+            raise e
+
+    def __del__(self):
+        '''Always abort an uncommitted item when the ref count drops to 0'''
+        if not getattr(self, 'done', True):
+            try:
+                self.abort()
+            except FSQError:
+                pass
+
+    ####### EXPOSED METHODS AND ATTRS #######
+    def write(self, data):
+        '''Write data to the item'''
+        started = _i.start()
+        try:
+            self.item.write(data)
+        except (OSError, IOError, ), e:
+            raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+        _i.record(u'enqueue.write', self.queue, started)
+
+    def sync(self):
+        '''Flush buffers, and force the item to disk'''
+        started = _i.start()
+        try:
+            self.item.flush()
+            os.fsync(self.item.fileno())
+        except (OSError, IOError, ), e:
+            raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+        _i.record(u'enqueue.fsync', self.queue, started)
+
+    def commit(self):
+        '''Sync the item and atomically link it into the queue, returning the
+           queue item id (filename)'''
+        try:
+            self.sync()
+            self.item.close()
+            # hard-link into queue, unlink tmp, failure case here leaves
+            # cruft in tmp, but no race condition into queue
+            started = _i.start()
+            # a lane is made, with its lanes dir, on first use
+            levels = 1
+            if self.priority:
+                levels = 2 if self.layout is None else 3
+            shard_op(os.link, self.tmp, fsq_path.item(self.queue, self.id,
+                     priority=self.priority, layout=self.layout),
+                     levels=levels)
+            os.unlink(self.tmp)
+            _i.record(u'enqueue.link', self.queue, started)
+            self.done = True
+            return self.id
+        except Exception, e:
+            self.abort()
+            if (isinstance(e, OSError) or isinstance(e, IOError)) and\
+                    not isinstance(e, FSQError):
+                raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+            raise e
+
+    def abort(self):
+        '''Close and remove the uncommitted item from tmp'''
+        self.done = True
+        try:
+            if self.item is not None:
+                self.item.close()
+        except (OSError, IOError, ), e:
+            if e.errno != errno.EBADF:
+                raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
+        try:
+            os.unlink(self.tmp)
+        except (OSError, IOError, ), e:
+            if e.errno != errno.ENOENT:
+                raise FSQEnqueueError(e.errno, wrap_io_os_err(e))
 
 class FSQWorkItem(object):
     '''An FSQWorkItem object.  FSQWorkItem stores an open and potentially
@@ -43,49 +226,86 @@ class FSQWorkItem(object):
        include level functions taking a *WorkItem struct as their first
        argument.
 
+       The enqueued_at and arguments attributes are computed on first
+       access; enqueued_at is validated cheaply on construction, but an
+       impossible date (e.g. February 30th) in the default FSQ_TIMEFMT is
+       only reported (as FSQTimeFmtError) when enqueued_at is accessed.
+
+       Should lease (default: FSQ_LEASE) be non-0, opening the item claims
+       it for lease seconds in place of locking it: the item is renamed into
+       the claimed directory of the queue, and is returned to the queue by
+       reclaim once the lease lapses, unless it is renewed or done'd first.
+       The claimed id of a leased item is stored as the attribute
+       self.claimed; an item already claimed (e.g. by FSQScanGenerator) is
+       constructed by passing its claimed id as claimed.
+
+       An item enqueued with a priority is constructed by passing its
+       priority as priority, stored as the attribute self.priority, so that
+       it is found in (and retried into) its lane.
+
+       The shard layout of the queue is read on construction, and stored as
+       the attribute self.layout, unless passed as layout (e.g. by
+       FSQScanGenerator, which reads it once per scan).
+
        BEWARE: If you choose not to lock, the item you are working on may be
        worked on by others, and may be moved (on failure or success) out from
        underneath you.  Should you send lock=False, it is assumed you are
        guarenteeing concurrency of 1 on the queue through some other
        mechanism.'''
     ####### MAGICAL METHODS AND ATTRS #######
+    __slots__ = ( 'id', 'queue', 'max_tries', 'ttl', 'lock', 'item', 'host',
+                  'delimiter', 'entropy', 'pid', 'hostname', 'tries',
+                  'lease', 'claimed', 'priority', 'layout', '_timestamp',
+                  '_enqueued_at', '_args', '_arguments', )
+
     def __init__(self, trg_queue, item_id, max_tries=None, ttl=None,
-                 lock=None, no_open=False, host=None):
+                 lock=None, no_open=False, host=None, lease=None,
+                 claimed=None, priority=None, layout=_UNREAD):
         '''Construct an FSQWorkItem object from an item_id (file-name), and
-           queue-name.  The lock kwarg will override the default locking
-           preference (taken from environment).'''
+           queue-name.  The lock and lease kwargs will override the default
+           locking and leasing preferences (taken from environment).'''
 
         self.id = item_id
         self.queue = trg_queue
         self.max_tries = _c.FSQ_MAX_TRIES if max_tries is None else max_tries
         self.ttl = _c.FSQ_TTL if ttl is None else ttl
         self.lock = _c.FSQ_LOCK if lock is None else lock
+        self.lease = _c.FSQ_LEASE if lease is None else lease
+        self.claimed = claimed
         self.item = None
         self.host = host
+        self.priority = fsq_path.valid_priority(priority)
+        self.layout = fsq_path.layout(trg_queue) if layout is _UNREAD\
+                                                 else layout
+        self._enqueued_at = None
+        self._arguments = None
 
         # open file immediately
         if not no_open:
             self.open()
         try:
-            self.delimiter, arguments = deconstruct(item_id)
+            started = _i.start()
+            self.delimiter, self._args = deconstruct(item_id)
             try:
-                # construct datetime.datetime from enqueued_at
-                self.enqueued_at = datetime.datetime.strptime(arguments[0],
-                                                              _c.FSQ_TIMEFMT)
-                self.entropy = arguments[1]
-                self.pid = arguments[2]
-                self.hostname = arguments[3]
-                self.tries = arguments[4]
-                self.arguments = tuple(arguments[5:])
+                self._timestamp = self._args[0]
+                self.entropy = self._args[1]
+                self.pid = self._args[2]
+                self.hostname = self._args[3]
+                self.tries = self._args[4]
             except IndexError, e:
                 raise FSQMalformedEntryError(errno.EINVAL, u'needed at least'\
                                              u' 4 arguments to unpack, got:'\
-                                             u' {0}'.format(len(arguments)))
-            except ValueError, e:
-                raise FSQTimeFmtError(errno.EINVAL, u'invalid date string'\
-                                      u' for strptime fmt {0}:'\
-                                      u' {1}'.format(_c.FSQ_TIMEFMT,
-                                                     arguments[0]))
+                                             u' {0}'.format(len(self._args)))
+            # fixed-width timestamps are parsed on first access, anything
+            # else is parsed (and validated) now
+            if _c.FSQ_TIMEFMT != _FIXED_TIMEFMT or\
+                    not _FIXED_TIMESTAMP.match(self._timestamp):
+                try:
+                    # construct datetime.datetime from enqueued_at
+                    self._enqueued_at = datetime.datetime.strptime(
+                        self._timestamp, _c.FSQ_TIMEFMT)
+                except ValueError, e:
+                    raise _timefmt_error(_c.FSQ_TIMEFMT, self._timestamp)
             try:
                 self.tries = int(self.tries)
             except ValueError, e:
@@ -93,9 +313,12 @@ class FSQWorkItem(object):
                                       u' not {0}: {1}'.format(
                                         self.tries.__class__.__name__,
                                         self.tries))
+            _i.record(u'item.parse', self.queue, started)
             try:
-                check_ttl_max_tries(self.tries, self.enqueued_at,
-                                    self.max_tries, self.ttl)
+                # enqueued_at is only needed to check ttl
+                check_ttl_max_tries(self.tries, self.enqueued_at if\
+                                    self.ttl > 0 else None, self.max_tries,
+                                    self.ttl)
             except (FSQMaxTriesError, FSQTTLExpiredError, ), e:
                 e.strerror = u': '.join([
                     e.strerror,
@@ -116,6 +339,20 @@ class FSQWorkItem(object):
 
 
     ####### EXPOSED METHODS AND ATTRS #######
+    @property
+    def enqueued_at(self):
+        '''datetime.datetime at which the item was enqueued'''
+        if self._enqueued_at is None:
+            self._enqueued_at = _parse_fixed(self._timestamp)
+        return self._enqueued_at
+
+    @property
+    def arguments(self):
+        '''tuple of the arguments to the item, following tries'''
+        if self._arguments is None:
+            self._arguments = tuple(self._args[5:])
+        return self._arguments
+
     def close(self):
         # TODO : Why not just check to instance of file object?
         if (hasattr(self, 'item') and hasattr(self.item, 'close')
@@ -125,15 +362,30 @@ class FSQWorkItem(object):
 
     def open(self):
         self.close()
+        started = _i.start()
         try:
-            self.item = rationalize_file(fsq_path.item(self.queue, self.id,
-                                                       host=self.host),
-                                         _c.FSQ_CHARSET, lock=self.lock)
+            if self.lease and self.claimed is None:
+                self.claimed = fsq_lease.claim(self.queue, self.id,
+                                               self.lease, host=self.host,
+                                               priority=self.priority,
+                                               layout=self.layout)
+            if self.claimed is None:
+                self.item = rationalize_file(fsq_path.item(self.queue,
+                                             self.id, host=self.host,
+                                             priority=self.priority,
+                                             layout=self.layout),
+                                             _c.FSQ_CHARSET, lock=self.lock)
+            else:
+                # the lease stands in for the lock
+                self.item = rationalize_file(fsq_path.claimed_item(
+                                             self.queue, self.claimed,
+                                             host=self.host), _c.FSQ_CHARSET)
         except (OSError, IOError, ), e:
             if e.errno == errno.ENOENT:
                 raise FSQWorkItemError(e.errno, u'no such item in queue {0}:'\
                                        u' {1}'.format(self.queue, self.id))
             raise FSQWorkItemError(e.errno, wrap_io_os_err(e))
+        _i.record(u'item.lock', self.queue, started)
 
     def done(self, done_type=None):
         '''Complete an item, either successfully or with failure'''
@@ -153,3 +405,7 @@ class FSQWorkItem(object):
 
     def fail_perm(self):
         return fail_perm(self)
+
+    def renew(self, lease=None):
+        '''Extend the lease on this item (see fsq.lease.renew)'''
+        return renew(self, lease)
@@ -0,0 +1,141 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/lease.py -- provides leasing of work items: claim, renew, reclaim
+#
+#     fsq is all unicode internally, if you pass in strings,
+#     they will be explicitly coerced to unicode.
+#
+#   NB: an item is leased by renaming it out of the queue directory into
+#       the claimed directory, as <expiry>.<item id>, where expiry is in
+#       seconds since the epoch.  Renewing renames to a later expiry, and
+#       reclaiming renames a lapsed item back into the queue as a retry, so
+#       that each of claim, renew, reclaim and done is a single rename:
+#       whichever happens first wins, and the others fail with ENOENT.
+#       Leasing needs only write permission on the queue, and never stat's
+#       or locks an item.  Items claimed from a priority lane are claimed
+#       as <expiry>:<priority>.<item id>, and are reclaimed into the lane.
+#
+# This software is for POSIX compliant systems only.
+import os
+import errno
+import math
+import time
+
+from . import path as fsq_path, construct, deconstruct, FSQError,\
+              FSQLeaseError
+from .internal import wrap_io_os_err, shard_op
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# expiry is separated from the item id by a character no number contains
+_SEP = u'.'
+# as is the priority of an item claimed from a lane
+_LANE_SEP = u':'
+# claimed directories known to exist, so that a claim lost to another
+# process costs one rename, rather than a rename and a mkdir; refreshed by
+# reclaim, which lists the claimed directory before each leased scan
+_CLAIMED_DIRS = set()
+
+def _claimed_id(item_id, lease, now=None, priority=None):
+    now = time.time() if now is None else now
+    expires = u'{0:d}'.format(int(math.ceil(now + lease)))
+    if priority:
+        expires = u'{0}{1}{2:d}'.format(expires, _LANE_SEP, priority)
+    return u'{0}{1}{2}'.format(expires, _SEP, item_id)
+
+def _retry_id(item_id):
+    '''Return item_id with tries incremented, or item_id should it not parse
+       (a malformed item fails permanently as it is next scanned)'''
+    try:
+        delimiter, args = deconstruct(item_id)
+        args[4] = int(args[4]) + 1
+        return construct(args)
+    except (FSQError, IndexError, ValueError, ):
+        return item_id
+
+####### EXPOSED METHODS #######
+def claim(trg_queue, item_id, lease, host=None, priority=None, layout=None):
+    '''Claim a queued item (from the lane of priority, should priority be
+       non-0, and from its shard, should the layout of the queue be passed)
+       for lease seconds, returning the claimed id of the item; raises
+       OSError (ENOENT) should another have claimed (or done) the item
+       first'''
+    priority = fsq_path.valid_priority(priority)
+    claimed_id = _claimed_id(item_id, lease, priority=priority)
+    src = fsq_path.item(trg_queue, item_id, host=host, priority=priority,
+                        layout=layout)
+    # item_id is valid, and so is claimed_id
+    c_path = fsq_path.claimed(trg_queue, host=host)
+    trg = os.path.join(c_path, claimed_id)
+    if c_path in _CLAIMED_DIRS:
+        os.rename(src, trg)
+    else:
+        shard_op(os.rename, src, trg)
+        _CLAIMED_DIRS.add(c_path)
+    return claimed_id
+
+def renew(item, lease=None):
+    '''Extend the lease on a claimed item (e.g. as a heartbeat) to lease
+       seconds (default: the lease the item was claimed with) from now,
+       returning the new claimed id.  Raises FSQLeaseError should the lease
+       have lapsed, and the item been reclaimed.'''
+    lease = item.lease if lease is None else lease
+    claimed = getattr(item, 'claimed', None)
+    if claimed is None:
+        raise FSQLeaseError(errno.EINVAL, u'item is not leased:'\
+                            u' {0}'.format(item.id))
+    claimed_id = _claimed_id(item.id, lease,
+                             priority=getattr(item, 'priority', None))
+    # even renewing to the same expiry renames, to verify the lease is held
+    try:
+        os.rename(fsq_path.claimed_item(item.queue, claimed, host=item.host),
+                  fsq_path.claimed_item(item.queue, claimed_id,
+                                        host=item.host))
+    except (OSError, IOError, ), e:
+        if e.errno == errno.ENOENT:
+            raise FSQLeaseError(e.errno, u'lease lapsed for item:'\
+                                u' {0}'.format(item.id))
+        raise FSQLeaseError(e.errno, wrap_io_os_err(e))
+    item.claimed = claimed_id
+    return claimed_id
+
+def reclaim(trg_queue, host=None, now=None):
+    '''Return each item whose lease has lapsed to the queue (or host queue),
+       as a temporary failure (tries are incremented), returning the list of
+       reclaimed item ids.  Scanning with a lease reclaims before each
+       scan.'''
+    now = time.time() if now is None else now
+    c_path = fsq_path.claimed(trg_queue, host=host)
+    try:
+        claimed_ids = os.listdir(c_path)
+    except (OSError, IOError, ), e:
+        # nothing has been claimed yet
+        if e.errno == errno.ENOENT:
+            _CLAIMED_DIRS.discard(c_path)
+            return []
+        raise FSQLeaseError(e.errno, wrap_io_os_err(e))
+    _CLAIMED_DIRS.add(c_path)
+    p_layout = fsq_path.layout(trg_queue) if claimed_ids else None
+    reclaimed = []
+    for claimed_id in claimed_ids:
+        expires, sep, item_id = claimed_id.partition(_SEP)
+        expires, lane_sep, priority = expires.partition(_LANE_SEP)
+        try:
+            priority = int(priority) if lane_sep else 0
+            if not sep or int(expires) > now:
+                continue
+        except ValueError:
+            continue
+        item_id = _retry_id(item_id)
+        try:
+            # the lane was made as the item was enqueued, and is never removed
+            shard_op(os.rename, os.path.join(c_path, claimed_id),
+                     fsq_path.item(trg_queue, item_id, host=host,
+                                   priority=priority, layout=p_layout))
+        except (OSError, IOError, ), e:
+            # renewed, done or reclaimed by another first
+            if e.errno == errno.ENOENT:
+                continue
+            raise FSQLeaseError(e.errno, wrap_io_os_err(e))
+        reclaimed.append(item_id)
+    return reclaimed
@@ -3,20 +3,33 @@
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
 # fsq/construct.py -- provides path construction convenience functions: tmp,
-#                     queue, done, fail, down
+#                     queue, done, fail, down, item, done_item, fail_item,
+#                     claimed, claimed_item, lanes, shards, layout,
+#                     shard
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
 #
+#   NB: every function here but layout only constructs paths, and does no
+#       I/O.  layout reads the shard layout of a queue from its shards file,
+#       and is called once where a queue is opened, scanned or enqueued to;
+#       the layout is then passed down to item, done_item, fail_item and
+#       shard, which assume a flat queue should none be passed.
+#
 # This software is for POSIX compliant systems only.
 import os
 import errno
+import zlib
 
-from .internal import coerce_unicode
+from .internal import coerce_unicode, wrap_io_os_err
 from . import constants as _c, FSQPathError
 
 ####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
 _ILLEGAL_NAMES=('.', '..', )
+# shard layouts, and the default leading timestamp characters (time) or
+# number of buckets (hash) of each
+_LAYOUTS = { u'time': 10, u'hash': 256, }
+_MAX_BUCKETS = 65536
 
 def _path(queue, extra=None, root=_c.FSQ_ROOT):
     args = [coerce_unicode(root, _c.FSQ_CHARSET), valid_name(queue)]
@@ -32,6 +45,15 @@ def valid_name(name):
                                   u' {0}'.format(name))
     return name
 
+def valid_priority(priority):
+    '''Return the priority of a lane as an int; priority 0 (or None) is the
+       default lane, the queue dir itself'''
+    try:
+        return 0 if priority is None else int(priority)
+    except (TypeError, ValueError, ):
+        raise FSQPathError(errno.EINVAL, u'illegal priority:'\
+                           u' {0}'.format(priority))
+
 def base(p_queue, host=None):
     if host is not None:
         return _path(host, root=hosts(p_queue))
@@ -43,8 +65,13 @@ def tmp(p_queue, host=None):
     '''Construct a path to the tmp dir for a queue'''
     return _path(p_queue, _c.FSQ_TMP)
 
-def queue(p_queue, host=None):
-    '''Construct a path to the queue dir for a queue'''
+def queue(p_queue, host=None, priority=None):
+    '''Construct a path to the queue dir for a queue, or to the lane dir of
+       priority, should priority be non-0'''
+    priority = valid_priority(priority)
+    if priority:
+        return _path(u'{0:d}'.format(priority), root=lanes(p_queue,
+                     host=host))
     if host is not None:
         return _path(_c.FSQ_QUEUE, root=_path(host, root=hosts(p_queue)))
     return _path(p_queue, _c.FSQ_QUEUE)
@@ -67,16 +94,108 @@ def down(p_queue, host=None):
     '''Construct a path to the down file for a queue'''
     return _path(p_queue, _c.FSQ_DOWN)
 
+def claimed(p_queue, host=None):
+    '''Construct a path to the claimed dir for a queue, holding leased
+       items'''
+    if host is not None:
+        return _path(_c.FSQ_CLAIMED, root=_path(host, root=hosts(p_queue)))
+    return _path(p_queue, _c.FSQ_CLAIMED)
+
+def lanes(p_queue, host=None):
+    '''Construct a path to the lanes dir for a queue, holding a lane dir for
+       each non-0 priority'''
+    if host is not None:
+        return _path(_c.FSQ_LANES, root=_path(host, root=hosts(p_queue)))
+    return _path(p_queue, _c.FSQ_LANES)
+
 def hosts(p_queue):
     '''Construct a path to the hosts path for a queue'''
     return _path(p_queue, _c.FSQ_HOSTS)
 
-def item(p_queue, queue_id, host=None):
+def _item(p_dir, queue_id, p_layout):
+    queue_id = valid_name(queue_id)
+    p_shard = shard(p_layout, queue_id)
+    if p_shard is None:
+        return os.path.join(p_dir, queue_id)
+    return os.path.join(p_dir, p_shard, queue_id)
+
+def item(p_queue, queue_id, host=None, priority=None, layout=None):
+    '''Construct a path to a queued item, in its shard should the layout
+       of the queue (see layout) be passed'''
+    return _item(queue(p_queue, host=host, priority=priority), queue_id,
+                 layout)
+
+def done_item(p_queue, queue_id, host=None, layout=None):
+    '''Construct a path to a done item'''
+    return _item(done(p_queue, host=host), queue_id, layout)
+
+def fail_item(p_queue, queue_id, host=None, layout=None):
+    '''Construct a path to a failed item'''
+    return _item(fail(p_queue, host=host), queue_id, layout)
+
+def claimed_item(p_queue, claimed_id, host=None):
+    '''Construct a path to a leased item, claimed_id is the lease expiry
+       and item id (see fsq.lease); the claimed dir is never sharded'''
+    return os.path.join(claimed(p_queue, host=host), valid_name(claimed_id))
+
+def shards(p_queue):
+    '''Construct a path to the shard layout file for a queue'''
+    return _path(p_queue, _c.FSQ_SHARDS)
+
+def valid_layout(spec):
+    '''Return the ( kind, n, ) of a shard layout spec, one of: time[:n],
+       sharding by the first n characters of the item timestamp, or
+       hash[:n], sharding by hash into n buckets'''
+    spec = coerce_unicode(spec, _c.FSQ_CHARSET).strip()
+    kind, sep, n = spec.partition(u':')
+    try:
+        n = int(n) if sep else _LAYOUTS[kind]
+        if kind not in _LAYOUTS or 1 > n or\
+                ( kind == u'hash' and _MAX_BUCKETS < n ):
+            raise ValueError(n)
+    except (KeyError, ValueError, ):
+        raise FSQPathError(errno.EINVAL, u'illegal shard layout:'\
+                           u' {0}'.format(spec))
+    return ( kind, n, )
+
+def layout(p_queue):
+    '''Read the shard layout of a queue from its shards file, returning
+       ( kind, n, ), or None for a queue installed without shards (or not
+       installed at all).  The layout is fixed from install to uninstall, so
+       read it once where a queue is opened or scanned, and pass it down.'''
+    try:
+        with open(shards(p_queue), 'rb') as f:
+            return valid_layout(f.read())
+    except (OSError, IOError, ), e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise FSQPathError(e.errno, wrap_io_os_err(e))
+    except UnicodeError, e:
+        raise FSQPathError(errno.EINVAL, u'cannot read shard layout of queue'\
+                           u' {0}: {1}'.format(p_queue, e))
+
+def shard(p_layout, queue_id):
+    '''Return the name of the shard directory of an item in a queue with
+       layout p_layout (see layout), or None for a queue installed without
+       shards.  Shards ignore tries, so that retried items stay in the same
+       shard.'''
+    if p_layout is None:
+        return None
+    kind, n = p_layout
+    # timestamp, entropy, pid and hostname
+    delimiter = queue_id[:1]
+    fields = queue_id[1:].split(delimiter, 4)[:4] if delimiter else []
+    if kind == u'time':
+        p_shard = fields[0][:n] if fields else u''
+        return u'_' if p_shard in ( u'', ) + _ILLEGAL_NAMES else p_shard
+    bucket = zlib.crc32(u'\0'.join(fields).encode(_c.FSQ_CHARSET))
+    return u'{0:0{1}x}'.format((bucket&0xffffffff)%n, len(u'{0:x}'.format(n-1)))
+
+def rate(p_queue, host=None):
+    '''Construct a path to the shared rate-limit state file for a queue'''
     if host is not None:
-        return os.path.join(_path(host, _c.FSQ_QUEUE, root=hosts(p_queue)),
-                            valid_name(queue_id))
-    '''Construct a path to a queued item'''
-    return os.path.join(_path(p_queue, _c.FSQ_QUEUE), valid_name(queue_id))
+        return _path(_c.FSQ_RATE, root=_path(host, root=hosts(p_queue)))
+    return _path(p_queue, _c.FSQ_RATE)
 
 def trigger(p_queue, trigger=_c.FSQ_TRIGGER):
     '''Construct a path to a trigger (FIFO)'''
@@ -1,37 +1,159 @@
 # fsq -- a python library for manipulating and introspecting FSQ queues
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
-# fsq/push.py -- provides remote distsitrubtion function: push
+# fsq/push.py -- provides remote distsitrubtion functions: push, push_many
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
 #
+#   NB: Servers are pooled per process, thread and remote address, and
+#       keep their HTTP connection alive between calls.  Given a chunk_size,
+#       payloads are streamed in base64 chunks, rather than read whole.
+#
 # This software is for POSIX compliant systems only.
+import os
+import base64
+import thread
+import urllib
+
 from jsonrpclib import Server
+from jsonrpclib.jsonrpc import UnixTransport, UnixHTTPConnection
 from . import FSQPushError, FSQRemoteTriggerError, constants as _c
 
-def push(item, remote_addr, trg_queue, protocol=u'jsonrpc'):
-    ''' Enqueue an FSQWorkItem at a remote queue '''
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# max items, and (roughly) max bytes of items, push_many sends in one request
+_BATCH_SIZE = 256
+_BATCH_BYTES = 16777216
+# ( pid, thread, remote_addr, charset, ) -> Server
+_SERVERS = {}
+
+class _KeepAliveUnixTransport(UnixTransport):
+    '''jsonrpclib's UnixTransport speaks HTTP/1.0, and opens a new connection
+       per request; this keeps one HTTP/1.1 connection, as the http
+       transports do'''
+    def make_connection(self, host):
+        if self._connection and host == self._connection[0]:
+            return self._connection[1]
+        chost, extra_headers, x509 = self.get_host_info(host)
+        self._connection = host, UnixHTTPConnection(chost)
+        return self._connection[1]
+
+def _server(remote_addr):
+    '''Return a pooled Server for remote_addr, forked children and threads
+       never share a connection'''
+    key = ( os.getpid(), thread.get_ident(), remote_addr, _c.FSQ_CHARSET, )
+    try:
+        return _SERVERS[key]
+    except KeyError:
+        transport = None
+        if u'unix' == urllib.splittype(remote_addr)[0]:
+            transport = _KeepAliveUnixTransport()
+        server = Server(remote_addr, transport=transport,
+                        encoding=_c.FSQ_CHARSET)
+        return _SERVERS.setdefault(key, server)
+
+def _drop(remote_addr):
+    '''Drop the pooled Server for remote_addr, e.g. after an error'''
+    _SERVERS.pop(( os.getpid(), thread.get_ident(), remote_addr,
+                   _c.FSQ_CHARSET, ), None)
+
+def _size(item):
+    '''Size of the payload of an FSQWorkItem, or None if unknown'''
+    try:
+        return os.fstat(item.item.fileno()).st_size
+    except (AttributeError, ValueError, OSError, ):
+        return None
+
+def _push_chunked(server, item, trg_queue, chunk_size):
+    '''Stream an FSQWorkItem to the remote tmp dir of trg_queue, chunk_size
+       bytes per request, then commit it to trg_queue'''
+    server.enqueue_begin(item.id, trg_queue)
+    try:
+        offset = 0
+        while True:
+            chunk = item.item.read(chunk_size)
+            if not chunk:
+                break
+            offset = server.enqueue_write(item.id, trg_queue, offset,
+                                          base64.b64encode(chunk))
+        return server.enqueue_commit(item.id, trg_queue, offset)
+    except Exception, e:
+        # best effort, the connection may be gone
+        try:
+            server.enqueue_abort(item.id, trg_queue)
+        except Exception:
+            pass
+        raise e
+
+####### EXPOSED METHODS #######
+def push(item, remote_addr, trg_queue, protocol=u'jsonrpc', chunk_size=None):
+    ''' Enqueue an FSQWorkItem at a remote queue, streaming the payload in
+        chunks of chunk_size bytes, if chunk_size is given '''
     if protocol == u'jsonrpc':
         try:
-            server = Server(remote_addr, encoding=_c.FSQ_CHARSET)
+            server = _server(remote_addr)
+            if chunk_size:
+                return _push_chunked(server, item, trg_queue, chunk_size)
             return server.enqueue(item.id, trg_queue, item.item.read())
         except Exception, e:
+            _drop(remote_addr)
             raise FSQPushError(e)
 
     raise ValueError('Unknown protocol: {0}'.format(protocol))
 
+def push_many(items, remote_addr, trg_queue, trigger=False,
+              ignore_listener=False, protocol=u'jsonrpc', chunk_size=None):
+    '''Enqueue many FSQWorkItems at a remote queue, sending up to 256 items
+       (or 16MB of items) per request, and optionally pulling the remote
+       trigger once, with the last request.  Given a chunk_size, items larger
+       than chunk_size are streamed one at a time, as push does.  Returns the
+       list of item ids.'''
+    if protocol != u'jsonrpc':
+        raise ValueError('Unknown protocol: {0}'.format(protocol))
+    item_ids = []
+    batch = []
+    batch_bytes = 0
+    try:
+        server = _server(remote_addr)
+        for item in items:
+            if chunk_size and chunk_size < _size(item):
+                # keep item_ids in order
+                if batch:
+                    item_ids.extend(server.enqueue_many(trg_queue, batch,
+                                                        False,
+                                                        ignore_listener))
+                    batch = []
+                    batch_bytes = 0
+                item_ids.append(_push_chunked(server, item, trg_queue,
+                                              chunk_size))
+                continue
+            batch.append(( item.id, item.item.read(), ))
+            batch_bytes += len(batch[-1][1])
+            if _BATCH_SIZE <= len(batch) or _BATCH_BYTES <= batch_bytes:
+                item_ids.extend(server.enqueue_many(trg_queue, batch, False,
+                                                    ignore_listener))
+                batch = []
+                batch_bytes = 0
+        # the last request (even if empty) pulls the trigger
+        if batch or trigger:
+            item_ids.extend(server.enqueue_many(trg_queue, batch, trigger,
+                                                ignore_listener))
+        return item_ids
+    except Exception, e:
+        _drop(remote_addr)
+        raise FSQPushError(e)
+
 def remote_trigger_pull(remote_addr, trg_queue, ignore_listener=False,
                         protocol=u'jsonrpc'):
     '''Write a non-blocking byte to a remote trigger fifo, to cause a triggered
        scan'''
     if protocol == u'jsonrpc':
         try:
-            server = Server(remote_addr, encoding=_c.FSQ_CHARSET)
-            return server.trigger_pull(queue=trg_queue,
+            return _server(remote_addr).trigger_pull(queue=trg_queue,
                                        ignore_listener=ignore_listener,
                                        trigger=_c.FSQ_TRIGGER)
         except Exception, e:
+            _drop(remote_addr)
             raise FSQRemoteTriggerError(e)
 
     raise ValueError('Unknown protocol: {0}'.format(protocol))
@@ -1,15 +1,141 @@
+import os
+import errno
+import fcntl
+import mmap
+import struct
 import time
 
-def ratelimited(limit_qty, limit_period, iterable):
-    """Return a RatelimitedIterator over iterable. Units for limit_period are in seconds."""
-    return RatelimitedIterator(limit_qty, limit_period, iter(iterable))
+# a shared bucket: initialized flag, tokens and the clock time of the last take
+_STATE = struct.Struct('qdd')
+
+def ratelimited(limit_qty, limit_period, iterable, burst=1, state_file=None,
+                state_mode=0600, state_uid=-1, state_gid=-1):
+    """Return a RatelimitedIterator over iterable. Units for limit_period are in seconds.
+
+    Up to burst values are yielded at once, and if state_file is given, the limit is
+    shared with every process rate-limiting with the same state_file.  state_mode,
+    state_uid and state_gid are as mode, uid and gid for TokenBucket.
+    """
+    return RatelimitedIterator(limit_qty, limit_period, iter(iterable), burst=burst,
+                               state_file=state_file, state_mode=state_mode,
+                               state_uid=state_uid, state_gid=state_gid)
+
+class TokenBucket(object):
+    """A bucket holding up to burst tokens, refilled at limit_qty tokens per limit_period."""
+    DEFAULT_CLOCK_FUNC = time.time
+    DEFAULT_SLEEP_FUNC = time.sleep
+
+    def __init__(self, limit_qty, limit_period, burst=1, state_file=None, clock_func=None,
+                 sleep_func=None, mode=0600, uid=-1, gid=-1):
+        """
+        limit_qty is the number of tokens added to the bucket within limit_period.
+
+        burst is the most tokens the bucket holds, and so the most tokens which may be
+        taken at once, once the bucket has had time to fill.  The bucket starts full.
+
+        state_file is the path of a file (created if need be) in which to keep the
+        bucket.  The file is mmap'd, and locked with flock(2) while the bucket is
+        updated, so that every process using state_file takes from one bucket.  When
+        sharing a bucket, clock_func must agree across processes, as time.time does.
+
+        mode, uid and gid are the mode and ownership given state_file should it be
+        created (-1 leaves the owner or group as created).  Any process which may
+        write state_file may drain or refill the bucket, so the default mode is 0600.
+
+        clock_func and sleep_func are as for RatelimitedIterator.
+        """
+        if limit_qty <= 0 or limit_period <= 0:
+            raise ValueError("limit_qty and limit_period must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1, not {0}".format(burst))
+
+        self.burst = burst
+        self.clock_func = clock_func or self.DEFAULT_CLOCK_FUNC
+        self.sleep_func = sleep_func or self.DEFAULT_SLEEP_FUNC
+
+        #Ensure float division (not integral division)
+        self.rate = limit_qty / float(limit_period)
+
+        self.state = ( 0, 0.0, 0.0, )
+        self.fd = self.map = None
+        if state_file is not None:
+            self.fd = self._open(state_file, mode, uid, gid)
+            try:
+                if os.fstat(self.fd).st_size < _STATE.size:
+                    os.ftruncate(self.fd, _STATE.size)
+                self.map = mmap.mmap(self.fd, _STATE.size)
+            except Exception, e:
+                self.close()
+                raise e
+
+    def __del__(self):
+        self.close()
+
+    def _open(self, state_file, mode, uid, gid):
+        """Open state_file, creating it with mode, uid and gid if need be"""
+        try:
+            fd = os.open(state_file, os.O_RDWR|os.O_CREAT|os.O_EXCL, mode)
+        except (OSError, IOError, ), e:
+            if e.errno != errno.EEXIST:
+                raise e
+            return os.open(state_file, os.O_RDWR)
+        try:
+            if -1 != uid or -1 != gid:
+                os.fchown(fd, uid, gid)
+        except Exception, e:
+            os.close(fd)
+            os.unlink(state_file)
+            raise e
+        return fd
+
+    def close(self):
+        if getattr(self, 'map', None) is not None:
+            self.map.close()
+            self.map = None
+        if getattr(self, 'fd', None) is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def take(self):
+        """Take one token, sleeping until one is available"""
+        while True:
+            if self.map is None:
+                wait = self._take()
+            else:
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+                try:
+                    self.state = _STATE.unpack_from(self.map)
+                    wait = self._take()
+                    _STATE.pack_into(self.map, 0, *self.state)
+                finally:
+                    fcntl.flock(self.fd, fcntl.LOCK_UN)
+            if wait is None:
+                return
+            self.sleep_func(wait)
+
+    def _take(self):
+        """Refill and take a token, returning None, or the time to wait for a token"""
+        initialized, tokens, last = self.state
+        current = self.clock_func()
+        if not initialized:
+            tokens = self.burst
+        else:
+            #Clocks may step backwards, never drain the bucket for it
+            tokens = min(self.burst, tokens + max(0, current - last) * self.rate)
+        if tokens >= 1:
+            self.state = ( 1, tokens - 1, current, )
+            return None
+        self.state = ( 1, tokens, current, )
+        return (1 - tokens) / self.rate
 
 class RatelimitedIterator(object):
     """An iterator for rate-limiting another iterator."""
     DEFAULT_CLOCK_FUNC = time.time
     DEFAULT_SLEEP_FUNC = time.sleep
 
-    def __init__(self, limit_qty, limit_period, iterator, clock_func=None, sleep_func=None, allow_negative_sleep=False):
+    def __init__(self, limit_qty, limit_period, iterator, clock_func=None, sleep_func=None,
+                 allow_negative_sleep=False, burst=1, state_file=None, state_mode=0600,
+                 state_uid=-1, state_gid=-1):
         """
         limit_qty is the number of times a value will be yielded within limit_period.
 
@@ -25,8 +151,16 @@ class RatelimitedIterator(object):
         subtracted from, divided, and added to. If clock_func and sleep_func are not
         specified, this value is in seconds.
 
-        allow_negative_sleep allows sleep_func to be called if the desired sleep time
-        is negative (eg, the last loop took longer than interval)
+        allow_negative_sleep is kept for compatibility; sleep_func is only ever called
+        for positive delays.
+
+        burst is the most values yielded without delay, after a pause long enough for
+        burst values.  The default of 1 spaces every value limit_period / limit_qty
+        apart.
+
+        state_file, if given, is a file shared with other processes (see TokenBucket),
+        so that together they yield no more than limit_qty values within limit_period.
+        state_mode, state_uid and state_gid are as mode, uid and gid for TokenBucket.
         """
 
         clock_func = clock_func or self.DEFAULT_CLOCK_FUNC
@@ -38,11 +172,15 @@ class RatelimitedIterator(object):
         self.clock_func = clock_func
         self.sleep_func = sleep_func
         self.allow_negative_sleep = allow_negative_sleep
+        self.burst = burst
 
         #Ensure float division (not integral division)
-        self.interval = limit_period / float(limit_qty) 
+        self.interval = limit_period / float(limit_qty)
 
-        self.next_scheduled = None
+        self.bucket = TokenBucket(limit_qty, limit_period, burst=burst,
+                                  state_file=state_file, clock_func=clock_func,
+                                  sleep_func=sleep_func, mode=state_mode,
+                                  uid=state_uid, gid=state_gid)
 
     def __iter__(self):
         return self
@@ -53,17 +191,6 @@ class RatelimitedIterator(object):
         return ret
 
     def _delay(self):
-        """Delay for between zero and self.interval time units"""
-        if not self.next_scheduled:
-            self.next_scheduled = self.clock_func() + self.interval
-            return
-        while True:
-            current = self.clock_func()
-            if current >= self.next_scheduled:
-                extratime = current - self.next_scheduled
-                self.next_scheduled = current + self.interval - extratime
-                return
-            delay_amt = self.next_scheduled - current
-            #Call for 0, because that might be meaningful to sleep_func.
-            if self.allow_negative_sleep or delay_amt >= 0: 
-                self.sleep_func(self.next_scheduled - current)
+        """Delay until a token is available, between zero and self.interval time units
+        for a burst of 1"""
+        self.bucket.take()
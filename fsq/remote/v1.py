@@ -1,17 +1,111 @@
 # fsq -- a python library for manipulating and introspecting FSQ queues
 # @author: Jeff Rand <jeff.rand@axial.net>
 #
-# fsq/v1.py -- provides version 1 API function: enqueue
+# fsq/v1.py -- provides version 1 API functions: enqueue, enqueue_many,
+#              enqueue_begin, enqueue_write, enqueue_commit, enqueue_abort
 #
 #     fsq is all unicode internally, if you pass in strings,
 #     they will be explicitly coerced to unicode.
 #
+#   NB: chunked enqueues keep no state in the server, the partial item lives
+#       in the tmp dir of trg_queue, so that each chunk may be handled by
+#       any jsonrpcd worker.
+#
 # This software is for POSIX compliant systems only.
-from .. import vsreenqueue, trigger_pull, is_down
+import os
+import errno
+import base64
+import binascii
+
+from .. import vsreenqueue, trigger_pull, is_down, FSQReenqueueError,\
+               constants as _c, path as fsq_path
+from ..internal import wrap_io_os_err, shard_op
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+def _upload(fsq_id, trg_queue):
+    '''Path of a partially pushed item, hidden in the tmp dir of trg_queue'''
+    # validates fsq_id and trg_queue
+    fsq_path.item(trg_queue, fsq_id)
+    return os.path.join(fsq_path.tmp(trg_queue), u'.push.{0}'.format(fsq_id))
 
+def _open(fsq_id, trg_queue, flags=os.O_WRONLY):
+    try:
+        return os.open(_upload(fsq_id, trg_queue), flags, _c.FSQ_ITEM_MODE)
+    except (OSError, IOError, ), e:
+        raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
+
+####### EXPOSED METHODS #######
 def enqueue(fsq_id, trg_queue, data):
     ''' Enqueue an item pushed from a remote client '''
     return vsreenqueue(fsq_id, data, [ trg_queue, ])
 
+def enqueue_many(trg_queue, items, trigger=False, ignore_listener=False):
+    ''' Enqueue a list of [ fsq_id, data, ] items pushed from a remote
+        client, optionally pulling the trigger for trg_queue once all are
+        enqueued '''
+    item_ids = [ vsreenqueue(fsq_id, data, [ trg_queue, ])
+                 for fsq_id, data in items ]
+    if trigger:
+        trigger_pull(trg_queue, ignore_listener=ignore_listener)
+    return item_ids
+
+def enqueue_begin(fsq_id, trg_queue):
+    ''' Begin a chunked enqueue of an item pushed from a remote client,
+        truncating any earlier, abandoned attempt '''
+    os.close(_open(fsq_id, trg_queue, os.O_WRONLY|os.O_CREAT|os.O_TRUNC))
+    return fsq_id
+
+def enqueue_write(fsq_id, trg_queue, offset, data):
+    ''' Write a base64 encoded chunk at offset of a chunked enqueue, writing
+        the same chunk twice is harmless, so clients may retry '''
+    try:
+        data = base64.b64decode(data)
+    except (TypeError, binascii.Error, ), e:
+        raise FSQReenqueueError(errno.EINVAL, u'invalid chunk for {0}:'\
+                                u' {1}'.format(fsq_id, e))
+    fd = _open(fsq_id, trg_queue)
+    try:
+        os.lseek(fd, offset, os.SEEK_SET)
+        end = offset + len(data)
+        while data:
+            data = data[os.write(fd, data):]
+        return end
+    except (OSError, IOError, ), e:
+        raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
+    finally:
+        os.close(fd)
+
+def enqueue_commit(fsq_id, trg_queue, size):
+    ''' Commit a chunked enqueue of size bytes, atomically linking it into
+        trg_queue '''
+    tmp_name = _upload(fsq_id, trg_queue)
+    fd = _open(fsq_id, trg_queue)
+    try:
+        got = os.fstat(fd).st_size
+        if size == got:
+            # force write to disk pre link
+            os.fsync(fd)
+            shard_op(os.link, tmp_name, fsq_path.item(trg_queue, fsq_id,
+                     layout=fsq_path.layout(trg_queue)))
+    except (OSError, IOError, ), e:
+        raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
+    finally:
+        os.close(fd)
+    if size != got:
+        raise FSQReenqueueError(errno.EIO, u'expected {0} bytes for {1},'\
+                                u' got {2}'.format(size, fsq_id, got))
+    enqueue_abort(fsq_id, trg_queue)
+    return fsq_id
+
+def enqueue_abort(fsq_id, trg_queue):
+    ''' Abandon a chunked enqueue, removing the partial item '''
+    try:
+        os.unlink(_upload(fsq_id, trg_queue))
+    except (OSError, IOError, ), e:
+        if e.errno != errno.ENOENT:
+            raise FSQReenqueueError(e.errno, wrap_io_os_err(e))
+    return fsq_id
+
 #libexec/fsq/jsonrpcd.py will load all functions in __all__
-__all__ = [ 'enqueue', 'trigger_pull', 'is_down', ]
+__all__ = [ 'enqueue', 'enqueue_many', 'enqueue_begin', 'enqueue_write',
+            'enqueue_commit', 'enqueue_abort', 'trigger_pull', 'is_down', ]
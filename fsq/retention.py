@@ -0,0 +1,200 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/retention.py -- provides retention of done and failed items: expire
+#
+#     fsq is all unicode internally, if you pass in strings,
+#     they will be explicitly coerced to unicode.
+#
+#   NB: items are aged by the enqueue time in their names, so expiring
+#       never stat's an item; only items with names that cannot be parsed
+#       are aged by their mtime.
+#
+# This software is for POSIX compliant systems only.
+import os
+import re
+import errno
+import bisect
+import datetime
+import tarfile
+import tempfile
+
+from . import constants as _c, path as fsq_path, deconstruct, FSQError,\
+              FSQExpireError
+from .internal import wrap_io_os_err, fmt_time
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# items are ordered by enqueue time, as a fixed width timestamp
+_FIXED_TIMEFMT = u'%Y%m%d%H%M%S'
+_FIXED_TIMESTAMP = re.compile(u'[0-9]{14}\\Z')
+# most items rolled into one archive segment
+_SEGMENT_SIZE = 10000
+_COMPRESSLEVEL = 6
+
+def _stamp(s_path, item_id):
+    '''Return the enqueue time of an item as a fixed width timestamp, or
+       None should the item be gone'''
+    # the timestamp is the first field, following the delimiter
+    timestamp = item_id[1:].split(item_id[:1], 1)[0] if item_id else u''
+    if _c.FSQ_TIMEFMT == _FIXED_TIMEFMT and _FIXED_TIMESTAMP.match(timestamp):
+        return timestamp
+    try:
+        enqueued_at = datetime.datetime.strptime(deconstruct(item_id)[1][0],
+                                                 _c.FSQ_TIMEFMT)
+    except (FSQError, IndexError, ValueError, ):
+        try:
+            enqueued_at = datetime.datetime.fromtimestamp(os.lstat(
+                                os.path.join(s_path, item_id)).st_mtime)
+        except (OSError, IOError, ), e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise e
+    return fmt_time(enqueued_at, _FIXED_TIMEFMT, _c.FSQ_CHARSET)
+
+def _listdir(trg_queue, d_path):
+    '''Return ( stamp, item_id, shard_path, ) for each item in a done or fail
+       directory, and the list of shard paths'''
+    if fsq_path.layout(trg_queue) is None:
+        shards = [ d_path, ]
+    else:
+        shards = [ os.path.join(d_path, s) for s in os.listdir(d_path) ]
+    items = []
+    for s_path in shards:
+        try:
+            item_ids = os.listdir(s_path)
+        except (OSError, IOError, ), e:
+            if s_path == d_path or e.errno not in ( errno.ENOENT,
+                                                    errno.ENOTDIR, ):
+                raise e
+            continue
+        for item_id in item_ids:
+            stamp = _stamp(s_path, item_id)
+            if stamp is not None:
+                items.append(( stamp, item_id, s_path, ))
+    return items, shards
+
+def _archive(archive_dir, name, d_path, segment):
+    '''Roll a segment of items into a gzip'd tar file in archive_dir,
+       returning the items archived'''
+    fd, tmp_path = tempfile.mkstemp(u'', u'.{0}.'.format(name), archive_dir)
+    try:
+        archived = []
+        with os.fdopen(fd, 'wb') as f:
+            tar = tarfile.open(fileobj=f, mode='w:gz',
+                               compresslevel=_COMPRESSLEVEL)
+            try:
+                for item in segment:
+                    stamp, item_id, s_path = item
+                    path = os.path.join(s_path, item_id)
+                    try:
+                        tar.add(path.encode(_c.FSQ_CHARSET),
+                                os.path.relpath(path, d_path).encode(
+                                    _c.FSQ_CHARSET))
+                    except (OSError, IOError, ), e:
+                        # done or failed again (e.g. by another expire)
+                        if e.errno != errno.ENOENT:
+                            raise e
+                        continue
+                    archived.append(item)
+            finally:
+                tar.close()
+            f.flush()
+            os.fsync(f.fileno())
+        # link to a name no other segment has, segments are never replaced
+        seq = 0
+        while True:
+            seg_path = os.path.join(archive_dir, u'{0}.{1}-{2}.{3}.tar.gz'.\
+                                    format(name, segment[0][0],
+                                           segment[-1][0], seq))
+            try:
+                os.link(tmp_path, seg_path)
+                break
+            except (OSError, IOError, ), e:
+                if e.errno != errno.EEXIST:
+                    raise e
+                seq += 1
+    finally:
+        os.unlink(tmp_path)
+    # make the segment durable before removing what it holds
+    fd = os.open(archive_dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return archived
+
+def _expire(trg_queue, d_path, name, cutoff, max_count, archive_dir):
+    '''Expire items from one done or fail directory'''
+    items, shards = _listdir(trg_queue, d_path)
+    # oldest first
+    items.sort()
+    n_expired = 0
+    if max_count is not None:
+        n_expired = max(0, len(items) - max_count)
+    if cutoff is not None:
+        n_expired = max(n_expired, bisect.bisect_left(items, ( cutoff, )))
+    expired = 0
+    for start in xrange(0, n_expired, _SEGMENT_SIZE):
+        segment = items[start:min(n_expired, start + _SEGMENT_SIZE)]
+        if archive_dir is not None:
+            segment = _archive(archive_dir, name, d_path, segment)
+        for stamp, item_id, s_path in segment:
+            try:
+                os.unlink(os.path.join(s_path, item_id))
+                expired += 1
+            except (OSError, IOError, ), e:
+                if e.errno != errno.ENOENT:
+                    raise e
+    # remove emptied shards, they are re-made as items are done or failed
+    if expired:
+        for s_path in shards:
+            if s_path != d_path:
+                try:
+                    os.rmdir(s_path)
+                except (OSError, IOError, ), e:
+                    if e.errno not in ( errno.ENOENT, errno.ENOTEMPTY,
+                                        errno.EEXIST, errno.ENOTDIR, ):
+                        raise e
+    return expired
+
+####### EXPOSED METHODS #######
+def expire(trg_queue, max_age=None, max_count=None, archive_dir=None,
+           host=None, done=True, fail=True, now=None):
+    '''Expire items from the done and fail directories of a queue (or host
+       queue): those enqueued more than max_age seconds before now, and
+       those older than the newest max_count items of each directory.
+       Expired items are removed; should archive_dir be passed, they are
+       first rolled into gzip'd tar segments of up to 10000 items in
+       archive_dir, named for the queue (and host), directory and the
+       oldest and newest enqueue time in each.  Returns the number of items
+       expired.'''
+    if max_age is None and max_count is None:
+        raise ValueError(u'max_age or max_count is required')
+    now = datetime.datetime.now() if now is None else now
+    cutoff = None
+    if max_age is not None:
+        cutoff = fmt_time(now - datetime.timedelta(seconds=max_age),
+                          _FIXED_TIMEFMT, _c.FSQ_CHARSET)
+    expired = 0
+    for expire_dir, trg_dir, dir_name in (
+            ( done, fsq_path.done, _c.FSQ_DONE, ),
+            ( fail, fsq_path.fail, _c.FSQ_FAIL, ), ):
+        if not expire_dir:
+            continue
+        name = u'.'.join([ fsq_path.valid_name(trg_queue) ] + ([] if host is\
+                         None else [ fsq_path.valid_name(host) ]) +\
+                         [ dir_name ])
+        try:
+            expired += _expire(trg_queue, trg_dir(trg_queue, host=host),
+                               name, cutoff, max_count, archive_dir)
+        except (OSError, IOError, ), e:
+            if e.errno == errno.ENOENT:
+                raise FSQExpireError(e.errno, u'no such queue:'\
+                                     u' {0}'.format(trg_queue))
+            elif isinstance(e, FSQError):
+                raise e
+            raise FSQExpireError(e.errno, wrap_io_os_err(e))
+        except tarfile.TarError, e:
+            raise FSQExpireError(errno.EIO, u'cannot archive items:'\
+                                 u' {0}'.format(e))
+    return expired
@@ -16,16 +16,304 @@
 # This software is for POSIX compliant systems only.
 import os
 import errno
+import time
 
 from . import constants as _c, FSQWorkItem, path as fsq_path, FSQScanError,\
               FSQCannotLockError, FSQWorkItemError, FSQDownError, FSQError,\
-              is_down, hosts as fsq_hosts, host_is_down
+              is_down, hosts as fsq_hosts, host_is_down, FSQWatch,\
+              FSQWatchError, reclaim, instrument as _i, lease as fsq_lease
 from .internal import wrap_io_os_err
 
+# scandir streams directory entries, where listdir reads the whole directory
+# before returning; python 2.7 has no os.scandir, so it is a dependency of
+# fsq, used for unsorted scans.  Should it be missing (e.g. running from a
+# checkout), unsorted scans fall back to listdir, and are merely not sorted.
+try:
+    from scandir import scandir as _scandir
+except ImportError:
+    _scandir = None
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+# directory mtimes this close to now may yet be bumped by a change within the
+# same tick of file-system time, and are not trusted by FSQScanCursor
+_RACY_MTIME = 1
+
+def _listdir(queue, path):
+    started = _i.start()
+    names = os.listdir(path)
+    _i.record(u'scan.listdir', queue, started)
+    return names
+
+def _sort(queue, item_ids, key=None):
+    started = _i.start()
+    item_ids.sort(key=key)
+    _i.record(u'scan.sort', queue, started)
+    return item_ids
+
+def _listshard(queue, s_path):
+    '''List a shard directory, which may be removed from under us'''
+    try:
+        return _listdir(queue, s_path)
+    except (OSError, IOError, ), e:
+        if e.errno in ( errno.ENOENT, errno.ENOTDIR, ):
+            return []
+        raise e
+
+def _prune(s_path):
+    '''Remove an empty shard directory, enqueueing re-makes it as need be'''
+    try:
+        os.rmdir(s_path)
+    except (OSError, IOError, ), e:
+        if e.errno not in ( errno.ENOENT, errno.ENOTEMPTY, errno.EEXIST, ):
+            raise e
+
+def _itershards(queue, q_path, shards, sort, prune):
+    '''Generate the item ids in each of shards, listing each shard only as
+       the last is exhausted, and pruning empty shards (but the last)'''
+    for i, p_shard in enumerate(shards):
+        s_path = os.path.join(q_path, p_shard)
+        item_ids = _listshard(queue, s_path)
+        if not item_ids:
+            if prune and i + 1 < len(shards):
+                _prune(s_path)
+            continue
+        for item_id in (_sort(queue, item_ids) if sort else item_ids):
+            yield item_id
+
+def _iterdir(queue, p_layout, host=None, sort=False, priority=None):
+    '''Return an iterable of the item ids in a queue (or host queue, or lane
+       of priority) with shard layout p_layout, sorted if sort, else streamed
+       from the directory (or listed up front, should scandir be missing).
+       Shards are listed in order, so that sorted time sharded queues are
+       listed one shard at a time.'''
+    q_path = fsq_path.queue(queue, host=host, priority=priority)
+    if p_layout is None:
+        if sort:
+            return _sort(queue, _listdir(queue, q_path))
+        elif _scandir is None:
+            return iter(_listdir(queue, q_path))
+        return ( entry.name for entry in _scandir(q_path) )
+    shards = _sort(queue, _listdir(queue, q_path))
+    if sort and p_layout[0] != u'time':
+        return _sort(queue, list(_itershards(queue, q_path, shards, False,
+                                             False)))
+    return _itershards(queue, q_path, shards, sort, p_layout[0] == u'time')
+
+def _rotate(item_ids, offset):
+    '''Return a list of item_ids starting offset (a fraction) of the way
+       through, and wrapping around to the first'''
+    item_ids = item_ids if isinstance(item_ids, list) else list(item_ids)
+    i = int(len(item_ids)*offset)
+    return item_ids[i:] + item_ids[:i]
+
+def _lanes(queue):
+    '''Return the priorities of the lanes of a queue, highest first, and
+       including the default lane (0), or [] should the queue have no
+       lanes'''
+    try:
+        names = os.listdir(fsq_path.lanes(queue))
+    except (OSError, IOError, ), e:
+        if e.errno in ( errno.ENOENT, errno.ENOTDIR, ):
+            return []
+        raise e
+    priorities = set()
+    for name in names:
+        try:
+            priorities.add(int(name))
+        except ValueError:
+            continue
+    if not priorities:
+        return []
+    priorities.add(0)
+    return sorted(priorities, reverse=True)
+
+def _iterlane(queue, priority, list_lane, offset):
+    '''Generate ( priority, item_id, ) for each item in a lane, listing the
+       lane only as the first item is asked for; a lane removed from under us
+       (e.g. by uninstall) is empty'''
+    try:
+        item_ids = list_lane(priority)
+        if offset:
+            item_ids = _rotate(item_ids, offset)
+        for item_id in item_ids:
+            yield priority, item_id
+    except (OSError, IOError, ), e:
+        if e.errno not in ( errno.ENOENT, errno.ENOTDIR, ):
+            raise FSQScanError(e.errno, wrap_io_os_err(e))
+
+def _iterlanes(lanes, weights=None):
+    '''Generate ( priority, item_id, ) from each of lanes, highest priority
+       first: each lane is drained before the next is listed, or should
+       weights (priority -> weight, default: 1) be passed, up to weight items
+       are taken from each lane in turn'''
+    if not weights:
+        for priority, lane in lanes:
+            for item in lane:
+                yield item
+        return
+    lanes = [ ( lane, weights.get(priority, 1), ) for priority, lane in lanes ]
+    while lanes:
+        for turn in list(lanes):
+            lane, weight = turn
+            for i in xrange(weight):
+                try:
+                    item = lane.next()
+                except StopIteration:
+                    lanes.remove(turn)
+                    break
+                yield item
+
+def _listlane(queue, p_layout, priority, sort, cursor):
+    '''Return an iterable of the item ids in a lane (see _iterdir)'''
+    if cursor is not None:
+        return cursor.listdir(queue, priority=priority)
+    return _iterdir(queue, p_layout, sort=sort, priority=priority)
+
+def _iterhosts(queue, p_layout, hosts):
+    '''Return an iterator over ( host, item_id, ) for each host queue'''
+    for trg_host in hosts:
+        try:
+            host_ids = _iterdir(queue, p_layout, trg_host)
+        except (OSError, IOError, ), e:
+            if e.errno == errno.ENOENT:
+                raise FSQScanError(e.errno, u'no such queue:'\
+                                   u' {0}'.format(queue))
+            raise FSQScanError(e.errno, wrap_io_os_err(e))
+        for item in host_ids:
+            yield trg_host, item
+
 ####### EXPOSED METHODS AND CLASSES #######
+class FSQScanCursor(object):
+    '''FSQScanCursor remembers the state of a queue directory between scans,
+       so that successive scans of the same queue yield only items that are
+       new since the last pass, e.g.
+
+        cursor = FSQScanCursor()
+        while True:
+            for item in scan('a_queue', cursor=cursor):
+                ...
+
+       For each queue (or host queue, or lane) scanned, the cursor stores the
+       mtime of the queue directory (or of each shard directory, for sharded
+       queues) and the item ids it has seen there.  Should the mtime be
+       unchanged, the directory is not listed at all; otherwise only ids not
+       seen on the last pass are sorted and yielded.  An id is seen only once
+       it is yielded, or skipped as claimed or done by another, and the mtime
+       is kept only once every new id in the directory is seen, so that ids
+       not reached by a pass which is abandoned part way (e.g. on break, or
+       on error) are yielded by the next.  Retried items are renamed (their
+       tries are incremented), and so are always new.  Items skipped because
+       they are locked by another process are forgotten, so that they are
+       tried again on the next pass.
+
+       BEWARE: an item which is yielded and neither done'd nor retried (e.g.
+       scanning with no_done) will not be yielded again by the same cursor.'''
+    ####### MAGICAL METHODS AND ATTRS #######
+    def __init__(self):
+        # ( queue, host, priority, ) or ( queue, host, priority, shard, ) ->
+        # dir mtime of last pass
+        self.mtimes = {}
+        # ( queue, host, priority, ) or ( queue, host, priority, shard, ) ->
+        # set of item ids seen on last pass
+        self.seen = {}
+        # ( queue, host, priority, ) or ( queue, host, priority, shard, ) ->
+        # ( dir mtime, set of new item ids not yet seen, ) for the current
+        # pass; the mtime is None if it is not to be trusted
+        self.pending = {}
+        # ( queue, host, priority, ) -> shards of a sharded queue on last pass
+        self.shards = {}
+        # queue -> shard layout, read as each queue is listed
+        self.layouts = {}
+
+    def _listdir(self, key, path, queue):
+        '''Return the item ids in path not seen on the last pass'''
+        mtime = os.stat(path).st_mtime
+        if key in self.mtimes and mtime == self.mtimes[key]:
+            return []
+        item_ids = _listdir(queue, path)
+        seen = self.seen.get(key, frozenset())
+        new_ids = [ i for i in item_ids if i not in seen ]
+        # forget ids since removed, new ids are seen as they are yielded
+        self.seen[key] = set(seen.intersection(item_ids))
+        self.mtimes.pop(key, None)
+        # don't trust an mtime that may yet change within the same tick
+        if mtime >= time.time() - _RACY_MTIME:
+            mtime = None
+        if new_ids:
+            self.pending[key] = ( mtime, set(new_ids), )
+        else:
+            self.pending.pop(key, None)
+            if mtime is not None:
+                self.mtimes[key] = mtime
+        return new_ids
+
+    def _layout(self, queue):
+        '''The shard layout of queue, as read when it was last listed (or
+           now, should it not have been)'''
+        try:
+            return self.layouts[queue]
+        except KeyError:
+            return self.layouts.setdefault(queue, fsq_path.layout(queue))
+
+    def _key(self, queue, item_id, host, priority):
+        p_shard = fsq_path.shard(self._layout(queue), item_id)
+        if p_shard is None:
+            return ( queue, host, priority or 0, )
+        return ( queue, host, priority or 0, p_shard, )
+
+    ####### EXPOSED METHODS AND ATTRS #######
+    def listdir(self, queue, host=None, priority=None):
+        '''Return a sorted list of item ids in the queue directory (or lane
+           of priority) of queue that were not seen on the last pass'''
+        q_path = fsq_path.queue(queue, host=host, priority=priority)
+        key = ( queue, host, priority or 0, )
+        # re-read on each pass, should the queue have been re-installed
+        self.layouts[queue] = fsq_path.layout(queue)
+        if self.layouts[queue] is None:
+            return _sort(queue, self._listdir(key, q_path, queue))
+        new_ids = []
+        shards = set(_listdir(queue, q_path))
+        for p_shard in shards:
+            try:
+                new_ids.extend(self._listdir(key + ( p_shard, ),
+                                             os.path.join(q_path, p_shard),
+                                             queue))
+            except (OSError, IOError, ), e:
+                if e.errno not in ( errno.ENOENT, errno.ENOTDIR, ):
+                    raise e
+        # forget shards removed since the last pass
+        for p_shard in self.shards.get(key, set()) - shards:
+            self.seen.pop(key + ( p_shard, ), None)
+            self.mtimes.pop(key + ( p_shard, ), None)
+            self.pending.pop(key + ( p_shard, ), None)
+        self.shards[key] = shards
+        return _sort(queue, new_ids)
+
+    def mark(self, queue, item_id, host=None, priority=None):
+        '''Mark an item id seen, so that it is not yielded on the next
+           pass'''
+        key = self._key(queue, item_id, host, priority)
+        self.seen.setdefault(key, set()).add(item_id)
+        try:
+            mtime, new_ids = self.pending[key]
+        except KeyError:
+            return
+        new_ids.discard(item_id)
+        if not new_ids:
+            del self.pending[key]
+            if mtime is not None:
+                self.mtimes[key] = mtime
+
+    def forget(self, queue, item_id, host=None, priority=None):
+        '''Forget an item id, so that it is yielded again on the next pass'''
+        key = self._key(queue, item_id, host, priority)
+        self.seen.get(key, set()).discard(item_id)
+        self.mtimes.pop(key, None)
+
 class FSQScanGenerator(object):
     '''FSQScanGenerator is a Generator object for yielding FSQWorkItems from a
-       list of queue item ids, typcially passed in via the scan function.
+       list (or any iterable) of queue item ids, typcially passed in via the
+       scan function.  Item ids are consumed lazily, as items are yielded.
 
        Should a queue item be exclusively locked by another operation,
        FSQScanGenerator will quietly skip the item; FSQScanGenerator will also
@@ -39,10 +327,26 @@ class FSQScanGenerator(object):
        down-files, pass in None or an empty string as the kwarg ``down'', this
        functionality is useful for introspecting down'ed queues.
 
+       As stat'ing down-files before each item is costly for large queues,
+       the down_every and down_interval kwargs (defaulting to FSQ_DOWN_EVERY
+       and FSQ_DOWN_INTERVAL) allow the result to be re-used until either
+       down_every items have been dispatched, or down_interval seconds have
+       passed, since the last check.  A value of 0 disables either.  By
+       default down-files are checked before each item.
+
        FSQScanGenerator is intended to be a minimalist object, capable of
        reverse engineering to a C-struct.  The C-struct will be similar to FTS
        (man 3 fts).
 
+       Should lease (default: FSQ_LEASE) be non-0, items are claimed for
+       lease seconds rather than locked (see FSQWorkItem); items claimed by
+       another process are skipped as though done.  Items are claimed
+       before an FSQWorkItem is constructed, so that skipping an item
+       claimed by another costs a failed rename, and nothing more.
+
+       Should lanes be passed as True, item_ids are ( priority, item_id, )
+       tuples, and each item is found in the lane of its priority.
+
        BEWARE: If you choose not to lock, the item you are working on may be
        worked on by others, and may be moved (on failure or success) out from
        underneath you.  Should you send lock=False, it is assumed you are
@@ -51,25 +355,43 @@ class FSQScanGenerator(object):
     ####### MAGICAL METHODS AND ATTRS #######
     def __init__(self, queue, item_ids, lock=None, ttl=None,
                  max_tries=None, ignore_down=False, no_open=False,
-                 host=False):
-        '''Construct an FSQScanGenerator object from a list of item_ids and a
-           queue name.  The lock kwarg will override the default locking
-           preference (taken from environment).'''
+                 host=False, cursor=None, down_every=None,
+                 down_interval=None, lease=None, lanes=False):
+        '''Construct an FSQScanGenerator object from an iterable of item_ids
+           and a queue name.  The lock and lease kwargs will override the
+           default locking and leasing preferences (taken from environment).
+           Should a cursor be passed, items are marked seen by the cursor as
+           they are yielded or skipped, and locked items are forgotten.'''
         # index of current item
         self._index = -1
+        # iterator over item ids
+        self._item_ids = iter(item_ids)
 
         # current item
         self.item = None
         self.queue = queue
         self.host = host
+        self.lanes = lanes
+        # read once, and passed to each item
+        self.layout = fsq_path.layout(queue)
 
         # list of item ids
         self.item_ids = item_ids
         self.lock = _c.FSQ_LOCK if lock is None else lock
         self.ttl = _c.FSQ_TTL if ttl is None else ttl
         self.max_tries = _c.FSQ_MAX_TRIES if max_tries is None else max_tries
+        self.lease = _c.FSQ_LEASE if lease is None else lease
         self.ignore_down = ignore_down
         self.no_open = no_open
+        self.cursor = cursor
+        self.down_every = _c.FSQ_DOWN_EVERY if down_every is None\
+                                            else down_every
+        self.down_interval = _c.FSQ_DOWN_INTERVAL if down_interval is None\
+                                                  else down_interval
+        # host -> down-ness, cleared when down_every or down_interval pass
+        self._down = {}
+        self._down_index = 0
+        self._down_time = time.time()
 
     def __iter__(self):
         return self
@@ -79,38 +401,86 @@ class FSQScanGenerator(object):
         if hasattr(self, 'item'):
             del self.item
 
+    ####### INTERNAL METHODS #######
+    def _is_down(self, host):
+        '''Return True if the queue (and host queue) are down, re-using the
+           last answer until down_every items or down_interval seconds have
+           passed'''
+        if self.down_every and\
+                self._index - self._down_index >= self.down_every:
+            self._down.clear()
+        elif self.down_interval and\
+                time.time() - self._down_time >= self.down_interval:
+            self._down.clear()
+        if not self._down:
+            self._down_index = self._index
+            self._down_time = time.time()
+        try:
+            return self._down[host]
+        except KeyError:
+            down = is_down(self.queue) and ( not host or
+                   host_is_down(self.queue, host))
+            self._down[host] = down
+            return down
+
+    def _mark(self, item_id, host, priority):
+        '''Mark an item id seen by the cursor, if any'''
+        if self.cursor is not None:
+            self.cursor.mark(self.queue, item_id, host=host,
+                             priority=priority)
+
     def next(self):
-        while self._index < len(self.item_ids)-1:
+        for item in self._item_ids:
             self._index += 1
             # always destroy self.item to close file if necessary
             if getattr(self, 'item', None) is not None:
                 del self.item
             if self.host:
-                host = self.item_ids[self._index][0]
-                item = self.item_ids[self._index][1]
+                host, item = item
             else:
                 host = None
-                item = self.item_ids[self._index]
-            if not self.ignore_down and is_down(self.queue) and ( not host or
-                    host_is_down(self.queue, host)):
+            priority = None
+            if self.lanes:
+                priority, item = item
+            if not self.ignore_down and self._is_down(host):
                 raise FSQDownError(errno.EAGAIN, u'queue {0}: is'\
                                    u' down'.format(self.queue))
+            claimed = None
+            if self.lease and not self.no_open:
+                try:
+                    claimed = fsq_lease.claim(self.queue, item, self.lease,
+                                              host=host, priority=priority,
+                                              layout=self.layout)
+                except (OSError, IOError, ), e:
+                    # claimed (or done) by another first
+                    if e.errno == errno.ENOENT:
+                        self._mark(item, host, priority)
+                        continue
+                    raise FSQWorkItemError(e.errno, wrap_io_os_err(e))
             try:
                 self.item = FSQWorkItem(self.queue,
                                         item,
                                         lock=self.lock, ttl=self.ttl,
                                         max_tries=self.max_tries,
                                         no_open=self.no_open,
-                                        host=host)
+                                        host=host, lease=self.lease,
+                                        claimed=claimed, priority=priority,
+                                        layout=self.layout)
             except (FSQWorkItemError, FSQCannotLockError, ), e:
                 # we discard on ENOENT -- e.g. something else already did the
                 #  work
                 # or EAGAIN -- e.g. cannot lock because something else is
                 #  already doing the work
                 if e.errno == errno.EAGAIN or e.errno == errno.ENOENT:
+                    if e.errno == errno.EAGAIN and self.cursor is not None:
+                        self.cursor.forget(self.queue, item, host=host,
+                                           priority=priority)
+                    else:
+                        self._mark(item, host, priority)
                     continue
                 # else raise
                 raise e
+            self._mark(item, host, priority)
             return self.item
 
         if getattr(self, 'item', None) is not None:
@@ -129,37 +499,197 @@ def scan_forever(queue, *args, **kwargs):
        It takes all the same parameters as scan(), plus process_once_now,
        which is a boolean to determine if an initial .scan() is run before
        listening to the trigger. This argument defaults to True.
+
+       Should watch be passed as True, scan_forever will use inotify(7) to
+       block for items linked or renamed into the queue, and will scan only
+       those items rather than re-listing the queue; producers need not pull
+       the trigger.  Should inotify be unavailable (or should host be
+       passed), scan_forever falls back to the trigger.  As events name only
+       new items, items skipped on a wakeup (e.g. locked by a consumer that
+       then died without done'ing them) are not seen again until the whole
+       queue is rescanned, every rescan (default: FSQ_WATCH_RESCAN) seconds;
+       0 disables the rescan.  Lanes (see scan) are watched too, so that
+       items enqueued with a priority wake scan_forever as items linked into
+       the queue directory do.
     """
-    process_once_now = kwargs.get('process_once_now', True)
-    if process_once_now:
-        for work in scan(queue, *args, **kwargs):
-            yield work
-    while True:
-        with open(fsq_path.trigger(queue), 'rb') as t:
-            t.read(1)
-        for work in scan(queue, *args, **kwargs):
-            yield work
+    process_once_now = kwargs.pop('process_once_now', True)
+    watch = kwargs.pop('watch', False)
+    rescan = kwargs.pop('rescan', _c.FSQ_WATCH_RESCAN)
+    watcher = None
+    if watch and not kwargs.get('host') and kwargs.get('hosts') is None:
+        try:
+            # watch before the first scan, so nothing slips between the two
+            watcher = FSQWatch(queue, lanes=True)
+        except FSQWatchError, e:
+            if e.errno == errno.ENOENT:
+                raise FSQScanError(e.errno, u'no such queue:'\
+                                   u' {0}'.format(queue))
+    try:
+        if process_once_now:
+            for work in scan(queue, *args, **kwargs):
+                yield work
+        while True:
+            item_ids = None
+            if watcher is None:
+                with open(fsq_path.trigger(queue), 'rb') as t:
+                    t.read(1)
+            else:
+                # None on event overflow or timeout, in which case we rescan
+                item_ids = watcher.wait(timeout=rescan or None)
+            for work in scan(queue, *args, item_ids=item_ids, **kwargs):
+                yield work
+    finally:
+        if watcher is not None:
+            watcher.close()
 
 def scan(queue, lock=None, ttl=None, max_tries=None, ignore_down=False,
-         no_open=False, generator=FSQScanGenerator, host=False, hosts=None):
+         no_open=False, generator=FSQScanGenerator, host=False, hosts=None,
+         item_ids=None, cursor=None, sort=True, down_every=None,
+         down_interval=None, lease=None, offset=None, weights=None):
     '''Given a queue, generate a list of files in that queue, and pass it to
        FSQScanGenerator for iteration.  The generator kwarg is provided here
-       as a means of implementing a custom generator, use with caution.'''
+       as a means of implementing a custom generator, use with caution.
+
+       Should item_ids be passed, the queue is not listed, and only those
+       items are scanned (e.g. items reported by FSQWatch).  Should an
+       FSQScanCursor be passed as cursor, only items new since the last scan
+       with the same cursor are scanned.
+
+       Should sort be passed as False, items are scanned in directory order
+       rather than time then entropy order, and are streamed from the queue
+       directory as they are yielded, rather than being listed and sorted up
+       front -- so the first item is available at once, even for very large
+       queues.  Streaming needs the scandir package (a dependency of fsq);
+       should it be missing, the queue is listed up front, but not sorted.
+       Unsorted scans are useful for draining a backlog where the
+       order of work is unimportant.
+
+       Should lease (default: FSQ_LEASE) be non-0, items whose leases have
+       lapsed are reclaimed into the queue (or host queues) before it is
+       listed, and items are claimed for lease seconds as they are yielded,
+       rather than locked.
+
+       Should offset (a fraction, 0 <= offset < 1) be passed, items are
+       scanned starting offset of the way through the queue, wrapping around
+       to the first item; consumers of one queue each passing a different
+       offset (e.g. i/n for the i'th of n consumers) each start on different
+       items, rather than all contending for the oldest.  Combined with a
+       lease, each item is won by exactly one consumer with a rename, and
+       the losers skip it on ENOENT without opening it.  Scanning with an
+       offset lists the whole queue up front, even when not sorted.
+
+       Items enqueued with a priority are held in a lane per priority (see
+       fsq.path.lanes), and lanes of higher priority are drained first, the
+       queue directory itself being the lane of priority 0; each lane is
+       listed and sorted on its own, as the last is exhausted, so urgent work
+       never waits on a sort of the backlog.  Should weights (a dict of
+       priority -> weight, default: 1) be passed, lanes are instead drained
+       by weighted fair share: up to weight items are taken from each lane in
+       turn, highest priority first.  An offset applies to each lane.
+       Should item_ids be passed, they are taken to be the items of the
+       queue directory, and lanes are listed as well; should any be passed
+       as ( priority, item_id, ) pairs (e.g. as reported by FSQWatch with
+       lanes), no lane is listed, and only those items are scanned, each in
+       the lane of its priority.  Lanes are not scanned for host queues.
+
+       The ignore_down, down_every and down_interval kwargs are passed through
+       to the generator, see FSQScanGenerator.'''
     lock = _c.FSQ_LOCK if lock is None else lock
     ttl = _c.FSQ_TTL if lock is None else ttl
     max_tries = _c.FSQ_MAX_TRIES if max_tries is None else max_tries
-    item_ids = []
+    lease = _c.FSQ_LEASE if lease is None else lease
+    if offset is not None and not 0 <= offset < 1:
+        raise ValueError(u'offset must be at least 0, and less than 1, not:'\
+                         u' {0}'.format(offset))
+    if weights:
+        weights = dict(( fsq_path.valid_priority(priority), int(weight), )
+                       for priority, weight in weights.iteritems())
+        if 1 > min(weights.itervalues()):
+            raise ValueError(u'weights must be at least 1')
+    gen_kwargs = { 'lock': lock, 'ttl': ttl, 'max_tries': max_tries,
+                   'no_open': no_open, 'host': host, }
+    # only pass what is set, so as not to break custom generators
+    for kwarg, val in (( 'ignore_down', ignore_down or None, ),
+                       ( 'cursor', cursor, ),
+                       ( 'down_every', down_every, ),
+                       ( 'down_interval', down_interval, ),
+                       ( 'lease', lease or None, ), ):
+        if val is not None:
+            gen_kwargs[kwarg] = val
     try:
+        # reclaim even when given item_ids, as reclaimed items are renamed
+        # into the queue, and so are seen by FSQWatch
+        if lease:
+            if not host and hosts is None:
+                reclaim(queue)
+            else:
+                for trg_host in (fsq_hosts(queue) if hosts is None else hosts):
+                    reclaim(queue, host=trg_host)
+        priorities = []
+        # priority -> item ids, should item_ids be given with priorities
+        given_lanes = None
         if not host and hosts is None:
-            item_ids = os.listdir(fsq_path.queue(queue))
-            item_ids.sort()
+            if item_ids is not None:
+                item_ids = list(item_ids)
+                if any(isinstance(i, tuple) for i in item_ids):
+                    given_lanes = {}
+                    for item in item_ids:
+                        priority, item = item if isinstance(item, tuple)\
+                                              else ( 0, item, )
+                        given_lanes.setdefault(fsq_path.valid_priority(
+                                               priority), []).append(item)
+            if given_lanes is not None:
+                priorities = sorted(given_lanes, reverse=True)
+            else:
+                priorities = _lanes(queue)
+        if item_ids is not None and not priorities:
+            item_ids = sorted(item_ids, key=(lambda x: x[1]) if host else\
+                              None)
+            if offset:
+                item_ids = _rotate(item_ids, offset)
+            return generator(queue, item_ids, **gen_kwargs)
+        # read the shard layout once, for every lane (or host queue)
+        p_layout = fsq_path.layout(queue)
+        if priorities:
+            given = None if item_ids is None else sorted(item_ids)
+            def list_lane(priority):
+                if given_lanes is not None:
+                    return sorted(given_lanes[priority])
+                elif not priority and given is not None:
+                    return given
+                return _listlane(queue, p_layout, priority, sort, cursor)
+            item_ids = _iterlanes([ ( p, _iterlane(queue, p, list_lane,
+                                                   offset), )
+                                    for p in priorities ], weights)
+            gen_kwargs['lanes'] = True
+            return generator(queue, item_ids, **gen_kwargs)
+        item_ids = []
+        if not sort and cursor is None:
+            if not host and hosts is None:
+                item_ids = _iterdir(queue, p_layout)
+            else:
+                if hosts is None:
+                    hosts = fsq_hosts(queue)
+                # list each host queue only as the last is exhausted
+                item_ids = _iterhosts(queue, p_layout, hosts)
+        elif not host and hosts is None:
+            if cursor is None:
+                item_ids = _iterdir(queue, p_layout, sort=True)
+            else:
+                item_ids = cursor.listdir(queue)
         else:
             if hosts is None:
                 hosts = fsq_hosts(queue)
             for trg_host in hosts:
-                for item in os.listdir(fsq_path.queue(queue, trg_host)):
+                if cursor is None:
+                    host_ids = _iterdir(queue, p_layout, trg_host)
+                else:
+                    host_ids = cursor.listdir(queue, trg_host)
+                for item in host_ids:
                     item_ids.append((trg_host, item))
-            item_ids.sort(key=lambda x: x[1])
+            _sort(queue, item_ids, key=lambda x: x[1])
+        if offset:
+            item_ids = _rotate(item_ids, offset)
     except (OSError, IOError, ), e:
         if e.errno == errno.ENOENT:
             raise FSQScanError(e.errno, u'no such queue:'\
@@ -169,5 +699,4 @@ def scan(queue, lock=None, ttl=None, max_tries=None, ignore_down=False,
         raise FSQScanError(e.errno, wrap_io_os_err(e))
 
     # sort here should yield time then entropy sorted
-    return generator(queue, item_ids, lock=lock, ttl=ttl, max_tries=max_tries,
-                     no_open=no_open, host=host)
+    return generator(queue, item_ids, **gen_kwargs)
@@ -0,0 +1,345 @@
+# fsq -- a python library for manipulating and introspecting FSQ queues
+# @author: Matthew Story <matt.story@axial.net>
+#
+# fsq/tests/bench.py -- throughput benchmarks, emitted as JSON: run_bench
+#
+#   usage: python -m fsq.tests.bench [-s|--scale=float] [-o|--output=path]
+#                                    [bench [bench [...]]]
+#
+#   benchmarks install (and uninstall) their own queues in FSQ_ROOT, which
+#   must exist; point FSQ_ROOT at a tmpfs to take the disk out of the
+#   numbers, or at a local dir to put it in.
+#
+#   the daemons benchmark runs fsq-jsonrpcd and fsq-asyncd from
+#   FSQ_EXEC_DIR (default: libexec/fsq of this checkout) on a free local
+#   port, and drives each with the same jsonrpclib client.
+#
+# This software is for POSIX compliant systems only.
+import errno
+import getopt
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import jsonrpclib
+
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, uninstall, senqueue, scan, reenqueue, construct,\
+               deconstruct, fork_exec_items, FSQWorkItem, constants as _c
+
+####### INTERNAL MODULE FUNCTIONS AND ATTRIBUTES #######
+_PAYLOAD_SIZES = ( 0, 1024, 65536, 1048576, )
+_BACKLOGS = ( 100, 1000, 10000, )
+_FANOUTS = ( 1, 4, 16, )
+_CONSUMERS = ( 1, 4, 16, )
+_ARGS = ( u'foo', u'bar_baz', u'qu/ux', u'%20', )
+_CLIENTS = ( 1, 8, )
+# daemon -> args, with as many workers (or threads) as the most clients
+_DAEMONS = ( ( u'jsonrpcd', ( '-w', '8', ), ),
+             ( u'asyncd', ( '-t', '8', ), ), )
+_DAEMON_WAIT = 10
+
+def _queue(name, hosts=None):
+    queue = u'bench_{0}_{1}'.format(name, os.getpid())
+    install(queue, hosts=hosts)
+    return queue
+
+def _rate(n, secs):
+    return n/secs if secs else None
+
+def _n(n, scale):
+    return max(1, int(n*scale))
+
+def _exec_dir():
+    if _c.FSQ_EXEC_DIR is not None:
+        return _c.FSQ_EXEC_DIR
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        os.path.pardir, os.path.pardir, 'libexec', 'fsq')
+
+def _free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(( '127.0.0.1', 0, ))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+def _daemon(name, args, port):
+    '''Start a daemon on port, and wait for it to accept'''
+    env = dict(os.environ)
+    env['FSQ_ROOT'] = _c.FSQ_ROOT.encode(_c.FSQ_CHARSET)
+    # the daemon imports the same fsq as we do
+    env['PYTHONPATH'] = os.pathsep.join([ os.path.dirname(os.path.dirname(
+                                          os.path.dirname(os.path.abspath(
+                                          __file__)))) ] + filter(None, [
+                                          env.get('PYTHONPATH') ]))
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen([ sys.executable, os.path.join(_exec_dir(),
+                                  '{0}.py'.format(name)) ] + list(args) +\
+                                [ '127.0.0.1', str(port), ], env=env,
+                                stdout=devnull, stderr=devnull)
+    deadline = time.time() + _DAEMON_WAIT
+    while time.time() < deadline and proc.poll() is None:
+        try:
+            socket.create_connection(( '127.0.0.1', port, )).close()
+            return proc
+        except socket.error, e:
+            if e.errno != errno.ECONNREFUSED:
+                raise e
+            time.sleep(0.05)
+    _stop(proc)
+    raise ValueError(u'{0} did not start'.format(name))
+
+def _stop(proc):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGTERM)
+    proc.wait()
+
+####### EXPOSED METHODS #######
+def bench_senqueue(scale=1.0):
+    '''senqueue items/sec and MB/sec by payload size'''
+    results = []
+    for size in _PAYLOAD_SIZES:
+        queue = _queue(u'senqueue')
+        try:
+            payload = 'x'*size
+            # roughly the same bytes for the larger payloads
+            n = _n(min(2000, 64*1048576/max(size, 1)), scale)
+            start = time.time()
+            for i in xrange(n):
+                senqueue(queue, payload, i)
+            secs = time.time() - start
+            results.append({ 'payload_bytes': size, 'items': n,
+                             'seconds': secs, 'items_per_sec': _rate(n, secs),
+                             'mb_per_sec': _rate(n*size/1048576.0, secs), })
+        finally:
+            uninstall(queue)
+    return results
+
+def bench_scan(scale=1.0):
+    '''scan latency to the first item, and full scan rate, by backlog'''
+    results = []
+    for backlog in _BACKLOGS:
+        backlog = _n(backlog, scale)
+        queue = _queue(u'scan')
+        try:
+            for i in xrange(backlog):
+                senqueue(queue, '', i)
+            start = time.time()
+            items = scan(queue, no_open=True)
+            items.next()
+            first = time.time() - start
+            n = 1 + sum(1 for item in items)
+            secs = time.time() - start
+            results.append({ 'backlog': backlog, 'first_item_seconds': first,
+                             'seconds': secs, 'items_per_sec': _rate(n, secs),
+                           })
+        finally:
+            uninstall(queue)
+    return results
+
+def bench_fork_exec(scale=1.0):
+    '''fork_exec_items end-to-end items/sec, executing true(1)'''
+    n = _n(500, scale)
+    queue = _queue(u'fork_exec')
+    try:
+        for i in xrange(n):
+            senqueue(queue, '', i)
+        start = time.time()
+        fork_exec_items(queue, exec_args=( 'true', ))
+        secs = time.time() - start
+        left = len(os.listdir(os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)))
+        return { 'items': n, 'seconds': secs, 'items_per_sec': _rate(n, secs),
+                 'left_in_queue': left, }
+    finally:
+        uninstall(queue)
+
+def bench_consumers(scale=1.0):
+    '''items/sec drained by concurrent consumers, each locking every item,
+       or each claiming items with a lease from its own offset'''
+    results = []
+    for n_consumers in _CONSUMERS:
+        for lease in ( 0, 60, ):
+            n = _n(2000, scale)
+            queue = _queue(u'consumers')
+            try:
+                for i in xrange(n):
+                    senqueue(queue, '', i)
+                start = time.time()
+                pids = []
+                for consumer in xrange(n_consumers):
+                    pid = os.fork()
+                    if 0 == pid:
+                        rc = 0
+                        try:
+                            for item in scan(queue, lease=lease, offset=(
+                                    float(consumer)/n_consumers if lease\
+                                    else None)):
+                                item.success()
+                        except Exception:
+                            rc = 1
+                        os._exit(rc)
+                    pids.append(pid)
+                failed = 0
+                for pid in pids:
+                    failed += 0 != os.waitpid(pid, 0)[1]
+                secs = time.time() - start
+                left = len(os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                   _c.FSQ_QUEUE)))
+                results.append({ 'consumers': n_consumers,
+                                 'lease': bool(lease), 'items': n,
+                                 'seconds': secs,
+                                 'items_per_sec': _rate(n, secs),
+                                 'failed_consumers': failed,
+                                 'left_in_queue': left, })
+            finally:
+                uninstall(queue)
+    return results
+
+def bench_reenqueue(scale=1.0):
+    '''vreenqueue cost by number of host queues fanned out to'''
+    results = []
+    for n_hosts in _FANOUTS:
+        n = _n(200, scale)
+        src = _queue(u'reenqueue_src')
+        trg = _queue(u'reenqueue_trg', hosts=[ u'h{0}'.format(i)
+                                               for i in xrange(n_hosts) ])
+        try:
+            item_ids = [ senqueue(src, 'x'*4096, i) for i in xrange(n) ]
+            start = time.time()
+            for item_id in item_ids:
+                item = FSQWorkItem(src, item_id, lock=False)
+                try:
+                    reenqueue(item, trg, all_hosts=True)
+                finally:
+                    item.close()
+            secs = time.time() - start
+            results.append({ 'hosts': n_hosts, 'items': n, 'seconds': secs,
+                             'items_per_sec': _rate(n, secs),
+                             'copies_per_sec': _rate(n*n_hosts, secs), })
+        finally:
+            uninstall(src)
+            uninstall(trg)
+    return results
+
+def bench_construct(scale=1.0):
+    '''construct and deconstruct ops/sec'''
+    n = _n(100000, scale)
+    start = time.time()
+    for i in xrange(n):
+        name = construct(_ARGS)
+    construct_secs = time.time() - start
+    start = time.time()
+    for i in xrange(n):
+        deconstruct(name)
+    deconstruct_secs = time.time() - start
+    return { 'ops': n, 'construct_per_sec': _rate(n, construct_secs),
+             'deconstruct_per_sec': _rate(n, deconstruct_secs), }
+
+def bench_daemons(scale=1.0):
+    '''remote enqueue requests/sec and latency, fsq-jsonrpcd against
+       fsq-asyncd, by number of client threads'''
+    results = []
+    for name, args in _DAEMONS:
+        for n_clients in _CLIENTS:
+            n = _n(2000, scale)
+            src = _queue(u'daemons_src')
+            trg = _queue(u'daemons_trg')
+            port = _free_port()
+            proc = _daemon(name, args, port)
+            try:
+                item_ids = [ senqueue(src, '', i) for i in xrange(n) ]
+                payload = 'x'*1024
+                latencies = []
+                errors = []
+                def client(ids):
+                    server = jsonrpclib.Server('http://127.0.0.1:{0}'.format(
+                                               port))
+                    for item_id in ids:
+                        start = time.time()
+                        try:
+                            server.enqueue(item_id, trg, payload)
+                        except Exception, e:
+                            errors.append(e)
+                        latencies.append(time.time() - start)
+                threads = [ threading.Thread(target=client,
+                                             args=( item_ids[i::n_clients], ))
+                            for i in xrange(n_clients) ]
+                start = time.time()
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                secs = time.time() - start
+                results.append({ 'daemon': name, 'args': list(args),
+                                 'clients': n_clients, 'requests': n,
+                                 'seconds': secs,
+                                 'requests_per_sec': _rate(n, secs),
+                                 'latency_avg': sum(latencies)/n,
+                                 'latency_max': max(latencies),
+                                 'errors': len(errors), })
+            finally:
+                _stop(proc)
+                uninstall(src)
+                uninstall(trg)
+    return results
+
+BENCHES = ( ( 'senqueue', bench_senqueue, ), ( 'scan', bench_scan, ),
+            ( 'fork_exec', bench_fork_exec, ),
+            ( 'consumers', bench_consumers, ),
+            ( 'reenqueue', bench_reenqueue, ),
+            ( 'construct', bench_construct, ),
+            ( 'daemons', bench_daemons, ), )
+
+def run_bench(names=None, scale=1.0):
+    '''Run the named benchmarks (default: all), returning a JSON-able dict'''
+    benches = dict(BENCHES)
+    names = [ name for name, fn in BENCHES ] if not names else names
+    for name in names:
+        if name not in benches:
+            raise ValueError(u'no such benchmark: {0}'.format(name))
+    results = {}
+    for name in names:
+        results[name] = benches[name](scale)
+    return { 'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+             'python': platform.python_version(),
+             'platform': platform.platform(), 'root': _c.FSQ_ROOT,
+             'scale': scale, 'results': results, }
+
+def main(argv):
+    scale = 1.0
+    output = None
+    try:
+        opts, args = getopt.getopt(argv[1:], 'hs:o:', ( 'help', 'scale=',
+                                   'output=', ))
+        for flag, opt in opts:
+            if flag in ( '-s', '--scale', ):
+                scale = float(opt)
+            elif flag in ( '-o', '--output', ):
+                output = opt
+            elif flag in ( '-h', '--help', ):
+                print 'usage: {0} [-s|--scale=float] [-o|--output=path]'\
+                      ' [{1}]'.format(argv[0], '|'.join(name for name, fn in
+                                                         BENCHES))
+                return 0
+        results = run_bench(args, scale)
+    except ( getopt.GetoptError, ValueError, ), e:
+        print >> sys.stderr, '{0}: {1}'.format(argv[0], e)
+        return 100
+    f = sys.stdout if output is None else open(output, 'w')
+    try:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+    finally:
+        if output is not None:
+            f.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
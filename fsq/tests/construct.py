@@ -1,10 +1,12 @@
+import threading
+
 from . import FSQTestCase
 from .internal import normalize
 from . import constants as _test_c
 
 # FROM PAPA-BEAR IMPORT THE FOLLOWING
-from .. import construct, deconstruct, constants as _c, FSQCoerceError,\
-               FSQEncodeError, FSQMalformedEntryError
+from .. import construct, deconstruct, codec, FSQCodec, constants as _c,\
+               FSQCoerceError, FSQEncodeError, FSQMalformedEntryError
 
 class TestConstruct(FSQTestCase):
     def _cycle(self, args, fsq_encode=None, fsq_delimiter=None,
@@ -46,6 +48,43 @@ class TestConstruct(FSQTestCase):
                                     assert_eq=False)
         self.assertFalse(bool(len(set(against)^set(deconstructed))))
 
+    def test_codec(self):
+        normalize()
+        self.assertTrue(codec() is codec(_c.FSQ_DELIMITER, _c.FSQ_ENCODE,
+                                         _c.FSQ_CHARSET))
+        constructed = construct(_test_c.NORMAL)
+        # cached deconstructs are copies
+        delim, deconstructed = deconstruct(constructed)
+        deconstructed.append(_test_c.NORMAL[0])
+        delim, deconstructed = deconstruct(constructed)
+        self.assertEquals(list(_test_c.NORMAL), deconstructed)
+
+    def test_codecthreads(self):
+        '''Test that a codec cache shared by many threads stays bounded and
+           correct'''
+        normalize()
+        fsq_codec = FSQCodec(_c.FSQ_DELIMITER, _c.FSQ_ENCODE, _c.FSQ_CHARSET,
+                             cache_size=8)
+        names = [ fsq_codec.construct(( unicode(i), ) + _test_c.NORMAL)
+                  for i in range(32) ]
+        errors = []
+        def _deconstruct():
+            try:
+                for i in range(50):
+                    for j, name in enumerate(names):
+                        args = fsq_codec.deconstruct(name)
+                        if [ unicode(j), ] + list(_test_c.NORMAL) != args:
+                            errors.append(args)
+            except Exception, e:
+                errors.append(e)
+        threads = [ threading.Thread(target=_deconstruct) for i in range(8) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], errors)
+        self.assertTrue(8 >= len(fsq_codec.cache))
+
     def test_badconstruct(self):
         # assert failure for bad encode char
         normalize()
@@ -5,13 +5,17 @@ import signal
 import numbers
 import sys
 import traceback
+import base64
 
 from . import FSQTestCase, constants as _test_c
 from .internal import test_type_own_mode, normalize
 # FROM PAPA-BEAR IMPORT THE FOLLOWING
-from .. import enqueue, venqueue, senqueue, vsenqueue, install, deconstruct,\
+from .. import enqueue, venqueue, senqueue, vsenqueue, enqueue_many,\
+               senqueue_many, reenqueue, sreenqueue, FSQEnqueueItem,\
+               FSQWorkItem, install, deconstruct,\
                constants as _c, FSQPathError, FSQCoerceError,\
-               FSQEnqueueError, FSQEncodeError
+               FSQEnqueueError, FSQEncodeError, FSQReenqueueError, scan
+from ..remote import v1
 
 def _raise(signum, frame):
     raise IOError(errno.EAGAIN, 'Operation timed out')
@@ -722,3 +726,154 @@ class TestEnqueue(FSQTestCase):
         self.assertRaises(FSQCoerceError, senqueue, queue, _test_c.NON_ASCII,
                           [], charset='ascii')
         self._run_gammit(vsenqueue, 's', False)
+
+    def test_enqueue_many(self):
+        '''Test enqueue_many and senqueue_many, items are returned in order
+           and nothing is left in tmp'''
+        contents = _test_c.PAYLOAD
+        args = ( u'foo', _test_c.NON_ASCII, )
+        for fn, mkitem in ( ( enqueue_many, lambda: open(_test_c.FILE, 'r'), ),
+                            ( senqueue_many, lambda: contents, ), ):
+            queue = normalize()
+            install(queue)
+            items = fn(queue, ( ( mkitem(), args + ( i, ), )
+                                for i in range(10) ))
+            self.assertEquals(10, len(items))
+            for i, item in enumerate(items):
+                self._valid_enqueue(queue, item, contents,
+                                    args + ( unicode(i), ))
+            self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                          _c.FSQ_TMP)))
+            self.assertEquals([], fn(queue, []))
+
+    def test_badenqueue_many(self):
+        '''Test that a failed enqueue_many cleans up tmp'''
+        queue = normalize()
+        install(queue)
+        self.assertRaises(FSQEnqueueError, enqueue_many, queue,
+                          ( ( _test_c.FILE, [], ),
+                            ( _test_c.ILLEGAL_FD, [], ), ))
+        self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                      _c.FSQ_TMP)))
+        self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                      _c.FSQ_QUEUE)))
+
+    def test_enqueueitem(self):
+        '''Test streaming an item with FSQEnqueueItem, and that nothing is
+           visible in the queue until commit'''
+        queue = normalize()
+        install(queue)
+        args = ( u'foo', _test_c.NON_ASCII, )
+        queue_dir = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)
+        tmp_dir = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_TMP)
+        item = FSQEnqueueItem(queue, *args)
+        for c in _test_c.PAYLOAD:
+            item.write(c)
+        self.assertEquals([], os.listdir(queue_dir))
+        self.assertEquals([item.id], os.listdir(tmp_dir))
+        item_id = item.commit()
+        self._valid_enqueue(queue, item_id, _test_c.PAYLOAD, args)
+        self.assertEquals([], os.listdir(tmp_dir))
+
+        # abort, explicitly and by ref count
+        item = FSQEnqueueItem(queue, *args)
+        item.write(_test_c.PAYLOAD)
+        item.abort()
+        item = FSQEnqueueItem(queue, *args)
+        item.write(_test_c.PAYLOAD)
+        del item
+        self.assertEquals([item_id], os.listdir(queue_dir))
+        self.assertEquals([], os.listdir(tmp_dir))
+
+    def test_reenqueue(self):
+        '''Test copying an item and a string to many queues with reenqueue'''
+        queue, trg_queues = normalize(), [ normalize(), normalize(), ]
+        s_queue = normalize()
+        for q in [ queue, s_queue, ] + trg_queues:
+            install(q)
+        args = ( u'foo', _test_c.NON_ASCII, )
+        payload = _test_c.PAYLOAD * 4096
+        item_id = senqueue(queue, payload, *args)
+        item = FSQWorkItem(queue, item_id)
+        try:
+            self.assertEquals(item_id, reenqueue(item, *trg_queues))
+        finally:
+            item.close()
+        self.assertEquals(item_id, sreenqueue(item_id, payload, s_queue))
+        for q in [ s_queue, ] + trg_queues:
+            self._valid_enqueue(q, item_id, payload, args)
+            self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, q,
+                                                          _c.FSQ_TMP)))
+
+    def test_copybufsize(self):
+        '''Test enqueueing files and buffers with a small FSQ_COPY_BUFSIZE'''
+        queue = normalize()
+        install(queue)
+        orig = _c.FSQ_COPY_BUFSIZE
+        _c.FSQ_COPY_BUFSIZE = 3
+        try:
+            self._valid_enqueue(queue, enqueue(queue, _test_c.FILE, u'foo'),
+                                _test_c.PAYLOAD, ( u'foo', ))
+            self._valid_enqueue(queue, senqueue(queue, _test_c.PAYLOAD,
+                                u'bar'), _test_c.PAYLOAD, ( u'bar', ))
+        finally:
+            _c.FSQ_COPY_BUFSIZE = orig
+
+    def test_chunked(self):
+        '''Test that chunked remote enqueues link into the queue only on
+           commit, and only with every byte written'''
+        queue = normalize()
+        install(queue)
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        os.unlink(os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE, item_id))
+        tmp_dir = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_TMP)
+        queue_dir = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)
+        payload = _test_c.PAYLOAD
+        self.assertEquals(item_id, v1.enqueue_begin(item_id, queue))
+        offset = 0
+        for chunk in ( payload[:3], payload[3:], ):
+            offset = v1.enqueue_write(item_id, queue, offset,
+                                      base64.b64encode(chunk))
+        self.assertEquals([], os.listdir(queue_dir))
+        self.assertRaises(FSQReenqueueError, v1.enqueue_commit, item_id,
+                          queue, offset + 1)
+        self.assertEquals(item_id, v1.enqueue_commit(item_id, queue, offset))
+        self.assertEquals([], os.listdir(tmp_dir))
+        self._valid_enqueue(queue, item_id, payload, ())
+        self.assertRaises(FSQReenqueueError, v1.enqueue_write, item_id,
+                          queue, 0, base64.b64encode(payload))
+
+    def test_hostdist(self):
+        '''Test that reenqueueing to host queues on one file-system gives
+           each host queue its own copy, so that an item locked on one host
+           is still scanned on every other'''
+        queue, trg_queue = normalize(), normalize()
+        hosts = [ u'foo', u'bar', u'baz', ]
+        install(queue)
+        install(trg_queue, hosts=hosts)
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        item = FSQWorkItem(queue, item_id)
+        try:
+            self.assertEquals(item_id, reenqueue(item, trg_queue,
+                              all_hosts=True))
+        finally:
+            item.close()
+        inodes = set()
+        for host in hosts:
+            host_dir = os.path.join(_c.FSQ_ROOT, trg_queue, _c.FSQ_HOSTS,
+                                    host)
+            self.assertEquals([], os.listdir(os.path.join(host_dir,
+                                                          _c.FSQ_TMP)))
+            item_path = os.path.join(host_dir, _c.FSQ_QUEUE, item_id)
+            self.assertEquals(_test_c.PAYLOAD, open(item_path).read())
+            inodes.add(os.stat(item_path).st_ino)
+        self.assertEquals(len(hosts), len(inodes))
+        locked = FSQWorkItem(trg_queue, item_id, host=hosts[0])
+        try:
+            self.assertEquals([], [ i.id for i in scan(trg_queue,
+                              host=True, hosts=hosts[:1]) ])
+            for host in hosts[1:]:
+                self.assertEquals([ item_id, ], [ i.id for i in scan(
+                                  trg_queue, host=True, hosts=[ host, ]) ])
+        finally:
+            locked.close()
@@ -0,0 +1,71 @@
+from . import FSQTestCase
+from .internal import normalize
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, senqueue, scan, success, fail_tmp, FSQTimings,\
+               add_hook, remove_hook
+
+class TestInstrument(FSQTestCase):
+    def setUp(self):
+        super(TestInstrument, self).setUp()
+        self.calls = []
+        self.timings = FSQTimings()
+        add_hook(self.timings)
+        add_hook(self._hook)
+
+    def tearDown(self):
+        remove_hook(self.timings)
+        remove_hook(self._hook)
+        super(TestInstrument, self).tearDown()
+
+    def _hook(self, stage, queue, seconds):
+        self.calls.append(( stage, queue, ))
+        self.assertTrue(0 <= seconds)
+
+    def test_stages(self):
+        '''Test that each hot-path stage is reported, keyed by queue'''
+        queue = normalize()
+        install(queue)
+        senqueue(queue, 'foo')
+        senqueue(queue, 'bar')
+        items = list(scan(queue))
+        success(items[0])
+        fail_tmp(items[1], max_tries=2)
+        items = None
+        stages = [ u'enqueue.open', u'enqueue.write', u'enqueue.fsync',
+                   u'enqueue.link', u'scan.listdir', u'scan.sort',
+                   u'item.lock', u'item.parse', u'done.rename', ]
+        for stage in stages:
+            self.assertTrue(( stage, queue, ) in self.calls)
+        snap = self.timings.snapshot()
+        self.assertEquals(set(stages), set(s for s, q in snap))
+        self.assertEquals(2, snap[( u'enqueue.link', queue, )]['count'])
+        self.assertEquals(2, snap[( u'done.rename', queue, )]['count'])
+        self.assertEquals(1, snap[( u'scan.sort', queue, )]['count'])
+
+    def test_remove_hook(self):
+        '''Test that nothing is reported once hooks are removed'''
+        queue = normalize()
+        install(queue)
+        remove_hook(self._hook)
+        senqueue(queue, 'foo')
+        self.assertEquals([], self.calls)
+        # removing twice is harmless
+        remove_hook(self._hook)
+
+    def test_histogram(self):
+        '''Test bucketing, and prometheus text output'''
+        timings = FSQTimings(buckets=( 0.1, 1, ))
+        for seconds in ( 0.05, 0.1, 0.5, 5, ):
+            timings(u'scan.sort', u'a"b', seconds)
+        snap = timings.snapshot()[( u'scan.sort', u'a"b', )]
+        self.assertEquals(4, snap['count'])
+        self.assertEquals([ ( 0.1, 2, ), ( 1, 3, ), ( None, 4, ), ],
+                          snap['buckets'])
+        text = timings.prometheus()
+        self.assertTrue(u'# TYPE fsq_operation_seconds histogram' in text)
+        self.assertTrue(u'fsq_operation_seconds_bucket{stage="scan.sort",'\
+                        u'queue="a\\"b",le="+Inf"} 4' in text)
+        self.assertTrue(u'fsq_operation_seconds_count{stage="scan.sort",'\
+                        u'queue="a\\"b"} 4' in text)
+        timings.reset()
+        self.assertEquals({}, timings.snapshot())
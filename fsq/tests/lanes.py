@@ -0,0 +1,118 @@
+import os
+import time
+import errno
+import signal
+import threading
+
+from . import FSQTestCase, constants as _test_c
+from .internal import normalize
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, senqueue, senqueue_many, scan, scan_forever, success,\
+               fail_tmp, reclaim, FSQWatch, FSQWatchError, FSQPathError,\
+               constants as _c
+
+def _raise(signum, frame):
+    raise IOError(errno.EAGAIN, 'Operation timed out')
+
+class TestLanes(FSQTestCase):
+    def _lane(self, queue, priority):
+        return os.listdir(os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_LANES,
+                                       str(priority)))
+
+    def _scanned(self, queue, **kwargs):
+        return [ ( i.priority, i.id, ) for i in scan(queue, no_open=True,
+                                                      **kwargs) ]
+
+    def test_enqueue(self):
+        '''Test that items with a priority are linked into their lane, and
+           that priority 0 is the queue directory'''
+        queue = normalize()
+        install(queue)
+        urgent = senqueue(queue, _test_c.PAYLOAD, priority=5)
+        batch = senqueue_many(queue, [ ( _test_c.PAYLOAD, (), ), ] * 2,
+                              priority=u'-1')
+        bulk = senqueue(queue, _test_c.PAYLOAD, priority=0)
+        self.assertEquals([ urgent, ], self._lane(queue, 5))
+        self.assertEquals(sorted(batch), sorted(self._lane(queue, -1)))
+        self.assertEquals([ bulk, ], os.listdir(os.path.join(_c.FSQ_ROOT,
+                          queue, _c.FSQ_QUEUE)))
+        self.assertRaises(FSQPathError, senqueue, queue, _test_c.PAYLOAD,
+                          priority=u'high')
+        # sharded lanes are sharded as the queue is
+        queue = normalize()
+        install(queue, shards=u'hash:4')
+        senqueue(queue, _test_c.PAYLOAD, priority=2)
+        self.assertEquals(1, len(self._lane(queue, 2)))
+        self.assertEquals(1, len(os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                          _c.FSQ_LANES, u'2', self._lane(queue, 2)[0]))))
+
+    def test_order(self):
+        '''Test that lanes are drained highest priority first, or by
+           weighted fair share'''
+        queue = normalize()
+        install(queue, shards=u'time')
+        lanes = { 5: [], 0: [], -1: [], }
+        for priority in ( 0, 5, -1, 0, 5, 0, ):
+            lanes[priority].append(( priority, senqueue(queue,
+                                     _test_c.PAYLOAD, priority=priority), ))
+        urgent, bulk, low = [ sorted(lanes[p]) for p in ( 5, 0, -1, ) ]
+        self.assertEquals(urgent + bulk + low, self._scanned(queue))
+        self.assertEquals([ urgent[0], bulk[0], bulk[1], low[0], urgent[1],
+                            bulk[2], ], self._scanned(queue,
+                                                      weights={ 0: 2, }))
+        # lanes are listed along with given item ids
+        self.assertEquals(urgent + low, self._scanned(queue, item_ids=[]))
+        self.assertRaises(ValueError, scan, queue, weights={ 5: 0, })
+
+    def test_retry(self):
+        '''Test that retried and reclaimed items stay in their lane'''
+        queue = normalize()
+        install(queue)
+        item_ids = sorted([ senqueue(queue, _test_c.PAYLOAD, priority=3)
+                            for i in range(2) ])
+        items = list(scan(queue, max_tries=3))
+        self.assertEquals(item_ids, [ i.id for i in items ])
+        self.assertEquals(_test_c.PAYLOAD, items[0].item.read())
+        fail_tmp(items[0])
+        success(items[1])
+        items = None
+        items = list(scan(queue, max_tries=3, lease=60))
+        self.assertEquals([ ( 3, 1, ) ], [ ( i.priority, i.tries, )
+                                           for i in items ])
+        self.assertEquals([], self._lane(queue, 3))
+        items = None
+        reclaimed = reclaim(queue, now=time.time() + 120)
+        self.assertEquals(reclaimed, self._lane(queue, 3))
+        self.assertEquals([ ( 3, 2, ) ], [ ( i.priority, i.tries, )
+                          for i in scan(queue, max_tries=3, no_open=True) ])
+
+    def test_watch(self):
+        '''Test that scan_forever with watch yields items enqueued into
+           lanes, with no items enqueued into the queue directory'''
+        for shards in ( None, u'hash:4', ):
+            queue = normalize()
+            install(queue, shards=shards)
+            try:
+                FSQWatch(queue).close()
+            except FSQWatchError:
+                return
+            # no rescans, so only a watch can wake scan_forever
+            items = scan_forever(queue, watch=True, rescan=0)
+            signal.signal(signal.SIGALRM, _raise)
+            signal.alarm(10)
+            try:
+                # the lanes dir, a new lane, then an existing lane
+                for priority in ( 5, -1, 5, ):
+                    enqueue = threading.Timer(0.1, senqueue, ( queue,
+                                              _test_c.PAYLOAD, ),
+                                              { 'priority': priority, })
+                    enqueue.start()
+                    item = items.next()
+                    enqueue.join()
+                    self.assertEquals(priority, item.priority)
+                    success(item)
+            finally:
+                signal.alarm(0)
+                items.close()
+            self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                          _c.FSQ_QUEUE)))
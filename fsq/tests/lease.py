@@ -0,0 +1,115 @@
+import os
+import time
+
+from . import FSQTestCase, constants as _test_c
+from .internal import normalize
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, senqueue, scan, success, fail_tmp, fail_perm,\
+               renew, reclaim, FSQWorkItem, FSQLeaseError, FSQDoneError,\
+               constants as _c
+
+class TestLease(FSQTestCase):
+    def _claimed(self, queue):
+        try:
+            return os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                           _c.FSQ_CLAIMED))
+        except OSError:
+            return []
+
+    def test_claim(self):
+        '''Test that leased items are renamed out of the queue, and done'd
+           from the claimed directory'''
+        queue = normalize()
+        install(queue, shards=u'time:8')
+        item_ids = sorted([ senqueue(queue, _test_c.PAYLOAD)
+                            for i in range(3) ])
+        items = list(scan(queue, lease=60))
+        self.assertEquals(item_ids, [ i.id for i in items ])
+        for item in items:
+            self.assertEquals(_test_c.PAYLOAD, item.item.read())
+            self.assertEquals(u'{0}.{1}'.format(item.claimed.split(u'.')[0],
+                              item.id), item.claimed)
+            self.assertTrue(time.time() + 59 <= int(item.claimed.split(
+                            u'.')[0]))
+        self.assertEquals(sorted(i.claimed for i in items),
+                          sorted(self._claimed(queue)))
+        # claimed items are not scanned again, by lease or by lock
+        self.assertEquals([], list(scan(queue, lease=60)))
+        self.assertEquals([], list(scan(queue)))
+        success(items[0])
+        fail_perm(items[1])
+        retried = fail_tmp(items[2], max_tries=2)
+        self.assertEquals(None, items[2].claimed)
+        self.assertEquals([], self._claimed(queue))
+        q_path = os.path.join(_c.FSQ_ROOT, queue)
+        self.assertTrue(os.path.exists(os.path.join(q_path, _c.FSQ_DONE,
+                        item_ids[0][1:9], item_ids[0])))
+        self.assertTrue(os.path.exists(os.path.join(q_path, _c.FSQ_FAIL,
+                        item_ids[1][1:9], item_ids[1])))
+        self.assertEquals([ retried, ], [ i.id for i in scan(queue,
+                          max_tries=2) ])
+
+    def test_reclaim(self):
+        '''Test that lapsed leases are reclaimed as retries, and cannot be
+           renewed'''
+        queue = normalize()
+        install(queue)
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        item = list(scan(queue, lease=60))[0]
+        self.assertEquals([], reclaim(queue))
+        self.assertEquals([], reclaim(queue, now=time.time() + 30))
+        reclaimed = reclaim(queue, now=time.time() + 61)
+        self.assertEquals(1, len(reclaimed))
+        self.assertEquals(item_id[:-1] + u'1', reclaimed[0])
+        self.assertEquals([], self._claimed(queue))
+        self.assertRaises(FSQLeaseError, renew, item)
+        self.assertRaises(FSQDoneError, item.success)
+        # scanning with a lease reclaims, and the reclaimed item is a retry
+        items = list(scan(queue, lease=1, max_tries=2))
+        self.assertEquals(reclaimed, [ i.id for i in items ])
+        self.assertEquals(1, items[0].tries)
+
+    def test_renew(self):
+        '''Test that renewing a lease pushes out its expiry'''
+        queue = normalize()
+        install(queue)
+        senqueue(queue, _test_c.PAYLOAD)
+        item = list(scan(queue, lease=60))[0]
+        claimed = item.claimed
+        renewed = item.renew(600)
+        self.assertEquals(renewed, item.claimed)
+        self.assertNotEquals(claimed, renewed)
+        self.assertEquals([ item.claimed, ], self._claimed(queue))
+        self.assertEquals([], reclaim(queue, now=time.time() + 61))
+        # only leased items may be renewed
+        self.assertRaises(FSQLeaseError, renew, FSQWorkItem(queue,
+                          senqueue(queue, _test_c.PAYLOAD), no_open=True))
+        item.success()
+        self.assertEquals([], self._claimed(queue))
+
+    def test_offset(self):
+        '''Test that offsets rotate scans, and that consumers claiming with a
+           lease each win distinct items'''
+        queue = normalize()
+        install(queue)
+        items = sorted([ senqueue(queue, _test_c.PAYLOAD, i)
+                         for i in range(4) ])
+        self.assertEquals(items[2:] + items[:2], [ i.id for i in scan(queue,
+                          offset=0.5, no_open=True) ])
+        self.assertRaises(ValueError, scan, queue, offset=1)
+        # both consumers list every item, before either claims any
+        gens = [ scan(queue, lease=60, offset=offset)
+                 for offset in ( 0, 0.5, ) ]
+        won = [ [], [], ]
+        while gens[0] is not None or gens[1] is not None:
+            for i, gen in enumerate(gens):
+                try:
+                    if gen is not None:
+                        won[i].append(gen.next())
+                except StopIteration:
+                    gens[i] = None
+        self.assertEquals([ items[:2], items[2:], ], [ [ i.id for i in w ]
+                          for w in won ])
+        for item in won[0] + won[1]:
+            item.success()
+        self.assertEquals([], self._claimed(queue))
@@ -4,7 +4,8 @@ from .internal import normalize
 from . import constants as _test_c
 
 # FROM PAPA-BEAR IMPORT THE FOLLOWING
-from .. import path as _p, constants as _c, FSQPathError, FSQCoerceError
+from .. import path as _p, constants as _c, install, FSQPathError,\
+               FSQCoerceError
 
 ########## INTERNAL VALIDATION METHODS
 def _valid_path(*args):
@@ -99,3 +100,21 @@ class TestPath(FSQTestCase):
 
     def test_item(self):
         self._second_level_test(_p.item, 'FSQ_QUEUE', do_item=True)
+
+    def test_layout(self):
+        '''Test that item paths are sharded only given a layout, and that
+           failing to read a layout raises FSQPathError'''
+        queue = normalize()
+        self.assertEquals(None, _p.layout(queue))
+        install(queue, shards=u'hash:4')
+        p_layout = _p.layout(queue)
+        self.assertEquals(( u'hash', 4, ), p_layout)
+        item_id = u'_20120101000000_0_1_host_0'
+        self.assertEquals(_valid_path(queue, _c.FSQ_QUEUE, item_id),
+                          _p.item(queue, item_id))
+        self.assertEquals(_valid_path(queue, _c.FSQ_DONE, _p.shard(p_layout,
+                          item_id), item_id), _p.done_item(queue, item_id,
+                          layout=p_layout))
+        os.unlink(_p.shards(queue))
+        os.mkdir(_p.shards(queue))
+        self.assertRaises(FSQPathError, _p.layout, queue)
@@ -0,0 +1,83 @@
+import os
+import stat
+
+from . import FSQTestCase
+from .internal import normalize
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, RatelimitedIterator, TokenBucket, path as fsq_path
+
+class _Clock(object):
+    '''A clock which only moves when slept on'''
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept.append(secs)
+        self.now += secs
+
+class TestRatelimit(FSQTestCase):
+    def test_interval(self):
+        '''Test that the default burst of 1 spaces items evenly'''
+        clock = _Clock()
+        items = RatelimitedIterator(2, 1, iter(range(4)), clock_func=clock,
+                                    sleep_func=clock.sleep)
+        self.assertEquals(range(4), list(items))
+        self.assertEquals([ 0.5, 0.5, 0.5, ], clock.slept)
+
+    def test_burst(self):
+        '''Test that a full bucket yields burst items without delay'''
+        clock = _Clock()
+        bucket = TokenBucket(1, 1, burst=3, clock_func=clock,
+                             sleep_func=clock.sleep)
+        for i in range(3):
+            bucket.take()
+        self.assertEquals([], clock.slept)
+        bucket.take()
+        self.assertEquals([ 1.0, ], clock.slept)
+        # a long pause refills no more than burst
+        clock.now += 10
+        for i in range(4):
+            bucket.take()
+        self.assertEquals([ 1.0, 1.0, ], clock.slept)
+
+    def test_shared(self):
+        '''Test that buckets sharing a state file share one limit'''
+        queue = normalize()
+        install(queue)
+        clock = _Clock()
+        buckets = [ TokenBucket(1, 1, burst=2, clock_func=clock,
+                                sleep_func=clock.sleep,
+                                state_file=fsq_path.rate(queue))
+                    for i in range(2) ]
+        buckets[0].take()
+        buckets[1].take()
+        self.assertEquals([], clock.slept)
+        buckets[0].take()
+        self.assertEquals([ 1.0, ], clock.slept)
+        buckets[1].take()
+        self.assertEquals([ 1.0, 1.0, ], clock.slept)
+        for bucket in buckets:
+            bucket.close()
+
+    def test_statemode(self):
+        '''Test that state files are created with the mode given, and are
+           not world-writable by default'''
+        queue = normalize()
+        install(queue)
+        state_file = fsq_path.rate(queue)
+        umask = os.umask(0)
+        try:
+            TokenBucket(1, 1, state_file=state_file).close()
+            self.assertEquals(0600, stat.S_IMODE(os.stat(state_file).st_mode))
+            os.unlink(state_file)
+            TokenBucket(1, 1, state_file=state_file, mode=0640).close()
+            self.assertEquals(0640, stat.S_IMODE(os.stat(state_file).st_mode))
+            # an existing state file is shared as is
+            TokenBucket(1, 1, state_file=state_file, mode=0666).close()
+            self.assertEquals(0640, stat.S_IMODE(os.stat(state_file).st_mode))
+        finally:
+            os.umask(umask)
@@ -0,0 +1,87 @@
+import os
+import datetime
+import tarfile
+import tempfile
+import shutil
+
+from . import FSQTestCase, constants as _test_c
+from .internal import normalize
+# FROM PAPA-BEAR IMPORT THE FOLLOWING
+from .. import install, vsreenqueue, scan, success, fail_perm, construct,\
+               expire, FSQExpireError, constants as _c
+
+_NOW = datetime.datetime(2012, 6, 12)
+
+class TestRetention(FSQTestCase):
+    def _done(self, queue, days, fail=False):
+        '''Enqueue, then done or fail, items enqueued days before _NOW'''
+        item_ids = []
+        for i, day in enumerate(days):
+            item_id = construct(( (_NOW - datetime.timedelta(days=day))\
+                                  .strftime(_c.FSQ_TIMEFMT), unicode(i),
+                                  u'1', u'host', u'0', ))
+            vsreenqueue(item_id, _test_c.PAYLOAD, [ queue, ])
+            item_ids.append(item_id)
+        for item in scan(queue):
+            if fail:
+                fail_perm(item)
+            else:
+                success(item)
+        return sorted(item_ids)
+
+    def _ids(self, queue, d_name):
+        d_path = os.path.join(_c.FSQ_ROOT, queue, d_name)
+        return sorted(os.listdir(d_path))
+
+    def test_max_age(self):
+        '''Test that items are expired by the enqueue time in their names'''
+        queue = normalize()
+        install(queue)
+        done = self._done(queue, ( 10, 1, 5, ))
+        self.assertRaises(ValueError, expire, queue)
+        self.assertEquals(0, expire(queue, max_age=30*86400, now=_NOW))
+        # names, not mtimes, are what age an item
+        self.assertEquals(2, expire(queue, max_age=2*86400, now=_NOW))
+        self.assertEquals(done[2:], self._ids(queue, _c.FSQ_DONE))
+        self.assertEquals(0, expire(queue, max_age=2*86400, now=_NOW))
+
+    def test_max_count(self):
+        '''Test that all but the newest max_count items are expired, from
+           done and fail independently'''
+        queue = normalize()
+        install(queue)
+        done = self._done(queue, ( 3, 1, 2, 4, ))
+        failed = self._done(queue, ( 6, 5, ), fail=True)
+        self.assertEquals(1, expire(queue, max_count=3, fail=False))
+        self.assertEquals(done[1:], self._ids(queue, _c.FSQ_DONE))
+        self.assertEquals(failed, self._ids(queue, _c.FSQ_FAIL))
+        self.assertEquals(3, expire(queue, max_count=1))
+        self.assertEquals(done[3:], self._ids(queue, _c.FSQ_DONE))
+        self.assertEquals(failed[1:], self._ids(queue, _c.FSQ_FAIL))
+        self.assertRaises(FSQExpireError, expire, normalize(), max_count=0)
+
+    def test_archive(self):
+        '''Test that expired items are rolled into archive segments'''
+        queue = normalize()
+        install(queue, shards=u'time:8')
+        done = self._done(queue, ( 3, 2, 1, ))
+        archive_dir = tempfile.mkdtemp()
+        try:
+            self.assertEquals(2, expire(queue, max_age=36*3600,
+                                        archive_dir=archive_dir, now=_NOW))
+            segments = os.listdir(archive_dir)
+            self.assertEquals(1, len(segments))
+            self.assertTrue(segments[0].startswith(u'{0}.{1}.'.format(queue,
+                            _c.FSQ_DONE)))
+            self.assertTrue(segments[0].endswith(u'.0.tar.gz'))
+            with tarfile.open(os.path.join(archive_dir, segments[0])) as tar:
+                members = tar.getnames()
+                self.assertEquals(_test_c.PAYLOAD, tar.extractfile(
+                                  members[0]).read())
+            self.assertEquals(sorted(os.path.join(i[1:9], i)
+                                     for i in done[:2]), sorted(members))
+            # emptied shards are removed
+            self.assertEquals([ done[2][1:9], ], self._ids(queue,
+                              _c.FSQ_DONE))
+        finally:
+            shutil.rmtree(archive_dir)
@@ -9,6 +9,12 @@ from .encode import TestEncodeDecode
 from .construct import TestConstruct
 from .enqueue import TestEnqueue
 from .scan import TestScan
+from .ratelimit import TestRatelimit
+from .instrument import TestInstrument
+from .retention import TestRetention
+from .lease import TestLease
+from .lanes import TestLanes
+from .utility import TestUtility
 from . import constants as _test_c
 
 ############ INTERNAL HELPERS
@@ -56,6 +62,30 @@ def run_scan():
     scan_tests = _LOADER.loadTestsFromTestCase(TestScan)
     return _RUNNER.run(scan_tests)
 
+def run_ratelimit():
+    ratelimit_tests = _LOADER.loadTestsFromTestCase(TestRatelimit)
+    return _RUNNER.run(ratelimit_tests)
+
+def run_instrument():
+    instrument_tests = _LOADER.loadTestsFromTestCase(TestInstrument)
+    return _RUNNER.run(instrument_tests)
+
+def run_retention():
+    retention_tests = _LOADER.loadTestsFromTestCase(TestRetention)
+    return _RUNNER.run(retention_tests)
+
+def run_lease():
+    lease_tests = _LOADER.loadTestsFromTestCase(TestLease)
+    return _RUNNER.run(lease_tests)
+
+def run_lanes():
+    lanes_tests = _LOADER.loadTestsFromTestCase(TestLanes)
+    return _RUNNER.run(lanes_tests)
+
+def run_utility():
+    utility_tests = _LOADER.loadTestsFromTestCase(TestUtility)
+    return _RUNNER.run(utility_tests)
+
 def run_all():
     failures = errors = 0
     failures, errors = _extract(run_paths(), errors, failures)
@@ -67,6 +97,12 @@ def run_all():
     failures, errors = _extract(run_construct(), errors, failures)
     failures, errors = _extract(run_enqueue(), errors, failures)
     failures, errors = _extract(run_scan(), errors, failures)
+    failures, errors = _extract(run_ratelimit(), errors, failures)
+    failures, errors = _extract(run_instrument(), errors, failures)
+    failures, errors = _extract(run_retention(), errors, failures)
+    failures, errors = _extract(run_lease(), errors, failures)
+    failures, errors = _extract(run_lanes(), errors, failures)
+    failures, errors = _extract(run_utility(), errors, failures)
     print >> sys.stderr, "Total Tests Run: {0}".format(_test_c.TOTAL_COUNT)
     print >> sys.stderr, "Total Failures: {0}, Total Errors:"\
                          " {1}".format(failures, errors)
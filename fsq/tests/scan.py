@@ -1,17 +1,360 @@
-#import os
+import os
+import fcntl
+import errno
+import signal
+import threading
+import sys
 #import socket
-#import errno
-#import signal
 #import numbers
 #import sys
 #import traceback
 
-from . import FSQTestCase # , constants as _test_c
-#from .internal import test_type_own_mode, normalize
+from . import FSQTestCase, constants as _test_c
+from .internal import normalize
 # FROM PAPA-BEAR IMPORT THE FOLLOWING
-#from .. import enqueue, venqueue, senqueue, vsenqueue, install, deconstruct,\
-#               constants as _c, FSQPathError, FSQCoerceError,\
-#               FSQEnqueueError, FSQEncodeError
+from .. import install, senqueue, scan, scan_forever, success, fail_tmp,\
+               construct, down, up, success_many, fail_many, FSQWatch,\
+               FSQWatchError, FSQScanCursor, FSQWorkItem, FSQDownError,\
+               FSQInstallError, FSQFailError, vsreenqueue, uninstall,\
+               constants as _c
+from ..internal import shard_op
+
+def _raise(signum, frame):
+    raise IOError(errno.EAGAIN, 'Operation timed out')
 
 class TestScan(FSQTestCase):
-   pass
+    def test_itemids(self):
+        '''Test that scan with item_ids only scans those items, in order'''
+        queue = normalize()
+        install(queue)
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(3) ]
+        self.assertEquals(items, [ i.id for i in scan(queue) ])
+        self.assertEquals(items[:2], [ i.id for i in scan(queue,
+                          item_ids=reversed(items[:2])) ])
+
+    def test_watch(self):
+        '''Test that scan_forever with watch yields newly enqueued items
+           without a trigger'''
+        queue = normalize()
+        install(queue)
+        try:
+            FSQWatch(queue).close()
+        except FSQWatchError:
+            # no inotify here, scan_forever would fall back to the trigger
+            return
+        first = senqueue(queue, _test_c.PAYLOAD)
+        items = scan_forever(queue, watch=True)
+        item = items.next()
+        self.assertEquals(first, item.id)
+        success(item)
+        second = senqueue(queue, _test_c.PAYLOAD)
+        item = items.next()
+        self.assertEquals(second, item.id)
+        success(item)
+        items.close()
+        self.assertEquals([], os.listdir(os.path.join(_c.FSQ_ROOT, queue,
+                                                      _c.FSQ_QUEUE)))
+
+    def test_watchrescan(self):
+        '''Test that scan_forever with watch rescans the queue, retrying
+           items that were locked by another process on the last pass'''
+        queue = normalize()
+        install(queue)
+        try:
+            FSQWatch(queue).close()
+        except FSQWatchError:
+            return
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        fd = os.open(os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE, item_id),
+                     os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self.assertEquals([], list(scan(queue)))
+        # unlock while scan_forever waits, with no events to wake it
+        unlock = threading.Timer(0.2, os.close, ( fd, ))
+        unlock.start()
+        items = scan_forever(queue, watch=True, rescan=1)
+        signal.signal(signal.SIGALRM, _raise)
+        signal.alarm(10)
+        try:
+            item = items.next()
+            self.assertEquals(item_id, item.id)
+            success(item)
+        finally:
+            signal.alarm(0)
+            unlock.join()
+            items.close()
+
+    def test_cursor(self):
+        '''Test that scans with a cursor yield only new, retried or
+           previously locked items'''
+        queue = normalize()
+        install(queue)
+        cursor = FSQScanCursor()
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(3) ]
+        self.assertEquals(items, [ i.id for i in scan(queue, cursor=cursor,
+                                                      max_tries=2) ])
+        # nothing new
+        self.assertEquals([], [ i.id for i in scan(queue, cursor=cursor, max_tries=2) ])
+        # new and retried items
+        new = senqueue(queue, _test_c.PAYLOAD, 3)
+        retried = fail_tmp(FSQWorkItem(queue, items[0], max_tries=2))
+        self.assertEquals(sorted([ new, retried, ]),
+                          [ i.id for i in scan(queue, cursor=cursor, max_tries=2) ])
+        # locked items are tried again on the next pass
+        locked = FSQWorkItem(queue, items[1], lock=True)
+        cursor = FSQScanCursor()
+        self.assertEquals(sorted([ items[2], new, retried, ]),
+                          [ i.id for i in scan(queue, cursor=cursor,
+                                               lock=True, max_tries=2) ])
+        del locked
+        self.assertEquals([ items[1] ], [ i.id for i in scan(queue,
+                          cursor=cursor, lock=True, max_tries=2) ])
+
+    def test_cursorabandoned(self):
+        '''Test that ids not reached by an abandoned pass are yielded by the
+           next pass with the same cursor'''
+        queue = normalize()
+        install(queue)
+        cursor = FSQScanCursor()
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(3) ]
+        # an mtime old enough to be trusted by the cursor
+        q_path = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)
+        old = os.stat(q_path).st_mtime - 10
+        os.utime(q_path, ( old, old, ))
+        gen = scan(queue, cursor=cursor, max_tries=2)
+        self.assertEquals(items[0], gen.next().id)
+        del gen
+        self.assertEquals(items[1:], [ i.id for i in scan(queue,
+                          cursor=cursor, max_tries=2) ])
+        self.assertEquals([], [ i.id for i in scan(queue, cursor=cursor,
+                                                   max_tries=2) ])
+
+    def test_unsorted(self):
+        '''Test that unsorted scans yield every item, lazily'''
+        queue = normalize()
+        install(queue)
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(3) ]
+        self.assertEquals(sorted(items), sorted([ i.id for i in scan(queue,
+                          sort=False) ]))
+        gen = scan(queue, sort=False)
+        first = gen.next()
+        self.assertTrue(first.id in items)
+        success(first)
+        self.assertEquals(2, len([ i for i in gen ]))
+
+    def test_workitem(self):
+        '''Test that lazily computed work item attributes match the item id'''
+        queue = normalize()
+        install(queue)
+        item_id = senqueue(queue, _test_c.PAYLOAD, *_test_c.NORMAL)
+        item = scan(queue).next()
+        self.assertEquals(tuple(_test_c.NORMAL), item.arguments)
+        self.assertEquals(item_id, construct(( item.enqueued_at.strftime(
+                          _c.FSQ_TIMEFMT), item.entropy, item.pid,
+                          item.hostname, item.tries, ) + item.arguments))
+
+    def test_down(self):
+        '''Test that down-files are re-checked every down_every items, and
+           ignored with ignore_down'''
+        queue = normalize()
+        install(queue)
+        # ids sort lexically, so entropy 10 sorts before 9
+        items = sorted([ senqueue(queue, _test_c.PAYLOAD, i)
+                         for i in range(3) ])
+        for down_every, yielded in (( None, 1, ), ( 2, 2, ), ( 0, 3, ), ):
+            gen = scan(queue, down_every=down_every)
+            self.assertEquals(items[0], gen.next().id)
+            down(queue)
+            got = 1
+            try:
+                for item in gen:
+                    got += 1
+                self.assertEquals(0, down_every)
+            except FSQDownError:
+                pass
+            # release our lock on the last item
+            item = None
+            self.assertEquals(yielded, got)
+            self.assertEquals(items, [ i.id for i in scan(queue,
+                              ignore_down=True, no_open=True) ])
+            up(queue)
+
+    def test_many(self):
+        '''Test that success_many and fail_many finish every item'''
+        queue = normalize()
+        install(queue)
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(4) ]
+        scanned = list(scan(queue, no_open=True))
+        self.assertEquals(items[:2], success_many(scanned[:2]))
+        self.assertEquals(items[2:], fail_many(scanned[2:]))
+        for trg, against in (( _c.FSQ_QUEUE, [], ),
+                             ( _c.FSQ_DONE, items[:2], ),
+                             ( _c.FSQ_FAIL, items[2:], ), ):
+            self.assertEquals(against, sorted(os.listdir(os.path.join(
+                              _c.FSQ_ROOT, queue, trg))))
+
+    def test_manytmp(self):
+        '''Test that fail_many retries every item, and fsyncs the directories
+           leased items are retried into'''
+        queue = normalize()
+        install(queue)
+        for i in range(3):
+            senqueue(queue, _test_c.PAYLOAD, i)
+        # fsq.done the module, not fsq.done the function
+        _done = sys.modules['fsq.done']
+        fsync_dirs = _done._fsync_dirs
+        synced = []
+        _done._fsync_dirs = lambda dirs, exc: synced.extend(dirs)
+        try:
+            leased = list(scan(queue, lease=60))
+            self.assertEquals(3, len([ i for i in leased if i.claimed ]))
+            retried = fail_many(leased, fail_type=_c.FSQ_FAIL_TMP,
+                                max_tries=3)
+        finally:
+            _done._fsync_dirs = fsync_dirs
+        q_path = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)
+        self.assertEquals(retried, sorted(os.listdir(q_path)))
+        self.assertTrue(os.path.abspath(q_path) in
+                        [ os.path.abspath(d) for d in synced ])
+        rescanned = list(scan(queue, max_tries=3, no_open=True))
+        self.assertEquals(retried, [ i.id for i in rescanned ])
+        self.assertEquals([ ( 1, unicode(i), ) for i in range(3) ],
+                          [ ( i.tries, i.arguments[0], ) for i in rescanned ])
+
+    def test_manyescalate(self):
+        '''Test that fail_many fails every item, when temporary failures are
+           escalated, and raises once for all of them'''
+        queue = normalize()
+        install(queue)
+        items = [ senqueue(queue, _test_c.PAYLOAD, i) for i in range(3) ]
+        scanned = list(scan(queue, no_open=True))
+        try:
+            fail_many(scanned, fail_type=_c.FSQ_FAIL_TMP)
+            self.fail('fail_many did not raise on escalation')
+        except FSQFailError, e:
+            self.assertEquals(items, e.failed)
+            self.assertEquals([], e.item_ids)
+        for trg, against in (( _c.FSQ_QUEUE, [], ),
+                             ( _c.FSQ_FAIL, items, ), ):
+            self.assertEquals(against, sorted(os.listdir(os.path.join(
+                              _c.FSQ_ROOT, queue, trg))))
+
+    def test_sharded(self):
+        '''Test that sharded queues spread items across shards, and scan
+           them in order'''
+        queue = normalize()
+        self.assertRaises(FSQInstallError, install, queue, shards=u'hash:0')
+        self.assertRaises(FSQInstallError, install, queue, shards=u'foo')
+        install(queue, shards=u'time:4')
+        q_path = os.path.join(_c.FSQ_ROOT, queue)
+        with open(os.path.join(q_path, _c.FSQ_SHARDS)) as f:
+            self.assertEquals('time:4\n', f.read())
+        items = [ construct(( u'{0}0101000000'.format(year), u'0', u'1',
+                              u'host', u'0', )) for year in ( 2012, 2010,
+                                                              2011, ) ]
+        for item_id in items:
+            vsreenqueue(item_id, _test_c.PAYLOAD, [ queue, ])
+        items.sort()
+        self.assertEquals([ u'2010', u'2011', u'2012', ], sorted(os.listdir(
+                          os.path.join(q_path, _c.FSQ_QUEUE))))
+        for sort in ( True, False, ):
+            self.assertEquals(items, [ i.id for i in scan(queue, sort=sort,
+                                                          no_open=True) ])
+        cursor = FSQScanCursor()
+        self.assertEquals(items, [ i.id for i in scan(queue, cursor=cursor,
+                                                      no_open=True) ])
+        self.assertEquals([], [ i.id for i in scan(queue, cursor=cursor,
+                                                   no_open=True) ])
+        new = senqueue(queue, _test_c.PAYLOAD)
+        self.assertEquals([ new, ], [ i.id for i in scan(queue,
+                          cursor=cursor, no_open=True) ])
+        # done and fail are sharded too, retries stay in their shard
+        success(FSQWorkItem(queue, items[0], no_open=True))
+        retried = fail_tmp(FSQWorkItem(queue, items[1], no_open=True),
+                           max_tries=2)
+        self.assertTrue(os.path.exists(os.path.join(q_path, _c.FSQ_DONE,
+                                                    u'2010', items[0])))
+        self.assertTrue(os.path.exists(os.path.join(q_path, _c.FSQ_QUEUE,
+                                                    u'2011', retried)))
+        # empty shards, but the last, are pruned as they are scanned
+        self.assertEquals([ retried, items[2], new, ], [ i.id for i in
+                          scan(queue, no_open=True, max_tries=2) ])
+        self.assertFalse(os.path.exists(os.path.join(q_path, _c.FSQ_QUEUE,
+                                                     u'2010')))
+        self.assertEquals([ retried, items[2], new, ], fail_many(
+                          list(scan(queue, no_open=True, max_tries=2))))
+        self.assertEquals(3, len(os.listdir(os.path.join(q_path,
+                                                         _c.FSQ_FAIL))))
+
+    def test_reinstall(self):
+        '''Test that a queue re-installed by another process with another
+           shard layout is enqueued to, scanned and done in its new
+           layout'''
+        queue = normalize()
+        install(queue, shards=u'time:4')
+        cursor = FSQScanCursor()
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        self.assertEquals([ item_id, ], [ i.id for i in scan(queue,
+                          cursor=cursor, no_open=True) ])
+        pid = os.fork()
+        if not pid:
+            try:
+                uninstall(queue)
+                install(queue)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        q_path = os.path.join(_c.FSQ_ROOT, queue)
+        self.assertEquals([ item_id, ], os.listdir(os.path.join(q_path,
+                          _c.FSQ_QUEUE)))
+        for item in scan(queue, cursor=cursor):
+            self.assertEquals(item_id, item.id)
+            item.success()
+        self.assertEquals([ item_id, ], os.listdir(os.path.join(q_path,
+                          _c.FSQ_DONE)))
+
+    def test_shardrace(self):
+        '''Test that linking into a shard made by another process, after
+           the link failed, is retried rather than failed'''
+        queue = normalize()
+        install(queue, shards=u'time:10')
+        item_id = senqueue(queue, _test_c.PAYLOAD)
+        q_path = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE)
+        src = os.path.join(q_path, item_id[1:11], item_id)
+        trg = os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_DONE, item_id[1:11],
+                           item_id)
+        def link(src, trg):
+            if not os.path.exists(os.path.dirname(trg)):
+                # another producer makes the shard first
+                os.mkdir(os.path.dirname(trg))
+                raise OSError(errno.ENOENT, os.strerror(errno.ENOENT))
+            return os.link(src, trg)
+        shard_op(link, src, trg)
+        self.assertTrue(os.path.exists(trg))
+        # with the shard there, a missing src is still an error
+        try:
+            shard_op(os.link, src + u'_', trg + u'_')
+        except OSError, e:
+            self.assertEquals(errno.ENOENT, e.errno)
+        else:
+            self.fail('linked a missing src')
+
+    def test_hashsharded(self):
+        '''Test hash sharded queues, and watching new shards'''
+        queue = normalize()
+        install(queue, shards=u'hash:4')
+        try:
+            watch = FSQWatch(queue)
+        except FSQWatchError:
+            watch = None
+        items = sorted(senqueue(queue, _test_c.PAYLOAD, i) for i in range(16))
+        shards = os.listdir(os.path.join(_c.FSQ_ROOT, queue, _c.FSQ_QUEUE))
+        self.assertTrue(1 < len(shards))
+        self.assertEquals([], list(set(shards) - set(u'0123')))
+        self.assertEquals(items, [ i.id for i in scan(queue, no_open=True) ])
+        self.assertEquals(items, sorted([ i.id for i in scan(queue,
+                          sort=False, no_open=True) ]))
+        if watch is not None:
+            self.assertEquals(items, sorted(watch.wait()))
+            watch.close()